@@ -1,266 +1,519 @@
+import importlib.util
+import os
 import warnings
+from contextlib import nullcontext
 import pandas as pd
-import os
-import plotly.express as px
 import plotly.graph_objects as go # Cần cho biểu đồ rỗng
 import dash
 from dash import dcc, html, Input, Output, State, no_update
-import calendar
+from flask import jsonify
+import sys
+from pathlib import Path
+
+# Thêm thư mục gốc dự án vào sys.path để import được package src khi chạy trực tiếp file này
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from src.config import (
+    DASH_COMPRESS, DASH_JOB_DIR, DOWNSAMPLE_POINTS, GRAPH_CACHE_MB, JOB_POLL_MS, MAX_BACKGROUND_JOBS,
+    SANLUONG_STORE_DIR
+)
+from src.dataset import DuckDBStore, ResolutionPyramid, SanluongStore, load_rollups, select_backend
+from src.features import SLOT_LABELS, day_slot_matrix, timeslot_stats
+from src.plots import downsample_frame, line_traces, patch_figure
+from src.services.api import create_api
+from src.services.cache import LRUCache, estimate_nbytes
+from src.services.jobs import JobSlots
+from src.services.loader import BackgroundLoader
 
 # Bỏ qua (ignore) các cảnh báo loại PerformanceWarning từ Pandas
 warnings.filterwarnings('ignore', category=pd.errors.PerformanceWarning)
 
-# ==================== 1. ĐỌC VÀ XỬ LÝ DỮ LIỆU (Thực hiện một lần khi khởi chạy) ====================
-print("🔄 Bắt đầu đọc và xử lý dữ liệu...")
-parquet_folder = r"C:\Khue\TDN\data\processed" # <-- Đảm bảo đường dẫn này chính xác
-df_sanluong = pd.DataFrame() # Khởi tạo DataFrame rỗng
+# ==================== 1. NẠP DỮ LIỆU NỀN (server phục vụ ngay, dữ liệu đến dần) ====================
+# Các biến dưới đây được luồng nạp nền gán lại khi từng phần dữ liệu sẵn sàng; callback đọc
+# chúng tại thời điểm gọi nên tự thấy dữ liệu mới
+store = None # Kho sản lượng: SanluongStore (mmap) hoặc DuckDBStore (ngoài bộ nhớ); None khi chưa nạp / lỗi
+store_backend = None # 'memory' | 'duckdb', chọn lúc khởi động theo ngân sách bộ nhớ (TDN_BACKEND, TDN_MEMORY_BUDGET_MB)
+data_ready = False
+ALL_NMTD = '__ALL__' # Giá trị "Tất cả nhà máy" -> dùng bảng tổng hợp theo công ty
+rollups = {} # tên bảng -> {(CTDL, NMTD, YEAR) hoặc (CTDL, YEAR): các dòng tháng đã sắp theo MONTH}
+PYRAMID_LEVEL_LABELS = {'30min': "chu kỳ 30'", '2h': '2 giờ', '1d': 'ngày', '1w': 'tuần'}
+pyramid = None
+range_min_date, range_max_date = None, None
+
+
+def publish_store(new_store, label):
+    """Đưa kho mới vào phục vụ (thay kho cũ); cache biểu đồ tự hết hạn theo fingerprint."""
+    global store, data_ready
+    if new_store is None or new_store.empty:
+        print(f"⚠️ Không có dữ liệu trong kho sản lượng ({label}): {SANLUONG_STORE_DIR}")
+        return
+    store, data_ready = new_store, True
+    print(f"   📊 Kho {store.backend} ({label}): {len(store):,} dòng, {store.nbytes / (1024**2):.2f} MB trong RAM, năm {store.years}")
 
-try:
-    all_files_in_folder = os.listdir(parquet_folder)
-    parquet_files = [os.path.join(parquet_folder, f)
-                     for f in all_files_in_folder
-                     if f.startswith("sanluong_") and f.endswith(".parquet")]
 
-    if not parquet_files:
-        print(f"⚠️ Không tìm thấy file nào khớp mẫu 'sanluong_*.parquet' trong thư mục: {parquet_folder}")
+def load_first_store():
+    """Kho khớp dữ liệu hiện tại mở ngay (mmap). Nếu phải dựng lại: phục vụ trước kho cũ, hoặc
+    kho chỉ gồm năm mới nhất (dựng nhanh), trong lúc dựng kho đầy đủ ở bước sau. Dữ liệu vượt
+    ngân sách bộ nhớ thì phục vụ bằng DuckDB đọc thẳng kho Parquet, không dựng kho trong RAM."""
+    global store_backend
+    store_backend = select_backend()
+    if store_backend == 'duckdb':
+        publish_store(DuckDBStore.open(), 'ngoài bộ nhớ')
+        return
+    if SanluongStore.is_current():
+        publish_store(SanluongStore.open(), 'đầy đủ')
+        return
+    try:
+        publish_store(SanluongStore.open(rebuild=False), 'bản cũ')
+    except FileNotFoundError:
+        publish_store(SanluongStore.open_latest(), 'năm mới nhất')
+
+
+def load_full_store():
+    # Kho cột mmap chỉ đọc (mã category, TIME, CS float32, khóa sắp xếp KEY): mọi worker WSGI mở
+    # cùng các file .npy nên chỉ có một bản trong page cache; dựng lại khi dữ liệu sản lượng thay đổi
+    if store_backend == 'duckdb':
+        return
+    if store is None or store.fingerprint != SanluongStore.fingerprint_of():
+        publish_store(SanluongStore.open(), 'đầy đủ')
+
+
+def load_rollup_tables():
+    # Bảng tổng hợp tháng dựng sẵn (vài KB), dùng cho tab xem theo năm
+    # Tách sẵn theo (CTDL[, NMTD], YEAR) một lần lúc nạp: mỗi lần chọn chỉ là tra dict, không lọc cả bảng
+    global rollups
+    tables = load_rollups(['monthly_plant', 'monthly_company'])
+    if tables:
+        print(f"   📊 Bảng tổng hợp: {', '.join(f'{k} ({len(v):,} dòng)' for k, v in tables.items())}")
     else:
-        df_list = []
-        for f in parquet_files:
-            try:
-                df_list.append(pd.read_parquet(f, engine='pyarrow'))
-            except Exception as e:
-                print(f"❌ Lỗi khi đọc file {f}: {e}")
-
-        if df_list:
-            df_all = pd.concat(df_list, ignore_index=True)
-            print(f"✅ Đã đọc xong {len(parquet_files)} file parquet. Tổng số dòng ban đầu: {df_all.shape[0]:,}")
-
-            # --- Xử lý df_sanluong ---
-            required_cols = ['CTDL', 'NMTD', 'MADIEMDO', 'ENDTIME', 'CS']
-            if all(col in df_all.columns for col in required_cols):
-                df_sanluong = df_all[required_cols].copy()
-                df_sanluong.rename(columns={'ENDTIME': 'TIME'}, inplace=True)
-
-                # ++++++++++++++++ TỐI ƯU HÓA KIỂU DỮ LIỆU (BẮT ĐẦU) ++++++++++++++++
-                if not df_sanluong.empty:
-                    print("🔄 Tối ưu hóa kiểu dữ liệu DataFrame...")
-                    mem_usage_before_opt = df_sanluong.memory_usage(deep=True).sum() / (1024**2)
-                    print(f"   📊 Bộ nhớ sử dụng TRƯỚC khi tối ưu: {mem_usage_before_opt:.2f} MB")
-
-                    # Chuyển đổi các cột ID/chuỗi lặp lại thành 'category'
-                    for col in ['CTDL', 'NMTD', 'MADIEMDO']:
-                        if col in df_sanluong.columns:
-                            try:
-                                df_sanluong[col] = df_sanluong[col].astype('category')
-                                print(f"   ✅ Đã chuyển cột '{col}' sang kiểu 'category'.")
-                            except Exception as e:
-                                print(f"   ⚠️ Không thể chuyển cột '{col}' sang category: {e}")
-
-                    # Chuyển đổi cột số công suất sang float32 nếu có thể
-                    if 'CS' in df_sanluong.columns:
-                        try:
-                            df_sanluong['CS'] = pd.to_numeric(df_sanluong['CS'], errors='coerce') # Đảm bảo là số
-                            # Chỉ downcast nếu không mất mát lớn (kiểm tra min/max nếu cần)
-                            df_sanluong['CS'] = df_sanluong['CS'].astype('float32')
-                            print("   ✅ Đã chuyển cột 'CS' sang kiểu 'float32'.")
-                        except Exception as e:
-                            print(f"   ⚠️ Không thể chuyển cột 'CS' sang float32: {e}")
-
-                    mem_usage_after_opt = df_sanluong.memory_usage(deep=True).sum() / (1024**2)
-                    print(f"   📊 Bộ nhớ sử dụng SAU khi tối ưu kiểu dữ liệu cơ bản: {mem_usage_after_opt:.2f} MB")
-                # ++++++++++++++++ TỐI ƯU HÓA KIỂU DỮ LIỆU (KẾT THÚC) ++++++++++++++++
-
-
-                # --- Tiếp tục xử lý thời gian và index ---
-                print("🔄 Xử lý thời gian và tối ưu DataFrame...")
-                try:
-                    df_sanluong['TIME'] = pd.to_datetime(df_sanluong['TIME'])
-
-                    # TẠO và TỐI ƯU kiểu dữ liệu cột thời gian NGAY LẬP TỨC
-                    df_sanluong['YEAR'] = df_sanluong['TIME'].dt.year.astype('int16') # Năm thường đủ int16
-                    df_sanluong['MONTH_NUM'] = df_sanluong['TIME'].dt.month.astype('int8') # Tháng đủ int8
-                    df_sanluong['DAY_NUM'] = df_sanluong['TIME'].dt.day.astype('int8')    # Ngày đủ int8
-                    print("   ✅ Đã tạo và tối ưu kiểu dữ liệu cột YEAR, MONTH_NUM, DAY_NUM.")
-
-                    mem_usage_after_time = df_sanluong.memory_usage(deep=True).sum() / (1024**2)
-                    print(f"   📊 Bộ nhớ sử dụng sau khi thêm cột thời gian tối ưu: {mem_usage_after_time:.2f} MB")
-
-
-                    # --- Tiếp tục đặt index và sắp xếp ---
-                    index_cols = ['CTDL', 'NMTD', 'YEAR', 'MONTH_NUM', 'DAY_NUM']
-                    if all(col in df_sanluong.columns for col in index_cols):
-                        print("   ⏳ Bắt đầu đặt index...")
-                        df_sanluong.set_index(index_cols, inplace=True)
-                        print("   ⏳ Bắt đầu sắp xếp index (có thể mất thời gian và bộ nhớ)...")
-                        df_sanluong.sort_index(inplace=True) # Đây vẫn là bước tốn kém nhất
-                        print("✅ Đã xử lý thời gian và tối ưu index DataFrame.")
-                        mem_usage_final = df_sanluong.memory_usage(deep=True).sum() / (1024**2)
-                        print(f"   📊 Bộ nhớ sử dụng cuối cùng: {mem_usage_final:.2f} MB")
-                    else:
-                        print("❌ Thiếu cột cần thiết để tạo index tối ưu.")
-                        missing_idx_cols = [col for col in index_cols if col not in df_sanluong.columns]
-                        print(f"   -> Các cột index bị thiếu: {missing_idx_cols}")
-                        df_sanluong = pd.DataFrame() # Đặt lại thành rỗng nếu lỗi
-                except Exception as e: # Bắt cả MemoryError và các lỗi khác
-                    print(f"❌ Lỗi khi xử lý thời gian hoặc đặt index: {e}")
-                    df_sanluong = pd.DataFrame() # Đặt lại thành rỗng nếu lỗi
-            else:
-                print(f"❌ Thiếu cột cần thiết trong dữ liệu ban đầu. Cần có: {required_cols}")
-                df_sanluong = pd.DataFrame()
-        else:
-            print("❌ Không đọc được file nào thành công.")
+        print("⚠️ Chưa có bảng tổng hợp (chạy 'python -m src.dataset rollups')")
+    rollups = {
+        name: {
+            key: group[['MONTH', 'SUM', 'MEAN', 'MIN', 'MAX', 'COUNT']].sort_values('MONTH')
+            for key, group in cube.groupby(['CTDL', 'NMTD', 'YEAR'] if 'NMTD' in cube else ['CTDL', 'YEAR'], observed=True)
+        }
+        for name, cube in tables.items()
+    }
 
-except FileNotFoundError:
-    print(f"❌ Lỗi: Không tìm thấy thư mục: {parquet_folder}")
-    df_sanluong = pd.DataFrame() # Đảm bảo df_sanluong rỗng nếu lỗi
-except Exception as e:
-    print(f"❌ Lỗi không xác định khi truy cập thư mục hoặc file: {e}")
-    df_sanluong = pd.DataFrame() # Đảm bảo df_sanluong rỗng nếu lỗi
 
+def load_pyramid():
+    # Kim tự tháp đa độ phân giải (30', 2 giờ, ngày, tuần) cho tab khoảng thời gian tự do
+    global pyramid, range_min_date, range_max_date
+    opened = ResolutionPyramid.open()
+    first_day, end_day = opened.span
+    if end_day > first_day:
+        range_min_date, range_max_date = str(first_day), str(end_day - 1)
+    pyramid = opened
 
-# --- Lấy danh sách ban đầu cho dropdowns (nếu df_sanluong tồn tại và không rỗng) ---
-initial_ctdl_options = []
-initial_year_options = []
-if not df_sanluong.empty: # Kiểm tra lại df_sanluong sau xử lý
-    try:
-        # Kiểm tra xem index có tồn tại không trước khi truy cập
-        if isinstance(df_sanluong.index, pd.MultiIndex):
-             if 'CTDL' in df_sanluong.index.names:
-                 initial_ctdl_options = [{'label': c, 'value': c} for c in sorted(df_sanluong.index.get_level_values('CTDL').unique())]
-             if 'YEAR' in df_sanluong.index.names:
-                 initial_year_options = [{'label': y, 'value': y} for y in sorted(df_sanluong.index.get_level_values('YEAR').unique())]
-        else:
-             print("⚠️ DataFrame không có MultiIndex như mong đợi sau khi xử lý.")
 
-    except Exception as e:
-        print(f"❌ Lỗi khi lấy danh sách CTDL/Year ban đầu từ index: {e}")
+print("🔄 Bắt đầu nạp dữ liệu trong nền...")
+loader = BackgroundLoader([
+    ('store', load_first_store),
+    ('store-full', load_full_store),
+    ('rollups', load_rollup_tables),
+    ('pyramid', load_pyramid),
+]).start()
+
+# --- Danh sách cho dropdowns: lấy từ bảng nhà máy và meta của kho, không quét toàn bộ dữ liệu ---
+def ctdl_options():
+    return [{'label': c, 'value': c} for c in store.ctdl_list()] if data_ready else []
+
+
+def year_options():
+    # Năm mới nhất trước: đó là năm được nạp đầu tiên và thường được xem nhiều nhất
+    return [{'label': y, 'value': y} for y in sorted(store.years, reverse=True)] if data_ready else []
+
+
+# --- Tác vụ nền: callback nặng chạy trong tiến trình con (Dash background callback + diskcache
+# cục bộ, không cần broker). Kết quả được ghi nhớ trong diskcache (LRU, giới hạn GRAPH_CACHE_MB,
+# khóa gồm fingerprint kho) nên dùng chung giữa mọi worker; yêu cầu cũ bị thay thế thì bị hủy ---
+try:
+    import diskcache
+    job_cache = diskcache.Cache(
+        str(DASH_JOB_DIR), size_limit=GRAPH_CACHE_MB * 1024**2, eviction_policy='least-recently-used'
+    )
+    background_manager = dash.DiskcacheManager(job_cache, cache_by=[lambda: store.fingerprint if store else None])
+    # Slot nằm trong cache riêng không bao giờ bị đẩy ra: kết quả callback không thể xóa mất slot đang giữ
+    slot_cache = diskcache.Cache(str(DASH_JOB_DIR / 'slots'), eviction_policy='none')
+    job_slots = JobSlots(slot_cache, 'graph-jobs', MAX_BACKGROUND_JOBS)
+    print(f"   ⚙️ Tác vụ nền: diskcache {DASH_JOB_DIR}, tối đa {MAX_BACKGROUND_JOBS} tác vụ đồng thời")
+except ImportError as e:
+    print(f"⚠️ Thiếu gói cho tác vụ nền ({e}, cài 'dash[diskcache]'): callback chạy đồng bộ")
+    job_cache, slot_cache, background_manager, job_slots = None, None, None, None
+
+# --- Cache LRU (giới hạn byte) cho biểu đồ tháng/ngày khi callback chạy đồng bộ: xem lại / chuyển
+# qua lại giữa các tab trả kết quả từ bộ nhớ; khóa gồm fingerprint kho nên tự hết hạn khi nạp dữ liệu
+# mới. Chế độ tác vụ nền chỉ dùng bộ nhớ kết quả của diskcache ở trên: callback chạy trong tiến
+# trình con nên cache trong tiến trình sẽ không bao giờ được dùng lại ---
+graph_cache = LRUCache(GRAPH_CACHE_MB * 1024**2) if background_manager is None else None
 
 # ==================== 2. KHỞI TẠO ỨNG DỤNG DASH ====================
-app = dash.Dash(__name__, suppress_callback_exceptions=True)
+# Nén gzip phản hồi (JSON figure, bundle JS) khi có flask-compress
+compress = DASH_COMPRESS and importlib.util.find_spec('flask_compress') is not None
+app = dash.Dash(__name__, suppress_callback_exceptions=True, background_callback_manager=background_manager,
+                compress=compress)
 server = app.server
 
+
+# --- Kiểm tra sống / sẵn sàng (bộ cân bằng tải, giám sát) ---
+def load_state():
+    """Trạng thái nạp dữ liệu của worker hiện tại."""
+    return {
+        'ready': bool(data_ready),
+        'pid': os.getpid(),
+        'loading': loader.state(),
+        'store': {'backend': store.backend, 'rows': len(store), 'nbytes': int(store.nbytes), 'fingerprint': store.fingerprint} if store is not None else None,
+        'pyramid': pyramid is not None,
+        'rollups': sorted(rollups),
+        'background_jobs': background_manager is not None,
+        'graph_cache': graph_cache.stats() if graph_cache is not None
+                       else {'entries': len(job_cache), 'nbytes': job_cache.volume(), 'backend': 'diskcache'},
+        'compress': compress,
+    }
+
+
+@server.route('/healthz')
+def healthz():
+    return jsonify(status='ok', pid=os.getpid())
+
+
+@server.route('/readyz')
+def readyz():
+    state = load_state()
+    return jsonify(state), 200 if state['ready'] else 503
+
+
+# --- API truy vấn dạng cột cho các nhóm khác (Arrow IPC / Parquet / JSON), dùng chung kho mmap ---
+server.register_blueprint(create_api(lambda: store if data_ready else None, lambda: pyramid))
+
 # ==================== 3. ĐỊNH NGHĨA LAYOUT ỨNG DỤNG ====================
-app.layout = html.Div([
-    html.H1("Trực Quan Hóa Dữ Liệu Sản Lượng", style={'textAlign': 'center'}),
+def loader_message():
+    """Dòng trạng thái nạp dữ liệu nền (rỗng khi đã nạp xong và không có lỗi)."""
+    state = loader.state()
+    if state['errors']:
+        return f"⚠️ Lỗi khi nạp: {', '.join(state['errors'])}"
+    if state['done']:
+        return ''
+    years = f" (đã có năm {', '.join(map(str, store.years))})" if data_ready else ''
+    return f"⏳ Đang nạp dữ liệu: {state['stage'] or 'khởi động'}{years}..."
 
-    dcc.Tabs(id="tabs-main", value='tab-month', children=[
-        # --- Tab Xem Theo Tháng ---
-        dcc.Tab(label='📅 Xem theo tháng', value='tab-month', children=[
-            html.Div([
-                html.Div([
-                    html.Label("CTDL:", style={'margin-right': '5px'}),
-                    dcc.Dropdown(
-                        id='ctdl-dropdown-month',
-                        options=initial_ctdl_options,
-                        # Chọn giá trị đầu tiên nếu có, nếu không thì None
-                        value=initial_ctdl_options[0]['value'] if initial_ctdl_options else None,
-                        clearable=False,
-                        style={'width': '300px', 'margin-right': '20px'}
-                    )
-                ], style={'display': 'flex', 'align-items': 'center'}),
-                html.Div([
-                    html.Label("Nhà máy:", style={'margin-right': '5px'}),
-                    dcc.Dropdown(
-                        id='nmtd-dropdown-month',
-                        options=[], # Sẽ được cập nhật bởi callback
-                        placeholder="Chọn nhà máy...",
-                        clearable=False,
-                        disabled=True, # Bắt đầu bị vô hiệu hóa
-                        style={'width': '300px', 'margin-right': '20px'}
-                    )
-                ], style={'display': 'flex', 'align-items': 'center'}),
+
+def serve_layout():
+    """Layout dựng lại mỗi lần tải trang: dropdown có sẵn dữ liệu đã nạp tới thời điểm đó."""
+    initial_ctdl_options = ctdl_options()
+    initial_year_options = year_options()
+    return html.Div([
+        html.H1("Trực Quan Hóa Dữ Liệu Sản Lượng", style={'textAlign': 'center'}),
+
+        dcc.Tabs(id="tabs-main", value='tab-month', children=[
+            # --- Tab Xem Theo Tháng ---
+            dcc.Tab(label='📅 Xem theo tháng', value='tab-month', children=[
                 html.Div([
-                     html.Label("Năm:", style={'margin-right': '5px'}),
-                     dcc.Dropdown(
-                        id='year-dropdown-month',
-                        options=initial_year_options,
-                        value=initial_year_options[0]['value'] if initial_year_options else None,
-                        clearable=False,
-                        style={'width': '120px', 'margin-right': '20px'}
-                     )
-                ], style={'display': 'flex', 'align-items': 'center'}),
+                    html.Div([
+                        html.Label("CTDL:", style={'margin-right': '5px'}),
+                        dcc.Dropdown(
+                            id='ctdl-dropdown-month',
+                            options=initial_ctdl_options,
+                            # Chọn giá trị đầu tiên nếu có, nếu không thì None
+                            value=initial_ctdl_options[0]['value'] if initial_ctdl_options else None,
+                            clearable=False,
+                            style={'width': '300px', 'margin-right': '20px'}
+                        )
+                    ], style={'display': 'flex', 'align-items': 'center'}),
+                    html.Div([
+                        html.Label("Nhà máy:", style={'margin-right': '5px'}),
+                        dcc.Dropdown(
+                            id='nmtd-dropdown-month',
+                            options=[], # Sẽ được cập nhật bởi callback
+                            placeholder="Chọn nhà máy...",
+                            clearable=False,
+                            disabled=True, # Bắt đầu bị vô hiệu hóa
+                            style={'width': '300px', 'margin-right': '20px'}
+                        )
+                    ], style={'display': 'flex', 'align-items': 'center'}),
+                    html.Div([
+                         html.Label("Năm:", style={'margin-right': '5px'}),
+                         dcc.Dropdown(
+                            id='year-dropdown-month',
+                            options=initial_year_options,
+                            value=initial_year_options[0]['value'] if initial_year_options else None,
+                            clearable=False,
+                            style={'width': '120px', 'margin-right': '20px'}
+                         )
+                    ], style={'display': 'flex', 'align-items': 'center'}),
+                    html.Div([
+                         html.Label("Tháng:", style={'margin-right': '5px'}),
+                         dcc.Dropdown(
+                            id='month-dropdown-month',
+                            options=[{'label': m, 'value': m} for m in range(1, 13)],
+                            value=1, # Giá trị tháng mặc định
+                            clearable=False,
+                            style={'width': '120px'}
+                        )
+                    ], style={'display': 'flex', 'align-items': 'center'}),
+                ], style={'display': 'flex', 'padding': '20px', 'flexWrap': 'wrap'}) # flexWrap để xuống dòng trên màn hình nhỏ
+            ]),
+
+            # --- Tab Xem Theo Ngày ---
+            dcc.Tab(label='🗓️ Xem theo ngày', value='tab-day', children=[
                 html.Div([
-                     html.Label("Tháng:", style={'margin-right': '5px'}),
-                     dcc.Dropdown(
-                        id='month-dropdown-month',
-                        options=[{'label': m, 'value': m} for m in range(1, 13)],
-                        value=1, # Giá trị tháng mặc định
-                        clearable=False,
-                        style={'width': '120px'}
-                    )
-                ], style={'display': 'flex', 'align-items': 'center'}),
-            ], style={'display': 'flex', 'padding': '20px', 'flexWrap': 'wrap'}) # flexWrap để xuống dòng trên màn hình nhỏ
-        ]),
+                     html.Div([
+                        html.Label("CTDL:", style={'margin-right': '5px'}),
+                        dcc.Dropdown(
+                            id='ctdl-dropdown-day',
+                            options=initial_ctdl_options,
+                            value=initial_ctdl_options[0]['value'] if initial_ctdl_options else None,
+                            clearable=False,
+                            style={'width': '300px', 'margin-right': '20px'}
+                        )
+                    ], style={'display': 'flex', 'align-items': 'center'}),
+                    html.Div([
+                        html.Label("Nhà máy:", style={'margin-right': '5px'}),
+                        dcc.Dropdown(
+                            id='nmtd-dropdown-day',
+                            options=[], # Sẽ được cập nhật bởi callback
+                            placeholder="Chọn nhà máy...",
+                            clearable=False,
+                            disabled=True,
+                            style={'width': '300px', 'margin-right': '20px'}
+                        )
+                    ], style={'display': 'flex', 'align-items': 'center'}),
+                     html.Div([
+                         html.Label("Năm:", style={'margin-right': '5px'}),
+                         dcc.Dropdown(
+                            id='year-dropdown-day',
+                            options=initial_year_options,
+                            value=initial_year_options[0]['value'] if initial_year_options else None,
+                            clearable=False,
+                            style={'width': '120px', 'margin-right': '20px'}
+                         )
+                     ], style={'display': 'flex', 'align-items': 'center'}),
+                    html.Div([
+                         html.Label("Tháng:", style={'margin-right': '5px'}),
+                         dcc.Dropdown(
+                            id='month-dropdown-day',
+                            options=[{'label': m, 'value': m} for m in range(1, 13)],
+                            value=1,
+                            clearable=False,
+                            style={'width': '120px', 'margin-right': '20px'}
+                        )
+                    ], style={'display': 'flex', 'align-items': 'center'}),
+                    html.Div([
+                         html.Label("Ngày:", style={'margin-right': '5px'}),
+                         dcc.Dropdown(
+                            id='day-dropdown-day',
+                            options=[], # Sẽ được cập nhật bởi callback
+                            placeholder="Chọn ngày...",
+                            clearable=False,
+                            disabled=True,
+                            style={'width': '120px'}
+                        )
+                    ], style={'display': 'flex', 'align-items': 'center'}),
+                ], style={'display': 'flex', 'padding': '20px', 'flexWrap': 'wrap'})
+            ]),
 
-        # --- Tab Xem Theo Ngày ---
-        dcc.Tab(label='🗓️ Xem theo ngày', value='tab-day', children=[
-            html.Div([
-                 html.Div([
-                    html.Label("CTDL:", style={'margin-right': '5px'}),
-                    dcc.Dropdown(
-                        id='ctdl-dropdown-day',
-                        options=initial_ctdl_options,
-                        value=initial_ctdl_options[0]['value'] if initial_ctdl_options else None,
-                        clearable=False,
-                        style={'width': '300px', 'margin-right': '20px'}
-                    )
-                ], style={'display': 'flex', 'align-items': 'center'}),
+            # --- Tab Tổng hợp theo năm (từ bảng tổng hợp tháng) ---
+            dcc.Tab(label='📊 Tổng hợp theo năm', value='tab-year', children=[
                 html.Div([
-                    html.Label("Nhà máy:", style={'margin-right': '5px'}),
-                    dcc.Dropdown(
-                        id='nmtd-dropdown-day',
-                        options=[], # Sẽ được cập nhật bởi callback
-                        placeholder="Chọn nhà máy...",
-                        clearable=False,
-                        disabled=True,
-                        style={'width': '300px', 'margin-right': '20px'}
-                    )
-                ], style={'display': 'flex', 'align-items': 'center'}),
-                 html.Div([
-                     html.Label("Năm:", style={'margin-right': '5px'}),
-                     dcc.Dropdown(
-                        id='year-dropdown-day',
-                        options=initial_year_options,
-                        value=initial_year_options[0]['value'] if initial_year_options else None,
-                        clearable=False,
-                        style={'width': '120px', 'margin-right': '20px'}
-                     )
-                 ], style={'display': 'flex', 'align-items': 'center'}),
+                    html.Div([
+                        html.Label("CTDL:", style={'margin-right': '5px'}),
+                        dcc.Dropdown(
+                            id='ctdl-dropdown-year',
+                            options=initial_ctdl_options,
+                            value=initial_ctdl_options[0]['value'] if initial_ctdl_options else None,
+                            clearable=False,
+                            style={'width': '300px', 'margin-right': '20px'}
+                        )
+                    ], style={'display': 'flex', 'align-items': 'center'}),
+                    html.Div([
+                        html.Label("Nhà máy:", style={'margin-right': '5px'}),
+                        dcc.Dropdown(
+                            id='nmtd-dropdown-year',
+                            options=[], # Sẽ được cập nhật bởi callback
+                            placeholder="Chọn nhà máy...",
+                            clearable=False,
+                            disabled=True,
+                            style={'width': '300px', 'margin-right': '20px'}
+                        )
+                    ], style={'display': 'flex', 'align-items': 'center'}),
+                    html.Div([
+                         html.Label("Năm:", style={'margin-right': '5px'}),
+                         dcc.Dropdown(
+                            id='year-dropdown-year',
+                            options=initial_year_options,
+                            value=initial_year_options[0]['value'] if initial_year_options else None,
+                            clearable=False,
+                            style={'width': '120px'}
+                         )
+                    ], style={'display': 'flex', 'align-items': 'center'}),
+                ], style={'display': 'flex', 'padding': '20px', 'flexWrap': 'wrap'})
+            ]),
+
+            # --- Tab Thống kê theo khung giờ (một điểm đo trong một tháng) ---
+            dcc.Tab(label='📈 Thống kê khung giờ', value='tab-stats', children=[
                 html.Div([
-                     html.Label("Tháng:", style={'margin-right': '5px'}),
-                     dcc.Dropdown(
-                        id='month-dropdown-day',
-                        options=[{'label': m, 'value': m} for m in range(1, 13)],
-                        value=1,
-                        clearable=False,
-                        style={'width': '120px', 'margin-right': '20px'}
-                    )
-                ], style={'display': 'flex', 'align-items': 'center'}),
+                    html.Div([
+                        html.Label("CTDL:", style={'margin-right': '5px'}),
+                        dcc.Dropdown(
+                            id='ctdl-dropdown-stats',
+                            options=initial_ctdl_options,
+                            value=initial_ctdl_options[0]['value'] if initial_ctdl_options else None,
+                            clearable=False,
+                            style={'width': '300px', 'margin-right': '20px'}
+                        )
+                    ], style={'display': 'flex', 'align-items': 'center'}),
+                    html.Div([
+                        html.Label("Nhà máy:", style={'margin-right': '5px'}),
+                        dcc.Dropdown(
+                            id='nmtd-dropdown-stats',
+                            options=[], # Sẽ được cập nhật bởi callback
+                            placeholder="Chọn nhà máy...",
+                            clearable=False,
+                            disabled=True,
+                            style={'width': '300px', 'margin-right': '20px'}
+                        )
+                    ], style={'display': 'flex', 'align-items': 'center'}),
+                    html.Div([
+                        html.Label("Mã điểm đo:", style={'margin-right': '5px'}),
+                        dcc.Dropdown(
+                            id='madiemdo-dropdown-stats',
+                            options=[], # Sẽ được cập nhật bởi callback
+                            placeholder="Chọn điểm đo...",
+                            clearable=False,
+                            disabled=True,
+                            style={'width': '300px', 'margin-right': '20px'}
+                        )
+                    ], style={'display': 'flex', 'align-items': 'center'}),
+                    html.Div([
+                         html.Label("Năm:", style={'margin-right': '5px'}),
+                         dcc.Dropdown(
+                            id='year-dropdown-stats',
+                            options=initial_year_options,
+                            value=initial_year_options[0]['value'] if initial_year_options else None,
+                            clearable=False,
+                            style={'width': '120px', 'margin-right': '20px'}
+                         )
+                    ], style={'display': 'flex', 'align-items': 'center'}),
+                    html.Div([
+                         html.Label("Tháng:", style={'margin-right': '5px'}),
+                         dcc.Dropdown(
+                            id='month-dropdown-stats',
+                            options=[{'label': m, 'value': m} for m in range(1, 13)],
+                            value=1,
+                            clearable=False,
+                            style={'width': '120px'}
+                        )
+                    ], style={'display': 'flex', 'align-items': 'center'}),
+                ], style={'display': 'flex', 'padding': '20px', 'flexWrap': 'wrap'})
+            ]),
+
+            # --- Tab Khoảng thời gian tự do (phóng to/kéo trên biểu đồ chỉ tải vùng đang xem) ---
+            dcc.Tab(label='🔍 Khoảng thời gian', value='tab-range', children=[
                 html.Div([
-                     html.Label("Ngày:", style={'margin-right': '5px'}),
-                     dcc.Dropdown(
-                        id='day-dropdown-day',
-                        options=[], # Sẽ được cập nhật bởi callback
-                        placeholder="Chọn ngày...",
-                        clearable=False,
-                        disabled=True,
-                        style={'width': '120px'}
-                    )
-                ], style={'display': 'flex', 'align-items': 'center'}),
-            ], style={'display': 'flex', 'padding': '20px', 'flexWrap': 'wrap'})
+                    html.Div([
+                        html.Label("CTDL:", style={'margin-right': '5px'}),
+                        dcc.Dropdown(
+                            id='ctdl-dropdown-range',
+                            options=initial_ctdl_options,
+                            value=initial_ctdl_options[0]['value'] if initial_ctdl_options else None,
+                            clearable=False,
+                            style={'width': '300px', 'margin-right': '20px'}
+                        )
+                    ], style={'display': 'flex', 'align-items': 'center'}),
+                    html.Div([
+                        html.Label("Nhà máy:", style={'margin-right': '5px'}),
+                        dcc.Dropdown(
+                            id='nmtd-dropdown-range',
+                            options=[], # Sẽ được cập nhật bởi callback
+                            placeholder="Chọn nhà máy...",
+                            clearable=False,
+                            disabled=True,
+                            style={'width': '300px', 'margin-right': '20px'}
+                        )
+                    ], style={'display': 'flex', 'align-items': 'center'}),
+                    html.Div([
+                        html.Label("Từ - đến:", style={'margin-right': '5px'}),
+                        dcc.DatePickerRange(
+                            id='date-range',
+                            min_date_allowed=range_min_date,
+                            max_date_allowed=range_max_date,
+                            start_date=range_min_date,
+                            end_date=range_max_date,
+                            display_format='DD/MM/YYYY'
+                        )
+                    ], style={'display': 'flex', 'align-items': 'center'}),
+                ], style={'display': 'flex', 'padding': '20px', 'flexWrap': 'wrap'})
+            ]),
         ]),
-    ]),
-
-    # --- Khu vực hiển thị biểu đồ và thông báo ---
-    html.Div(id='status-message', style={'padding': '10px', 'font-style': 'italic', 'color': 'grey'}),
-    dcc.Loading(
-        id="loading-graph",
-        type="circle",
-        children=dcc.Graph(id='graph-output', figure=go.Figure()) # Bắt đầu với biểu đồ trống
-    )
-])
+
+        # --- Khu vực hiển thị biểu đồ và thông báo ---
+        html.Div(id='status-message', style={'padding': '10px', 'font-style': 'italic', 'color': 'grey'}),
+        dcc.Loading(
+            id="loading-graph",
+            type="circle",
+            children=dcc.Graph(id='graph-output', figure=go.Figure()) # Bắt đầu với biểu đồ trống
+        ),
+        # Dạng biểu đồ trình duyệt đang hiển thị: cùng dạng thì chỉ gửi Patch (data + tiêu đề)
+        dcc.Store(id='graph-view'),
+        # Trạng thái nạp dữ liệu nền: hỏi định kỳ tới khi nạp xong, điền dần các dropdown
+        html.Div(id='loader-status', children=loader_message(), style={'padding': '0 10px', 'color': 'grey'}),
+        dcc.Interval(id='loader-poll', interval=1000, disabled=loader.done),
+        dcc.Store(id='loader-version', data=loader.version),
+    ])
+
+
+app.layout = serve_layout
 
 # ==================== 4. ĐỊNH NGHĨA CALLBACKS ====================
+# --- Điền dần dropdown khi luồng nền nạp thêm dữ liệu (năm mới nhất trước, rồi toàn bộ) ---
+CTDL_TABS = ['month', 'day', 'year', 'stats', 'range']
+YEAR_TABS = ['month', 'day', 'year', 'stats']
+
+
+def _keep_or_first(value, options):
+    values = [o['value'] for o in options]
+    return value if value in values else (values[0] if values else None)
+
+
+@app.callback(
+    [Output(f'ctdl-dropdown-{t}', 'options') for t in CTDL_TABS]
+    + [Output(f'ctdl-dropdown-{t}', 'value', allow_duplicate=True) for t in CTDL_TABS]
+    + [Output(f'year-dropdown-{t}', 'options') for t in YEAR_TABS]
+    + [Output(f'year-dropdown-{t}', 'value', allow_duplicate=True) for t in YEAR_TABS]
+    + [
+        Output('date-range', 'min_date_allowed'),
+        Output('date-range', 'max_date_allowed'),
+        Output('date-range', 'start_date'),
+        Output('date-range', 'end_date'),
+        Output('loader-status', 'children'),
+        Output('loader-poll', 'disabled'),
+        Output('loader-version', 'data'),
+    ],
+    Input('loader-poll', 'n_intervals'),
+    [State(f'ctdl-dropdown-{t}', 'value') for t in CTDL_TABS]
+    + [State(f'year-dropdown-{t}', 'value') for t in YEAR_TABS]
+    + [State('date-range', 'start_date'), State('date-range', 'end_date'), State('loader-version', 'data')],
+    prevent_initial_call=True
+)
+def poll_loader(_, *states):
+    ctdl_values = states[:len(CTDL_TABS)]
+    year_values = states[len(CTDL_TABS):len(CTDL_TABS) + len(YEAR_TABS)]
+    start_date, end_date, seen_version = states[-3:]
+    version, done = loader.version, loader.done
+    if version == seen_version:
+        n_data = 2 * len(CTDL_TABS) + 2 * len(YEAR_TABS) + 4
+        return [no_update] * n_data + [loader_message(), done, no_update]
+
+    ctdl_opts, year_opts = ctdl_options(), year_options()
+    return (
+        [ctdl_opts] * len(CTDL_TABS)
+        + [_keep_or_first(v, ctdl_opts) for v in ctdl_values]
+        + [year_opts] * len(YEAR_TABS)
+        + [_keep_or_first(v, year_opts) for v in year_values]
+        + [range_min_date, range_max_date, start_date or range_min_date, end_date or range_max_date]
+        + [loader_message(), done, version]
+    )
+
+
 # --- Đồng bộ filter khi chuyển sang tab ngày ---
 @app.callback(
     Output('ctdl-dropdown-day', 'value'),
@@ -305,16 +558,16 @@ def sync_to_month(tab, ctdl_d, nmtd_d, year_d, month_d):
     Input('ctdl-dropdown-month', 'value')
 )
 def update_nmtd_month(selected_ctdl):
-    if not selected_ctdl or df_sanluong.empty:
+    if not selected_ctdl or not data_ready:
         return [], None, True
 
     try:
-        # Kiểm tra CTDL có trong index không
-        if selected_ctdl not in df_sanluong.index.get_level_values('CTDL'):
-             print(f"CTDL '{selected_ctdl}' không tồn tại trong index (update_nmtd_month).")
+        nmtd_options_list = store.nmtd_list(selected_ctdl)
+        # CTDL không có trong kho -> danh sách rỗng
+        if not nmtd_options_list:
+             print(f"CTDL '{selected_ctdl}' không tồn tại trong kho (update_nmtd_month).")
              return [], None, True
 
-        nmtd_options_list = sorted(df_sanluong.loc[selected_ctdl].index.get_level_values('NMTD').unique())
         nmtd_options = [{'label': n, 'value': n} for n in nmtd_options_list]
 
         if not nmtd_options:
@@ -333,14 +586,14 @@ def update_nmtd_month(selected_ctdl):
     Input('ctdl-dropdown-day', 'value')
 )
 def update_nmtd_day(selected_ctdl):
-    if not selected_ctdl or df_sanluong.empty:
+    if not selected_ctdl or not data_ready:
         return [], None, True
     try:
-        if selected_ctdl not in df_sanluong.index.get_level_values('CTDL'):
-            print(f"CTDL '{selected_ctdl}' không tồn tại trong index (update_nmtd_day).")
+        nmtd_options_list = store.nmtd_list(selected_ctdl)
+        if not nmtd_options_list:
+            print(f"CTDL '{selected_ctdl}' không tồn tại trong kho (update_nmtd_day).")
             return [], None, True
 
-        nmtd_options_list = sorted(df_sanluong.loc[selected_ctdl].index.get_level_values('NMTD').unique())
         nmtd_options = [{'label': n, 'value': n} for n in nmtd_options_list]
         if not nmtd_options:
             return [], None, True
@@ -349,28 +602,158 @@ def update_nmtd_day(selected_ctdl):
         print(f"Lỗi khi cập nhật NMTD ngày cho CTDL '{selected_ctdl}': {e}")
         return [], None, True
 
+# --- Danh sách tháng có dữ liệu (dùng chung cho các tab) ---
+def month_options(ctdl, nmtd, year, current_month, madiemdo=None):
+    """Chỉ các tháng có dữ liệu theo chỉ mục phân cấp; giữ tháng đang chọn nếu còn hợp lệ."""
+    if not data_ready or not all([ctdl, nmtd, year]):
+        return [{'label': m, 'value': m} for m in range(1, 13)], current_month
+    months = store.index.months(ctdl, nmtd, year, madiemdo)
+    options = [{'label': m, 'value': m} for m in months]
+    value = current_month if current_month in months else (months[0] if months else None)
+    return options, value
+
+# --- Callback cập nhật Tháng cho tab Tháng ---
+@app.callback(
+    Output('month-dropdown-month', 'options'),
+    Output('month-dropdown-month', 'value', allow_duplicate=True),
+    Input('nmtd-dropdown-month', 'value'),
+    Input('year-dropdown-month', 'value'),
+    State('ctdl-dropdown-month', 'value'),
+    State('month-dropdown-month', 'value'),
+    prevent_initial_call='initial_duplicate'
+)
+def update_month_options_month(selected_nmtd, selected_year, selected_ctdl, current_month):
+    return month_options(selected_ctdl, selected_nmtd, selected_year, current_month)
+
+# --- Callback cập nhật Tháng cho tab Ngày ---
+@app.callback(
+    Output('month-dropdown-day', 'options'),
+    Output('month-dropdown-day', 'value', allow_duplicate=True),
+    Input('nmtd-dropdown-day', 'value'),
+    Input('year-dropdown-day', 'value'),
+    State('ctdl-dropdown-day', 'value'),
+    State('month-dropdown-day', 'value'),
+    prevent_initial_call='initial_duplicate'
+)
+def update_month_options_day(selected_nmtd, selected_year, selected_ctdl, current_month):
+    return month_options(selected_ctdl, selected_nmtd, selected_year, current_month)
+
+# --- Callback cập nhật Tháng cho tab Thống kê (theo điểm đo) ---
+@app.callback(
+    Output('month-dropdown-stats', 'options'),
+    Output('month-dropdown-stats', 'value'),
+    Input('madiemdo-dropdown-stats', 'value'),
+    Input('year-dropdown-stats', 'value'),
+    State('ctdl-dropdown-stats', 'value'),
+    State('nmtd-dropdown-stats', 'value'),
+    State('month-dropdown-stats', 'value')
+)
+def update_month_options_stats(selected_madiemdo, selected_year, selected_ctdl, selected_nmtd, current_month):
+    if not selected_madiemdo:
+        return month_options(None, None, None, current_month)
+    return month_options(selected_ctdl, selected_nmtd, selected_year, current_month, selected_madiemdo)
+
+# --- Callback cập nhật NMTD cho tab Năm (thêm lựa chọn "Tất cả nhà máy") ---
+@app.callback(
+    Output('nmtd-dropdown-year', 'options'),
+    Output('nmtd-dropdown-year', 'value'),
+    Output('nmtd-dropdown-year', 'disabled'),
+    Input('ctdl-dropdown-year', 'value')
+)
+def update_nmtd_year(selected_ctdl):
+    if not selected_ctdl or not data_ready:
+        return [], None, True
+    try:
+        nmtd_options = [{'label': 'Tất cả nhà máy', 'value': ALL_NMTD}]
+        nmtd_options += [{'label': n, 'value': n} for n in store.nmtd_list(selected_ctdl)]
+        return nmtd_options, ALL_NMTD, False
+    except Exception as e:
+        print(f"Lỗi khi cập nhật NMTD năm cho CTDL '{selected_ctdl}': {e}")
+        return [], None, True
+
+# --- Callback cập nhật NMTD cho tab Thống kê ---
+@app.callback(
+    Output('nmtd-dropdown-stats', 'options'),
+    Output('nmtd-dropdown-stats', 'value'),
+    Output('nmtd-dropdown-stats', 'disabled'),
+    Input('ctdl-dropdown-stats', 'value')
+)
+def update_nmtd_stats(selected_ctdl):
+    if not selected_ctdl or not data_ready:
+        return [], None, True
+    try:
+        nmtd_options = [{'label': n, 'value': n} for n in store.nmtd_list(selected_ctdl)]
+        if not nmtd_options:
+            return [], None, True
+        return nmtd_options, nmtd_options[0]['value'], False
+    except Exception as e:
+        print(f"Lỗi khi cập nhật NMTD thống kê cho CTDL '{selected_ctdl}': {e}")
+        return [], None, True
+
+# --- Callback cập nhật NMTD cho tab Khoảng thời gian ---
+@app.callback(
+    Output('nmtd-dropdown-range', 'options'),
+    Output('nmtd-dropdown-range', 'value'),
+    Output('nmtd-dropdown-range', 'disabled'),
+    Input('ctdl-dropdown-range', 'value')
+)
+def update_nmtd_range(selected_ctdl):
+    if not selected_ctdl or not data_ready:
+        return [], None, True
+    try:
+        nmtd_options = [{'label': n, 'value': n} for n in store.nmtd_list(selected_ctdl)]
+        if not nmtd_options:
+            return [], None, True
+        return nmtd_options, nmtd_options[0]['value'], False
+    except Exception as e:
+        print(f"Lỗi khi cập nhật NMTD khoảng thời gian cho CTDL '{selected_ctdl}': {e}")
+        return [], None, True
+
+# --- Callback cập nhật MADIEMDO cho tab Thống kê ---
+@app.callback(
+    Output('madiemdo-dropdown-stats', 'options'),
+    Output('madiemdo-dropdown-stats', 'value'),
+    Output('madiemdo-dropdown-stats', 'disabled'),
+    Input('ctdl-dropdown-stats', 'value'),
+    Input('nmtd-dropdown-stats', 'value')
+)
+def update_madiemdo_stats(selected_ctdl, selected_nmtd):
+    if not selected_ctdl or not selected_nmtd or not data_ready:
+        return [], None, True
+    try:
+        madiemdo_options = [{'label': m, 'value': m} for m in store.madiemdo_list(selected_ctdl, selected_nmtd)]
+        if not madiemdo_options:
+            return [], None, True
+        return madiemdo_options, madiemdo_options[0]['value'], False
+    except Exception as e:
+        print(f"Lỗi khi cập nhật MADIEMDO cho '{selected_ctdl}/{selected_nmtd}': {e}")
+        return [], None, True
+
 # --- Callback cập nhật Ngày cho tab Ngày ---
 @app.callback(
     Output('day-dropdown-day', 'options'),
     Output('day-dropdown-day', 'value'),
     Output('day-dropdown-day', 'disabled'),
+    Input('nmtd-dropdown-day', 'value'),
     Input('year-dropdown-day', 'value'),
     Input('month-dropdown-day', 'value'),
+    State('ctdl-dropdown-day', 'value'),
     State('day-dropdown-day', 'value') # Giữ giá trị ngày hiện tại để thử duy trì
 )
-def update_day_options_day(selected_year, selected_month, current_day_value):
-    if not selected_year or not selected_month:
-        return [], None, True # Vô hiệu hóa nếu chưa chọn Năm/Tháng
+def update_day_options_day(selected_nmtd, selected_year, selected_month, selected_ctdl, current_day_value):
+    if not selected_year or not selected_month or not selected_nmtd or not data_ready:
+        return [], None, True # Vô hiệu hóa nếu chưa chọn Nhà máy/Năm/Tháng
 
     try:
-        max_day = calendar.monthrange(selected_year, selected_month)[1]
-        day_options = [{'label': d, 'value': d} for d in range(1, max_day + 1)]
+        # Chỉ các ngày nhà máy có dữ liệu (chỉ mục phân cấp, không quét dữ liệu)
+        days = store.index.days(selected_ctdl, selected_nmtd, selected_year, selected_month)
+        day_options = [{'label': d, 'value': d} for d in days]
 
         new_day_value = None
-        if current_day_value is not None and 1 <= current_day_value <= max_day:
+        if current_day_value in days:
             new_day_value = current_day_value
         elif day_options:
-             new_day_value = day_options[0]['value'] # Ngày 1
+             new_day_value = day_options[0]['value'] # Ngày đầu tiên có dữ liệu
 
         return day_options, new_day_value, False # Trả về options, giá trị mới, không vô hiệu hóa
 
@@ -383,6 +766,7 @@ def update_day_options_day(selected_year, selected_month, current_day_value):
 @app.callback(
     Output('graph-output', 'figure'),
     Output('status-message', 'children'),
+    Output('graph-view', 'data'),
     Input('tabs-main', 'value'), # Input: Tab nào đang được chọn
     # Inputs từ Tab Tháng
     Input('ctdl-dropdown-month', 'value'),
@@ -394,19 +778,92 @@ def update_day_options_day(selected_year, selected_month, current_day_value):
     Input('nmtd-dropdown-day', 'value'),
     Input('year-dropdown-day', 'value'),
     Input('month-dropdown-day', 'value'),
-    Input('day-dropdown-day', 'value')
+    Input('day-dropdown-day', 'value'),
+    # Inputs từ Tab Năm
+    Input('ctdl-dropdown-year', 'value'),
+    Input('nmtd-dropdown-year', 'value'),
+    Input('year-dropdown-year', 'value'),
+    # Inputs từ Tab Thống kê
+    Input('ctdl-dropdown-stats', 'value'),
+    Input('nmtd-dropdown-stats', 'value'),
+    Input('madiemdo-dropdown-stats', 'value'),
+    Input('year-dropdown-stats', 'value'),
+    Input('month-dropdown-stats', 'value'),
+    # Inputs từ Tab Khoảng thời gian
+    Input('ctdl-dropdown-range', 'value'),
+    Input('nmtd-dropdown-range', 'value'),
+    Input('date-range', 'start_date'),
+    Input('date-range', 'end_date'),
+    State('graph-view', 'data'),
+    # Chạy nền khi có diskcache: tiến độ hiện trong status-message, yêu cầu mới thay thế yêu cầu cũ
+    **(dict(background=True, progress=Output('status-message', 'children'), interval=JOB_POLL_MS)
+       if background_manager is not None else {})
 )
-def update_graph(active_tab,
+def update_graph(*args):
+    # Callback nền nhận thêm hàm set_progress ở đầu
+    set_progress, args = (args[0], args[1:]) if background_manager is not None else (lambda status: None, args)
+    active_tab, *selections, current_view = args
+    slot = job_slots.acquire(
+        on_wait=lambda: set_progress(f"⏳ Đang chờ lượt xử lý (tối đa {MAX_BACKGROUND_JOBS} tác vụ đồng thời)...")
+    ) if job_slots is not None else nullcontext()
+    with slot:
+        set_progress("🔄 Đang lọc và vẽ biểu đồ...")
+        fig, status = render_graph(active_tab, *selections)
+    return send_figure(fig, status, GRAPH_VIEWS.get(active_tab), current_view)
+
+
+# --- Gửi figure: đầy đủ khi đổi dạng biểu đồ, chỉ Patch khi trình duyệt đã có cùng layout ---
+GRAPH_VIEWS = {'tab-month': 'line', 'tab-day': 'line', 'tab-year': 'year', 'tab-stats': 'stats', 'tab-range': 'range'}
+# Các khóa layout thay đổi giữa hai lần vẽ cùng dạng; template, trục, lề... giữ nguyên phía trình duyệt
+PATCH_LAYOUT_KEYS = {
+    'line': ['annotations'],
+    'year': ['annotations'],
+    'stats': ['annotations'],
+    'range': ['annotations', 'uirevision', 'xaxis.range', 'xaxis.autorange'],
+}
+
+
+def send_figure(fig, status, view, current_view):
+    """(figure hoặc Patch, thông báo, dạng biểu đồ mới) cho các Output của graph-output."""
+    if fig is dash.no_update:
+        return fig, status, dash.no_update
+    if not fig.data: # Biểu đồ trống (lỗi / không có dữ liệu): lần sau phải gửi lại đầy đủ
+        return fig, status, None
+    if view is not None and view == current_view:
+        return patch_figure(fig, PATCH_LAYOUT_KEYS[view]), status, view
+    return fig, status, view
+
+
+def render_graph(active_tab,
                  ctdl_m, nmtd_m, year_m, month_m,
-                 ctdl_d, nmtd_d, year_d, month_d, day_d):
+                 ctdl_d, nmtd_d, year_d, month_d, day_d,
+                 ctdl_y, nmtd_y, year_y,
+                 ctdl_s, nmtd_s, madiemdo_s, year_s, month_s,
+                 ctdl_r, nmtd_r, start_r, end_r):
 
-    # Nếu DataFrame rỗng ngay từ đầu, không làm gì cả
-    if df_sanluong.empty:
+    # Nếu kho rỗng ngay từ đầu, không làm gì cả
+    if not data_ready:
          return go.Figure(), "Lỗi: Không có dữ liệu đã xử lý hoặc xảy ra lỗi khi tải dữ liệu."
 
     ctx = dash.callback_context
     triggered_id = ctx.triggered[0]['prop_id'].split('.')[0] if ctx.triggered else 'initial load'
 
+    # Tab năm đọc thẳng từ bảng tổng hợp tháng, không chạm tới dữ liệu 30'
+    if active_tab == 'tab-year':
+        if not all([ctdl_y, nmtd_y, year_y]):
+            return dash.no_update, "Vui lòng chọn đủ CTDL, Nhà máy và Năm."
+        return update_graph_year(ctdl_y, nmtd_y, year_y)
+
+    if active_tab == 'tab-stats':
+        if not all([ctdl_s, nmtd_s, madiemdo_s, year_s, month_s]):
+            return dash.no_update, "Vui lòng chọn đủ CTDL, Nhà máy, Mã điểm đo, Năm và Tháng."
+        return update_graph_stats(ctdl_s, nmtd_s, madiemdo_s, year_s, month_s)
+
+    if active_tab == 'tab-range':
+        if not all([ctdl_r, nmtd_r, start_r, end_r]):
+            return dash.no_update, "Vui lòng chọn đủ CTDL, Nhà máy và khoảng thời gian."
+        return update_graph_range(ctdl_r, nmtd_r, start_r, end_r)
+
     # Xác định giá trị dựa trên tab đang hoạt động HOẶC tab của input vừa thay đổi
     ctdl, nmtd, year, month, day, mode = None, None, None, None, None, None
 
@@ -435,13 +892,21 @@ def update_graph(active_tab,
              return go.Figure(), "Vui lòng chọn các tùy chọn trên một tab."
 
 
+    # --- Tra cache theo truy vấn chuẩn hóa (cùng lựa chọn từ tab nào cũng trùng khóa) ---
+    cache_key = (store.fingerprint, mode, ctdl, nmtd, int(year), int(month), int(day) if mode == 'day' else None)
+    if graph_cache is not None:
+        graph_cache.bind(store.fingerprint)
+        cached = graph_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
     # --- Phần lọc và vẽ biểu đồ ---
     status = f"🔄 Đang lọc và vẽ biểu đồ cho {nmtd} - {mode}..."
     filtered_df = pd.DataFrame()
     title_ext = ""
 
     try:
-        # Xây dựng tuple index để truy vấn
+        # Xây dựng tuple truy vấn
         if mode == 'month':
             idx_query = (ctdl, nmtd, year, month)
             title_ext = f"{month}/{year}"
@@ -449,21 +914,9 @@ def update_graph(active_tab,
             idx_query = (ctdl, nmtd, year, month, day)
             title_ext = f"{day}/{month}/{year}"
 
-        # Kiểm tra sự tồn tại của index trước khi truy cập bằng .loc
-        # Sử dụng pd.IndexSlice cho truy vấn rõ ràng hơn trên MultiIndex (tùy chọn, nhưng tốt)
-        # slicer = pd.IndexSlice[idx_query] # Bỏ slicer nếu dùng tuple trực tiếp
-
-        # Kiểm tra sự tồn tại của index con trước khi dùng loc
-        # Cách 1: Kiểm tra trực tiếp tuple (đơn giản hơn)
-        if idx_query in df_sanluong.index:
-             # Lọc bằng .loc và chỉ lấy các cột cần thiết ngay lập tức
-             # reset_index(drop=True) để bỏ MultiIndex cũ
-             filtered_df = df_sanluong.loc[idx_query, ['TIME', 'CS', 'MADIEMDO']].reset_index(drop=True)
-        # Cách 2: Dùng try-except (an toàn hơn nếu index phức tạp)
-        # try:
-        #      filtered_df = df_sanluong.loc[idx_query, ['TIME', 'CS', 'MADIEMDO']].reset_index(drop=True)
-        # except KeyError:
-        #      filtered_df = pd.DataFrame() # Không tìm thấy index
+        # Đoạn dòng [lo, hi) tìm bằng searchsorted trên khóa đã sắp xếp của kho dùng chung,
+        # chỉ sao chép các dòng của nhà máy trong tháng/ngày được chọn (đã theo thời gian)
+        filtered_df = store.query(*idx_query, columns=['TIME', 'CS', 'MADIEMDO'])
 
     except Exception as e: # Bắt tất cả lỗi, không chỉ KeyError
         status = f"❌ Lỗi khi lọc dữ liệu cho {idx_query}: {e}"
@@ -476,13 +929,17 @@ def update_graph(active_tab,
 
     # --- Vẽ biểu đồ ---
     try:
-        filtered_df = filtered_df.sort_values('TIME') # Sắp xếp lại theo thời gian
+        # Giảm điểm (LTTB / min-max) cho mọi điểm đo cùng lúc khi trace vượt ngân sách điểm,
+        # giữ payload gửi xuống trình duyệt nhỏ với khoảng thời gian dài
+        n_points = len(filtered_df)
+        filtered_df = downsample_frame(filtered_df)
 
-        fig = px.line(
-            filtered_df, x='TIME', y='CS', color='MADIEMDO',
-            render_mode='webgl',
-            markers=True if mode == 'day' else False
+        # Mỗi điểm đo một trace scattergl; x (epoch ms) và y (float32) gửi dạng typed array
+        traces = line_traces(
+            filtered_df, markers=(mode == 'day'),
+            hovertemplate='Thời gian: %{x}<br>Công suất: %{y}'
         )
+        fig = go.Figure(data=traces)
 
         # Áp dụng layout y hệt như code gốc của bạn
         fig.update_layout(
@@ -497,7 +954,9 @@ def update_graph(active_tab,
             ],
             template='plotly_white', height=600, hovermode='x unified',
             xaxis_title=None, yaxis_title='Giá trị công suất',
+            legend_title_text='MADIEMDO',
             xaxis=dict(
+                type='date', # x là epoch ms
                 showgrid=True, gridcolor='lightgrey', griddash='dot',
                 title_font=dict(size=14, color='black'),
                 ticklabelposition='outside', ticks='outside', ticklen=8
@@ -514,9 +973,13 @@ def update_graph(active_tab,
             text="<b>Thời gian</b>", xref='paper', yref='paper', x=0.45, y=-0.15,
             showarrow=False, font=dict(size=14, color='black')
         )
-        fig.update_traces(line=dict(width=2), hovertemplate='Thời gian: %{x}<br>Công suất: %{y}')
 
         status = f"✅ Hiển thị biểu đồ cho {nmtd} - {title_ext}"
+        if len(filtered_df) < n_points:
+            status += f" (giảm điểm: {n_points:,} -> {len(filtered_df):,} điểm)"
+        # Phần lớn figure là các typed array base64 của trace
+        if graph_cache is not None:
+            graph_cache.put(cache_key, (fig, status), estimate_nbytes(traces))
         return fig, status
 
     except Exception as e:
@@ -525,19 +988,205 @@ def update_graph(active_tab,
         return go.Figure(), status
 
 
+# --- Phóng to / kéo trên tab Khoảng thời gian: chỉ tải lại vùng đang xem ---
+@app.callback(
+    Output('graph-output', 'figure', allow_duplicate=True),
+    Output('status-message', 'children', allow_duplicate=True),
+    Output('graph-view', 'data', allow_duplicate=True),
+    Input('graph-output', 'relayoutData'),
+    State('tabs-main', 'value'),
+    State('ctdl-dropdown-range', 'value'),
+    State('nmtd-dropdown-range', 'value'),
+    State('date-range', 'start_date'),
+    State('date-range', 'end_date'),
+    State('graph-view', 'data'),
+    prevent_initial_call=True
+)
+def update_graph_range_zoom(relayout, active_tab, ctdl, nmtd, start_date, end_date, current_view):
+    if active_tab != 'tab-range' or not relayout or not all([ctdl, nmtd, start_date, end_date]):
+        return dash.no_update, dash.no_update, dash.no_update
+    if relayout.get('xaxis.autorange'):
+        view = None # Nhấp đúp: về toàn bộ khoảng đã chọn
+    elif 'xaxis.range[0]' in relayout:
+        view = (relayout['xaxis.range[0]'], relayout['xaxis.range[1]'])
+    elif 'xaxis.range' in relayout:
+        view = tuple(relayout['xaxis.range'][:2])
+    else:
+        return dash.no_update, dash.no_update, dash.no_update # autosize, trục y...: không đổi cửa sổ thời gian
+    fig, status = update_graph_range(ctdl, nmtd, start_date, end_date, view)
+    return send_figure(fig, status, 'range', current_view)
+
+
+def update_graph_range(ctdl, nmtd, start_date, end_date, view=None):
+    """Biểu đồ CS của nhà máy trong khoảng [start_date, end_date] từ kim tự tháp đa độ phân giải.
+
+    Chỉ cắt vùng đang xem (view) cộng thêm nửa cửa sổ mỗi bên để kéo ngang không thấy khoảng trống,
+    ở mức mịn nhất mà vùng đang xem không vượt DOWNSAMPLE_POINTS điểm mỗi điểm đo.
+    """
+    if pyramid is None:
+        return go.Figure(), "⚠️ Chưa có kim tự tháp đa độ phân giải (chạy 'python -m src.dataset pyramid')."
+    try:
+        full_start = pd.Timestamp(start_date).normalize()
+        full_end = pd.Timestamp(end_date).normalize() + pd.Timedelta(days=1)
+        view_start, view_end = (pd.Timestamp(v) for v in view) if view else (full_start, full_end)
+        width = view_end - view_start
+        if width <= pd.Timedelta(0):
+            return dash.no_update, dash.no_update
+        fetch_start = max(view_start - width / 2, full_start)
+        fetch_end = min(view_end + width / 2, full_end)
+        max_points = int(DOWNSAMPLE_POINTS * ((fetch_end - fetch_start) / width))
+        series, level = pyramid.window(ctdl, nmtd, fetch_start, fetch_end, max_points)
+    except Exception as e:
+        status = f"❌ Lỗi khi lấy dữ liệu khoảng thời gian: {e}"
+        print(status)
+        return go.Figure(), status
+
+    if series.empty:
+        return go.Figure(), f"ℹ️ Không có dữ liệu cho lựa chọn: {ctdl}, {nmtd}, {start_date} - {end_date}."
+
+    try:
+        fig = go.Figure(data=line_traces(series, hovertemplate='Thời gian: %{x}<br>Công suất: %{y}'))
+        level_label = PYRAMID_LEVEL_LABELS.get(level, level)
+        fig.update_layout(
+            title=None,
+            annotations=[
+                dict(
+                    text=f"<b>Công suất trung bình theo {level_label} - {nmtd} - {full_start:%d/%m/%Y} - {full_end - pd.Timedelta(days=1):%d/%m/%Y}</b>",
+                    xref='paper', yref='paper', x=0.45, y=1.1,
+                    xanchor='center', yanchor='top', showarrow=False,
+                    font=dict(size=18, color='black')
+                )
+            ],
+            # Giữ nguyên vùng phóng to khi thay dữ liệu (cùng nhà máy và khoảng thời gian)
+            uirevision=f"{ctdl}|{nmtd}|{start_date}|{end_date}",
+            template='plotly_white', height=600, hovermode='x unified',
+            xaxis_title=None, yaxis_title='Giá trị công suất',
+            legend_title_text='MADIEMDO',
+            xaxis=dict(type='date', showgrid=True, gridcolor='lightgrey', griddash='dot',
+                       range=[view_start, view_end] if view else None, autorange=not view),
+            yaxis=dict(showgrid=True, gridcolor='lightgrey', griddash='dot', rangemode='tozero'),
+            margin=dict(l=60, r=40, t=80, b=80),
+            paper_bgcolor='white', plot_bgcolor='#f0f8ff'
+        )
+        return fig, f"✅ Hiển thị {nmtd} theo {level_label}: {view_start:%d/%m/%Y %H:%M} - {view_end:%d/%m/%Y %H:%M}"
+    except Exception as e:
+        status = f"❌ Lỗi khi vẽ biểu đồ khoảng thời gian: {e}"
+        print(status)
+        return go.Figure(), status
+
+
+def update_graph_year(ctdl, nmtd, year):
+    """Biểu đồ cột tổng CS theo tháng của một nhà máy (hoặc cả công ty) từ bảng tổng hợp."""
+    name = 'monthly_company' if nmtd == ALL_NMTD else 'monthly_plant'
+    if name not in rollups:
+        return go.Figure(), f"⚠️ Chưa có bảng tổng hợp '{name}' (chạy 'python -m src.dataset rollups')."
+
+    key = (ctdl, int(year)) if nmtd == ALL_NMTD else (ctdl, nmtd, int(year))
+    monthly = rollups[name].get(key)
+    label = ctdl if nmtd == ALL_NMTD else nmtd
+    if monthly is None or monthly.empty:
+        return go.Figure(), f"ℹ️ Không có dữ liệu tổng hợp cho {label} - {year}."
+
+    try:
+        fig = go.Figure(go.Bar(
+            x=monthly['MONTH'], y=monthly['SUM'],
+            customdata=monthly[['MEAN', 'MIN', 'MAX', 'COUNT']].to_numpy(),
+            hovertemplate=('Tháng %{x}<br>Tổng: %{y:,.2f}<br>TB: %{customdata[0]:.2f}'
+                           '<br>Min: %{customdata[1]:.2f}<br>Max: %{customdata[2]:.2f}'
+                           '<br>Số điểm: %{customdata[3]}<extra></extra>'),
+            marker_color='steelblue'
+        ))
+        fig.update_layout(
+            title=None,
+            annotations=[
+                dict(
+                    text=f"<b>Tổng công suất theo tháng - {label} - {year}</b>",
+                    xref='paper', yref='paper', x=0.45, y=1.1,
+                    xanchor='center', yanchor='top', showarrow=False,
+                    font=dict(size=18, color='black')
+                )
+            ],
+            template='plotly_white', height=600,
+            xaxis=dict(title='Tháng', tickmode='array', tickvals=list(range(1, 13)),
+                       showgrid=True, gridcolor='lightgrey', griddash='dot'),
+            yaxis=dict(title='Tổng công suất', showgrid=True, gridcolor='lightgrey', griddash='dot', rangemode='tozero'),
+            margin=dict(l=60, r=40, t=80, b=80),
+            paper_bgcolor='white', plot_bgcolor='#f0f8ff'
+        )
+        return fig, f"✅ Hiển thị tổng hợp năm cho {label} - {year}"
+    except Exception as e:
+        status = f"❌ Lỗi khi vẽ biểu đồ tổng hợp: {e}"
+        print(status)
+        return go.Figure(), status
+
+
+def update_graph_stats(ctdl, nmtd, madiemdo, year, month):
+    """Dải Min-Max, P25-P75, trung vị và trung bình theo khung giờ của một điểm đo trong tháng."""
+    try:
+        rows = store.query(ctdl, nmtd, year, month, madiemdo=madiemdo, columns=['TIME', 'CS'], dropna=True)
+        if rows.empty:
+            return go.Figure(), f"ℹ️ Không có dữ liệu cho lựa chọn: {nmtd}, {madiemdo}, {month}/{year}."
+        # Ma trận ngày × 48 khung giờ -> mọi thống kê trong một lượt vector hóa
+        matrix, _ = day_slot_matrix(rows['TIME'].to_numpy(), rows['CS'].to_numpy())
+        stats = timeslot_stats(matrix[None], axis=1)
+    except Exception as e:
+        status = f"❌ Lỗi tính toán thống kê: {e}"
+        print(status)
+        return go.Figure(), status
+
+    try:
+        has_data = stats['COUNT'][0] > 0
+        time_slots = [label for label, ok in zip(SLOT_LABELS, has_data) if ok]
+        series = {name: stats[name][0][has_data] for name in ('MIN', 'P25', 'MEDIAN', 'MEAN', 'P75', 'MAX')}
+
+        fig = go.Figure()
+        # 1. Vùng Min-Max
+        fig.add_trace(go.Scatter(x=time_slots, y=series['MAX'], mode='lines', line=dict(width=0),
+                                 showlegend=False, hovertemplate='Max: %{y:.2f}<extra></extra>'))
+        fig.add_trace(go.Scatter(x=time_slots, y=series['MIN'], mode='lines', line=dict(width=0),
+                                 fill='tonexty', fillcolor='rgba(211, 211, 211, 0.5)', name='Min-Max',
+                                 hovertemplate='Min: %{y:.2f}<extra></extra>'))
+        # 2. Vùng P25-P75
+        fig.add_trace(go.Scatter(x=time_slots, y=series['P75'], mode='lines', line=dict(width=0),
+                                 showlegend=False, hovertemplate='P75: %{y:.2f}<extra></extra>'))
+        fig.add_trace(go.Scatter(x=time_slots, y=series['P25'], mode='lines', line=dict(width=0),
+                                 fill='tonexty', fillcolor='rgba(173, 216, 230, 0.6)', name='Tần suất 25-75',
+                                 hovertemplate='P25: %{y:.2f}<extra></extra>'))
+        # 3. Trung vị và trung bình
+        fig.add_trace(go.Scatter(x=time_slots, y=series['MEDIAN'], mode='lines',
+                                 line=dict(color='navy', width=1.5, dash='dash'), name='Trung vị',
+                                 hovertemplate='Median: %{y:.2f}<extra></extra>'))
+        fig.add_trace(go.Scatter(x=time_slots, y=series['MEAN'], mode='lines+markers',
+                                 marker=dict(size=6, color='blue'), line=dict(color='blue', width=2.5),
+                                 name='Trung bình', hovertemplate='Mean: %{y:.2f}<extra></extra>'))
+
+        fig.update_layout(
+            title=None,
+            annotations=[
+                dict(
+                    text=f"<b>Thống kê công suất theo khung giờ - {nmtd} - {madiemdo} - {month}/{year}</b>",
+                    xref='paper', yref='paper', x=0.45, y=1.1,
+                    xanchor='center', yanchor='top', showarrow=False,
+                    font=dict(size=18, color='black')
+                )
+            ],
+            template='plotly_white', height=600, hovermode='x unified',
+            xaxis_title=None, yaxis_title='Giá trị công suất',
+            xaxis=dict(showgrid=True, gridcolor='lightgrey', griddash='dot', tickangle=-45),
+            yaxis=dict(showgrid=True, gridcolor='lightgrey', griddash='dot', rangemode='tozero'),
+            margin=dict(l=60, r=40, t=80, b=80),
+            paper_bgcolor='white', plot_bgcolor='#f0f8ff'
+        )
+        return fig, f"✅ Hiển thị thống kê khung giờ cho {madiemdo} - {month}/{year}"
+    except Exception as e:
+        status = f"❌ Lỗi khi vẽ biểu đồ thống kê: {e}"
+        print(status)
+        return go.Figure(), status
+
+
 # ==================== 5. CHẠY ỨNG DỤNG ====================
 if __name__ == '__main__':
-    # Kiểm tra lại nếu df_sanluong rỗng trước khi chạy server
-    if df_sanluong.empty:
-         print("\n❌ Không có dữ liệu hợp lệ để khởi chạy ứng dụng Dash.")
-         # Bạn có thể thêm logic để hiển thị thông báo lỗi này trên giao diện web nếu muốn
-         # Ví dụ: app.layout = html.Div("Lỗi tải dữ liệu, không thể khởi chạy ứng dụng.")
-         # Hoặc để layout như cũ nhưng biểu đồ sẽ trống và có thông báo lỗi
-         # Trong trường hợp này, ta vẫn chạy server để hiển thị lỗi (nếu có layout)
-         print("\n🚀 Khởi chạy Dash server (với dữ liệu rỗng)...")
-         print("Mở trình duyệt và truy cập: http://127.0.0.1:8050/")
-         app.run(debug=True)
-    else:
-         print("\n🚀 Khởi chạy Dash server...")
-         print("Mở trình duyệt và truy cập: http://127.0.0.1:8050/")
-         app.run(debug=True) # Thay run_server thành run
\ No newline at end of file
+    # Dữ liệu tiếp tục được nạp trong nền: trang mở được ngay, dropdown được điền khi có dữ liệu
+    print("\n🚀 Khởi chạy Dash server (phát triển; production: python -m src.services.dashboard serve --workers N)...")
+    print("Mở trình duyệt và truy cập: http://127.0.0.1:8050/")
+    app.run(debug=True) # Thay run_server thành run
@@ -5,140 +5,61 @@ import warnings
 # Bỏ qua (ignore) các cảnh báo loại PerformanceWarning từ Pandas
 warnings.filterwarnings("ignore", category=pd.errors.PerformanceWarning)
 import os
+import sys
 import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import ipywidgets as widgets
 from IPython.display import display, clear_output, HTML
-import calendar
 import numpy as np
 import time  # Thêm để đo thời gian (tùy chọn)
 
 # ==================== CELL 1: ĐỌC DỮ LIỆU ====================
-print("🔄 Bắt đầu đọc dữ liệu Parquet...")
+# Thêm thư mục gốc dự án vào sys.path để import được package src
+_base_dir = os.path.dirname(os.path.abspath(__file__)) if "__file__" in globals() else os.getcwd()
+sys.path.append(os.path.abspath(os.path.join(_base_dir, "..")))
+from src.config import SANLUONG_STORE_DIR
+from src.dataset import HierarchyIndex, open_sanluong_backend
+from src.features import SLOT_LABELS, day_slot_matrix, timeslot_stats
+from src.plots import downsample_frame
+
+print("🔄 Bắt đầu mở kho sản lượng...")
 start_read_time = time.time()  # Đo thời gian đọc
-parquet_folder = r"C:\Khue\TDN\data\processed"
 
 try:
-    all_files_in_folder = os.listdir(parquet_folder)
-    parquet_files = [
-        os.path.join(parquet_folder, f)
-        for f in all_files_in_folder
-        if f.startswith("sanluong_") and f.endswith(".parquet")
-    ]
+    # Cùng backend với dashboard (models/app.py): kho cột mmap nếu vừa ngân sách bộ nhớ
+    # (TDN_MEMORY_BUDGET_MB), nếu không DuckDB truy vấn thẳng kho Parquet
+    store = open_sanluong_backend()
 
-    if not parquet_files:
-        print(f"⚠️ Không tìm thấy file Parquet trong: {parquet_folder}")
-        df_all = pd.DataFrame()
+    if store.empty:
+        print(f"⚠️ Không có dữ liệu trong kho sản lượng: {SANLUONG_STORE_DIR}")
     else:
-        df_list = []
-        print(f"🔍 Tìm thấy {len(parquet_files)} file Parquet. Bắt đầu đọc...")
-        for i, f in enumerate(parquet_files):
-            try:
-                df_temp = pd.read_parquet(f, engine="pyarrow")
-                # Chỉ đọc các cột thực sự cần thiết ngay từ đầu để tiết kiệm bộ nhớ
-                required_cols_read = ["CTDL", "NMTD", "MADIEMDO", "ENDTIME", "CS"]
-                if all(col in df_temp.columns for col in required_cols_read):
-                    df_list.append(df_temp[required_cols_read])  # Chỉ lấy cột cần thiết
-                else:
-                    print(f"   ⚠️ File {os.path.basename(f)} thiếu cột, bỏ qua.")
-            except Exception as e:
-                print(f"❌ Lỗi đọc file {os.path.basename(f)}: {e}")
-
-        if df_list:
-            print("   Ghép các DataFrame...")
-            df_all = pd.concat(df_list, ignore_index=True)
-            print(f"✅ Đọc và ghép {len(df_list)} file thành công.")
-            print(f"👉 Tổng số dòng: {df_all.shape[0]:,}")
-            print(f"⏱️ Thời gian đọc và ghép: {time.time() - start_read_time:.2f} giây")
-            # Hiển thị thông tin bộ nhớ (tùy chọn)
-            # df_all.info(memory_usage='deep')
-        else:
-            print("❌ Không đọc được file nào thành công.")
-            df_all = pd.DataFrame()
+        print(f"👉 Tổng số dòng: {len(store):,} (backend {store.backend})")
+        print(f"⏱️ Thời gian mở kho: {time.time() - start_read_time:.2f} giây")
 
-except FileNotFoundError:
-    print(f"❌ Lỗi: Không tìm thấy thư mục: {parquet_folder}")
-    df_all = pd.DataFrame()
 except Exception as e:
-    print(f"❌ Lỗi không xác định khi đọc file/thư mục: {e}")
-    df_all = pd.DataFrame()
-
-
-# ==================== CELL 2: TIỀN XỬ LÝ VÀ TỐI ƯU HÓA ====================
-df_sanluong = pd.DataFrame()
-df_sanluong_indexed = pd.DataFrame()
+    print(f"❌ Lỗi không xác định khi đọc kho sản lượng: {e}")
+    store = None
 
-if not df_all.empty:
-    print("\n🔄 Bắt đầu tiền xử lý và tối ưu hóa...")
-    start_process_time = time.time()
-    try:
-        # 1. Đổi tên cột và đảm bảo kiểu dữ liệu datetime
-        df_sanluong = df_all.rename(
-            columns={"ENDTIME": "TIME"}, errors="raise"
-        )  # Đảm bảo cột tồn tại
-        df_sanluong["TIME"] = pd.to_datetime(df_sanluong["TIME"])
-
-        # 2. Đảm bảo kiểu dữ liệu số cho CS và xử lý NaN
-        df_sanluong["CS"] = pd.to_numeric(df_sanluong["CS"], errors="coerce")
-        initial_rows = len(df_sanluong)
-        df_sanluong.dropna(subset=["CS"], inplace=True)
-        removed_rows = initial_rows - len(df_sanluong)
-        if removed_rows > 0:
-            print(f"   ⚠️ Đã loại bỏ {removed_rows:,} dòng có giá trị CS không hợp lệ.")
-
-        # 3. Tạo các cột thời gian cần thiết
-        df_sanluong["YEAR"] = df_sanluong["TIME"].dt.year.astype(
-            "int16"
-        )  # Tối ưu kiểu int
-        df_sanluong["MONTH_NUM"] = df_sanluong["TIME"].dt.month.astype("int8")
-        df_sanluong["DAY_NUM"] = df_sanluong["TIME"].dt.day.astype("int8")
-        df_sanluong["TIME_SLOT"] = df_sanluong["TIME"].dt.strftime("%H:%M")
-
-        # 4. Tối ưu kiểu dữ liệu Categorical cho các cột chuỗi lặp lại
-        df_sanluong["CTDL"] = df_sanluong["CTDL"].astype("category")
-        df_sanluong["NMTD"] = df_sanluong["NMTD"].astype("category")
-        df_sanluong["MADIEMDO"] = df_sanluong["MADIEMDO"].astype("category")
-        df_sanluong["TIME_SLOT"] = df_sanluong["TIME_SLOT"].astype("category")
-
-        # df_sanluong bây giờ chứa tất cả dữ liệu cần thiết với kiểu tối ưu
-        print("   ✅ DataFrame gốc đã được xử lý và tối ưu hóa kiểu dữ liệu.")
-        # df_sanluong.info(memory_usage='deep') # Kiểm tra lại bộ nhớ
-
-        # 5. Tạo DataFrame được Index cho tính toán thống kê nhanh
-        index_cols = ["CTDL", "NMTD", "MADIEMDO", "YEAR", "MONTH_NUM", "DAY_NUM"]
-        # Chỉ cần TIME_SLOT và CS cho df_indexed
-        df_sanluong_indexed = df_sanluong[index_cols + ["TIME_SLOT", "CS"]].copy()
-        # Giữ kiểu category cho index để tiết kiệm bộ nhớ index
-        df_sanluong_indexed.set_index(index_cols, inplace=True)
-        df_sanluong_indexed.sort_index(inplace=True)  # Rất quan trọng cho hiệu năng loc
-        print("   ✅ DataFrame index cho thống kê đã được tạo và sắp xếp.")
-        # df_sanluong_indexed.info(memory_usage='deep')
-
-        print(f"⏱️ Thời gian tiền xử lý: {time.time() - start_process_time:.2f} giây")
 
-    except Exception as e:
-        print(f"❌ Lỗi trong quá trình tiền xử lý: {e}")
-        # Đảm bảo cả hai df đều rỗng nếu có lỗi
-        df_sanluong = pd.DataFrame()
-        df_sanluong_indexed = pd.DataFrame()
-else:
-    print("ℹ️ Không có dữ liệu đầu vào để xử lý.")
+# ==================== CELL 2: CHỈ MỤC TRUY VẤN ====================
+# - Nhà máy/tháng/ngày: searchsorted trên khóa đã sắp xếp của kho -> đoạn dòng liền, đã theo
+#   thời gian; không tạo mask trên toàn bộ dữ liệu, không sort lại mỗi lần chọn dropdown.
+# - Chỉ mục CTDL -> NMTD -> MADIEMDO và các ngày có dữ liệu (dựng sẵn trong kho, tra O(1)).
+hierarchy = store.index if store is not None else HierarchyIndex.from_frame(pd.DataFrame())
 
 # ==================== CELL 3: GIAO DIỆN TƯƠNG TÁC VÀ VẼ BIỂU ĐỒ ====================
 
 # --- Chỉ tiếp tục nếu dữ liệu đã được xử lý thành công ---
-if not df_sanluong.empty and not df_sanluong_indexed.empty:
+if store is not None and not store.empty:
     print("\n🔄 Tạo giao diện tương tác...")
-    # ========== DANH SÁCH CHO DROPDOWN (Lấy từ categories để nhanh hơn) ==========
+    # ========== DANH SÁCH CHO DROPDOWN (Lấy từ chỉ mục phân cấp dựng sẵn) ==========
     try:
-        ctdl_list = sorted(df_sanluong["CTDL"].cat.categories)
-        year_list = sorted(df_sanluong["YEAR"].unique())  # Year là số, dùng unique
-        # Lấy danh sách NMTD ban đầu (tất cả) - sẽ được lọc sau
-        nmtd_list_all = sorted(df_sanluong["NMTD"].cat.categories)
+        ctdl_list = hierarchy.ctdl_list()
+        year_list = hierarchy.years()
     except Exception as e:
         print(f"❌ Lỗi lấy danh sách dropdown: {e}")
-        ctdl_list, year_list, nmtd_list_all = [], [], []
+        ctdl_list, year_list = [], []
 
     # ========== HÀM TẠO DROPDOWN ==========
     def make_dropdown(options, description, width="250px", margin="0px 20px 0px 0px"):
@@ -199,87 +120,36 @@ if not df_sanluong.empty and not df_sanluong_indexed.empty:
         month_dropdown_stat,
     ]
 
-    # ========== CẬP NHẬT NHÀ MÁY (Tối ưu: Lọc trên index category) ==========
-    # Cache để tránh lọc lại NMTD cho cùng CTDL nhiều lần
-    nmtd_cache = {}
-    madiemdo_cache = {}
-
-    def update_nmtd(ctdl_value, dropdown_to_update):
-        global nmtd_cache
-        options = []
-        current_nmtd_value = dropdown_to_update.value
-
-        if ctdl_value:
-            if ctdl_value in nmtd_cache:  # Kiểm tra cache trước
-                options = nmtd_cache[ctdl_value]
-            elif (
-                not df_sanluong_indexed.empty
-            ):  # Chỉ lọc nếu chưa có trong cache và df tồn tại
-                try:
-                    # Lấy NMTD categories từ index con tương ứng với CTDL
-                    # Điều này nhanh hơn .loc[ctdl_value].index... trên df lớn
-                    nmtd_options = (
-                        df_sanluong_indexed.loc[ctdl_value]
-                        .index.get_level_values("NMTD")
-                        .unique()
-                        .tolist()
-                    )
-                    options = sorted(nmtd_options)
-                    nmtd_cache[ctdl_value] = options  # Lưu vào cache
-                except KeyError:
-                    options = []  # CTDL không có trong index
-                except Exception as e:
-                    print(f"Lỗi cập nhật NMTD cache cho '{ctdl_value}': {e}")
-                    options = []
-
-        # Cập nhật dropdown như cũ
+    # ========== CẬP NHẬT DROPDOWN (Tra chỉ mục phân cấp, không lọc DataFrame) ==========
+    def set_options(dropdown_to_update, options):
+        current_value = dropdown_to_update.value
         dropdown_to_update.options = options
         dropdown_to_update.disabled = not bool(options)
-        if current_nmtd_value in options:
-            dropdown_to_update.value = current_nmtd_value
+        if current_value in options:
+            dropdown_to_update.value = current_value
         elif options:
             dropdown_to_update.value = options[0]
         else:
             dropdown_to_update.value = None
 
+    def update_nmtd(ctdl_value, dropdown_to_update):
+        options = hierarchy.nmtd_list(ctdl_value) if ctdl_value else []
+        set_options(dropdown_to_update, options)
+
     def update_madiemdo(ctdl_value, nmtd_value, dropdown_to_update):
-        global madiemdo_cache
         options = []
-        current_madiemdo_value = dropdown_to_update.value
-
         if ctdl_value and nmtd_value:
-            cache_key = f"{ctdl_value}_{nmtd_value}"
-            if cache_key in madiemdo_cache:  # Kiểm tra cache trước
-                options = madiemdo_cache[cache_key]
-            elif not df_sanluong.empty:  # Chỉ lọc nếu chưa có trong cache
-                try:
-                    # Lấy danh sách các mã điểm đo của nhà máy đã chọn
-                    madiemdo_options = (
-                        df_sanluong[
-                            (df_sanluong["CTDL"] == ctdl_value)
-                            & (df_sanluong["NMTD"] == nmtd_value)
-                        ]["MADIEMDO"]
-                        .unique()
-                        .tolist()
-                    )
+            options = hierarchy.madiemdo_list(ctdl_value, nmtd_value)
+        set_options(dropdown_to_update, options)
 
-                    options = sorted(madiemdo_options)
-                    madiemdo_cache[cache_key] = options  # Lưu vào cache
-                except Exception as e:
-                    print(f"Lỗi cập nhật MADIEMDO cache cho '{cache_key}': {e}")
-                    options = []
-
-        # Cập nhật dropdown
-        dropdown_to_update.options = options
-        dropdown_to_update.disabled = not bool(options)
-        if current_madiemdo_value in options:
-            dropdown_to_update.value = current_madiemdo_value
-        elif options:
-            dropdown_to_update.value = options[0]
-        else:
-            dropdown_to_update.value = None
+    def update_months(ctdl_value, nmtd_value, year_value, dropdown_to_update, madiemdo_value=None):
+        # Chỉ hiện các tháng nhà máy (hoặc điểm đo) có dữ liệu trong năm đã chọn
+        options = []
+        if ctdl_value and nmtd_value and year_value:
+            options = hierarchy.months(ctdl_value, nmtd_value, year_value, madiemdo_value)
+        set_options(dropdown_to_update, options)
 
-    # Gắn observe và khởi tạo NMTD (như cũ)
+    # Gắn observe và khởi tạo NMTD
     ctdl_dropdown_month_plot.observe(
         lambda change: update_nmtd(change["new"], nmtd_dropdown_month_plot),
         names="value",
@@ -308,31 +178,58 @@ if not df_sanluong.empty and not df_sanluong_indexed.empty:
             ctdl_dropdown_stat.value, nmtd_dropdown_stat.value, madiemdo_dropdown_stat
         )
 
-    # ========== GIỚI HẠN NGÀY (Như cũ) ==========
+    # ========== GIỚI HẠN THÁNG (Chỉ các tháng có dữ liệu) ==========
+    def update_months_month_plot(*args):
+        update_months(
+            ctdl_dropdown_month_plot.value,
+            nmtd_dropdown_month_plot.value,
+            year_dropdown_month_plot.value,
+            month_dropdown_month_plot,
+        )
+
+    def update_months_day_plot(*args):
+        update_months(
+            ctdl_dropdown_day_plot.value,
+            nmtd_dropdown_day_plot.value,
+            year_dropdown_day_plot.value,
+            month_dropdown_day_plot,
+        )
+
+    def update_months_stat(*args):
+        update_months(
+            ctdl_dropdown_stat.value,
+            nmtd_dropdown_stat.value,
+            year_dropdown_stat.value,
+            month_dropdown_stat,
+            madiemdo_dropdown_stat.value,
+        )
+
+    nmtd_dropdown_month_plot.observe(update_months_month_plot, names="value")
+    year_dropdown_month_plot.observe(update_months_month_plot, names="value")
+    nmtd_dropdown_day_plot.observe(update_months_day_plot, names="value")
+    year_dropdown_day_plot.observe(update_months_day_plot, names="value")
+    madiemdo_dropdown_stat.observe(update_months_stat, names="value")
+    year_dropdown_stat.observe(update_months_stat, names="value")
+    update_months_month_plot()
+    update_months_day_plot()
+    update_months_stat()
+
+    # ========== GIỚI HẠN NGÀY (Chỉ các ngày có dữ liệu) ==========
     def update_day_options(*args):
+        ctdl = ctdl_dropdown_day_plot.value
+        nmtd = nmtd_dropdown_day_plot.value
         year = year_dropdown_day_plot.value
         month = month_dropdown_day_plot.value
-        current_day = day_dropdown_day_plot.value
         day_options = []
-        if year and month:
-            try:
-                max_day = calendar.monthrange(year, month)[1]
-                day_options = list(range(1, max_day + 1))
-            except Exception as e:
-                print(f"Lỗi lấy số ngày {month}/{year}: {e}")
-        day_dropdown_day_plot.options = day_options
-        day_dropdown_day_plot.disabled = not bool(day_options)
-        if current_day in day_options:
-            day_dropdown_day_plot.value = current_day
-        elif day_options:
-            day_dropdown_day_plot.value = 1
-        else:
-            day_dropdown_day_plot.value = None
+        if ctdl and nmtd and year and month:
+            day_options = hierarchy.days(ctdl, nmtd, year, month)
+        set_options(day_dropdown_day_plot, day_options)
 
+    nmtd_dropdown_day_plot.observe(update_day_options, names="value")
     year_dropdown_day_plot.observe(update_day_options, names="value")
     month_dropdown_day_plot.observe(update_day_options, names="value")
-    if year_dropdown_day_plot.value and month_dropdown_day_plot.value:
-        update_day_options()
+    update_day_options()
+
 
     # ========== VÙNG OUTPUT CHUNG ==========
     out = widgets.Output()
@@ -353,21 +250,11 @@ if not df_sanluong.empty and not df_sanluong_indexed.empty:
 
             filtered_df = pd.DataFrame()
             try:
-                # *** Tối ưu lọc: Lọc trên df_sanluong đã tối ưu kiểu dữ liệu ***
-                # Tạo mask boolean hiệu quả
-                mask = (
-                    (df_sanluong["CTDL"] == ctdl)
-                    & (df_sanluong["NMTD"] == nmtd)
-                    & (df_sanluong["YEAR"] == year)
-                    & (df_sanluong["MONTH_NUM"] == month)
-                )
-                if mode == "day":
-                    mask &= df_sanluong["DAY_NUM"] == day
-
-                # Chỉ lấy các cột cần thiết cho vẽ (`TIME`, `CS`, `MADIEMDO`) sau khi lọc
-                filtered_df = df_sanluong.loc[mask, ["TIME", "CS", "MADIEMDO"]].copy()
-                # Sắp xếp theo TIME là cần thiết cho biểu đồ đường
-                filtered_df.sort_values("TIME", inplace=True)
+                # *** Tối ưu lọc: searchsorted trên khóa đã sắp xếp của kho ***
+                # Chỉ sao chép các dòng của nhà máy trong tháng/ngày (đã theo thời gian, bỏ CS NaN)
+                filtered_df = store.query(ctdl, nmtd, year, month, day if mode == "day" else None, dropna=True)
+                # Giảm điểm từng trace về ngân sách DOWNSAMPLE_POINTS (LTTB / min-max)
+                filtered_df = downsample_frame(filtered_df)
 
             except Exception as e:
                 print(f"❌ Lỗi khi lọc dữ liệu cho biểu đồ: {e}")
@@ -463,33 +350,22 @@ if not df_sanluong.empty and not df_sanluong_indexed.empty:
 
             stats_by_time = pd.DataFrame()
             try:
-                # *** Tối ưu lọc: Dùng .loc trên df_sanluong_indexed ***
-                idx_query = (ctdl, nmtd, madiemdo, year, month)
-                # Kiểm tra sự tồn tại của index hiệu quả hơn
-                if idx_query in df_sanluong_indexed.index.droplevel("DAY_NUM").unique():
-                    # .loc trực tiếp trên index đã sắp xếp là rất nhanh
-                    monthly_data = df_sanluong_indexed.loc[
-                        idx_query, ["TIME_SLOT", "CS"]
-                    ]
-
-                    if not monthly_data.empty:
-                        # Group và Agg - bước này thường nhanh trên dữ liệu đã lọc
-                        stats_by_time = monthly_data.groupby(
-                            "TIME_SLOT", observed=True
-                        )["CS"].agg(  # observed=True tăng tốc nếu TIME_SLOT là category
-                            min="min",
-                            p25=lambda x: x.quantile(0.25),
-                            p50="mean",
-                            p75=lambda x: x.quantile(0.75),
-                            max="max",
-                        )
-                        # Sắp xếp index (TIME_SLOT) nếu chưa đúng thứ tự (thường thì groupby giữ nguyên)
-                        stats_by_time = stats_by_time.sort_index()
-                    else:
-                        print("   ℹ️ Không có dữ liệu chi tiết sau khi lọc.")
+                # *** Tối ưu lọc: searchsorted tới đoạn dòng của nhà máy trong tháng, rồi lọc điểm đo ***
+                monthly_data = store.query(ctdl, nmtd, year, month, madiemdo=madiemdo, columns=["TIME", "CS"], dropna=True)
+
+                if not monthly_data.empty:
+                    # Ma trận ngày × khung giờ (NaN ở ô thiếu) -> min/p25/median/mean/p75/max
+                    # cho cả 48 khung giờ trong một lượt vector hóa (không lambda theo nhóm)
+                    matrix, _ = day_slot_matrix(monthly_data["TIME"].to_numpy(), monthly_data["CS"].to_numpy())
+                    stats = timeslot_stats(matrix[None], axis=1)
+                    # Nhãn "HH:MM" chỉ gắn cho tối đa 48 dòng kết quả
+                    stats_by_time = pd.DataFrame(
+                        {name.lower(): values[0] for name, values in stats.items()}, index=SLOT_LABELS
+                    )
+                    stats_by_time = stats_by_time[stats_by_time["count"] > 0]
+                else:
+                    print("   ℹ️ Không có dữ liệu chi tiết sau khi lọc.")
 
-            except KeyError:
-                print("   ℹ️ Không tìm thấy dữ liệu (KeyError).")
             except Exception as e:
                 print(f"❌ Lỗi tính toán thống kê: {e}")
 
@@ -503,7 +379,8 @@ if not df_sanluong.empty and not df_sanluong_indexed.empty:
                 time_slots = stats_by_time.index
                 p25 = stats_by_time["p25"]
                 p75 = stats_by_time["p75"]
-                p50 = stats_by_time["p50"]
+                mean_cs = stats_by_time["mean"]
+                median_cs = stats_by_time["median"]
                 min_cs = stats_by_time["min"]
                 max_cs = stats_by_time["max"]
 
@@ -560,11 +437,23 @@ if not df_sanluong.empty and not df_sanluong_indexed.empty:
                     )
                 )
 
-                # 3. Đường Median (P50) (Màu xanh dương đậm)
+                # 3. Đường trung vị (P50) (nét đứt)
                 fig.add_trace(
                     go.Scatter(
                         x=time_slots,
-                        y=p50,
+                        y=median_cs,
+                        mode="lines",
+                        line=dict(color="navy", width=1.5, dash="dash"),
+                        name="Trung vị",
+                        hovertemplate="Median: %{y:.2f}<extra></extra>",
+                    )
+                )
+
+                # 4. Đường trung bình (Màu xanh dương đậm)
+                fig.add_trace(
+                    go.Scatter(
+                        x=time_slots,
+                        y=mean_cs,
                         mode="lines+markers",
                         marker=dict(size=6, color="blue"),  # Màu xanh dương đậm
                         line=dict(color="blue", width=2.5),  # Dày hơn chút
@@ -849,19 +738,27 @@ if not df_sanluong.empty and not df_sanluong_indexed.empty:
                 ):
                     target_widgets["year"].value = source_widgets["year"].value
 
-                # Đồng bộ Month
+                # Đồng bộ Month (options chỉ gồm các tháng có dữ liệu, cập nhật trước)
+                target_month = target_widgets["month"]
+                update_months(
+                    target_widgets["ctdl"].value,
+                    target_widgets["nmtd"].value,
+                    target_widgets["year"].value,
+                    target_month,
+                    target_widgets["madiemdo"].value if "madiemdo" in target_widgets else None,
+                )
                 if (
                     source_widgets.get("month")
-                    and source_widgets["month"].value is not None
+                    and source_widgets["month"].value in target_month.options
                 ):
-                    target_widgets["month"].value = source_widgets["month"].value
+                    target_month.value = source_widgets["month"].value
 
                 # Nếu chuyển sang tab ngày, cập nhật dropdown ngày
                 if "day" in target_widgets:
                     update_day_options()  # Cập nhật options ngày dựa trên năm/tháng đã chọn
-                    # Mặc định chọn ngày 1 nếu đến từ tab khác
+                    # Mặc định chọn ngày đầu tiên có dữ liệu nếu đến từ tab khác
                     if old_tab_index != 1 and target_widgets["day"].options:
-                        target_widgets["day"].value = 1
+                        target_widgets["day"].value = target_widgets["day"].options[0]
 
             # --- Kích hoạt observer và cập nhật nội dung tab mới ---
             if new_tab_index == 0:
@@ -891,7 +788,7 @@ if not df_sanluong.empty and not df_sanluong_indexed.empty:
             "type": "change",
         }
     )
-elif df_all.empty:
-    print("\n❌ Không có dữ liệu đầu vào từ file Parquet.")
-else:  # df_sanluong hoặc df_sanluong_indexed rỗng
-    print("\n❌ Lỗi tiền xử lý hoặc không có dữ liệu hợp lệ.")
+elif store is None:
+    print("\n❌ Lỗi khi mở kho sản lượng.")
+else:  # Kho rỗng
+    print("\n❌ Không có dữ liệu đầu vào từ kho sản lượng.")
@@ -0,0 +1,94 @@
+import os
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+# Đọc biến môi trường từ file .env (nếu có)
+load_dotenv()
+
+# ==================== ĐƯỜNG DẪN ====================
+PROJ_ROOT = Path(__file__).resolve().parents[1]
+
+# Cho phép trỏ thư mục dữ liệu sang ổ khác qua biến môi trường TDN_DATA_DIR
+DATA_DIR = Path(os.getenv("TDN_DATA_DIR", PROJ_ROOT / "data"))
+RAW_DATA_DIR = DATA_DIR / "raw"
+INTERIM_DATA_DIR = DATA_DIR / "interim"
+PROCESSED_DATA_DIR = DATA_DIR / "processed"
+EXTERNAL_DATA_DIR = DATA_DIR / "external"
+
+MODELS_DIR = PROJ_ROOT / "models"
+REPORTS_DIR = PROJ_ROOT / "reports"
+FIGURES_DIR = REPORTS_DIR / "figures"
+
+# ==================== DỮ LIỆU SẢN LƯỢNG ====================
+# Các năm có file ipp-sanluong-{year}.xlsx
+SANLUONG_YEARS = [2021, 2022, 2023, 2024]
+
+# Cột định danh (lặp lại nhiều) -> lưu dạng dictionary/category
+SANLUONG_ID_COLUMNS = ["CTDL", "NMTD", "MADIEMDO", "DVDL"]
+SANLUONG_TIME_COLUMNS = ["STARTTIME", "ENDTIME"]
+
+# Kho Parquet phân vùng hive YEAR=/MONTH=[/CTDL=], sắp xếp theo SANLUONG_SORT_KEYS
+SANLUONG_STORE_DIR = PROCESSED_DATA_DIR / "sanluong"
+SANLUONG_SORT_KEYS = ["CTDL", "NMTD", "MADIEMDO", "TIME"]
+# Kho cột mmap chỉ đọc dùng chung giữa các worker của dashboard
+SANLUONG_SHARED_DIR = INTERIM_DATA_DIR / "sanluong_shared"
+# Kho dùng chung chỉ gồm năm mới nhất: dashboard phục vụ ngay trong lúc dựng kho đầy đủ
+SANLUONG_LATEST_DIR = INTERIM_DATA_DIR / "sanluong_shared_latest"
+# Backend DuckDB ngoài bộ nhớ: chỉ mục phân cấp dựng sẵn + thư mục tràn đĩa của DuckDB
+SANLUONG_DUCKDB_DIR = INTERIM_DATA_DIR / "sanluong_duckdb"
+# Tensor dày (điểm đo, ngày, 48 khung giờ) float32
+SANLUONG_DENSE_DIR = INTERIM_DATA_DIR / "sanluong_dense"
+# Kim tự tháp đa độ phân giải (2 giờ, ngày, tuần) dựng từ tensor dày, cho biểu đồ theo khoảng thời gian
+SANLUONG_PYRAMID_DIR = INTERIM_DATA_DIR / "sanluong_pyramid"
+# Bảng tổng hợp (ngày/tháng theo điểm đo, nhà máy, công ty) dựng sẵn khi nạp dữ liệu
+ROLLUP_DIR = PROCESSED_DATA_DIR / "rollups"
+
+# Danh sách nhà máy kèm mã 'Lỗi đơn vị' dùng để chuẩn hóa CS
+UNIT_ERROR_REF = PROCESSED_DATA_DIR / "DanhsachNM_sanluong_20250423.xlsx"
+SANLUONG_NORMALIZED = INTERIM_DATA_DIR / "sanluong_chuanhoa.parquet"
+
+# ==================== BÁO CÁO BCSVH (DGMS) ====================
+# Thư mục gốc BCSVH_xlsx/<năm>/<tháng>/*.xlsx
+BCSVH_ROOT = Path(os.getenv("TDN_BCSVH_DIR", r"P:/15. Hệ thống DGMS/Daily Report/Bac/BCSVH_xlsx"))
+# Kho Parquet phân vùng YEAR=/MONTH=, mỗi file nguồn một file Parquet
+BCSVH_STORE_DIR = INTERIM_DATA_DIR / "bcsvh"
+BCSVH_MANIFEST = BCSVH_STORE_DIR / "_manifest.json"
+
+# ==================== CSDL DB_DGM (SQL Server) ====================
+# Chuỗi kết nối ODBC đặt trong .env, không ghi mật khẩu vào mã nguồn
+DGM_SQL_CONN_STR = os.getenv("DGM_SQL_CONN_STR")
+# Bản sao Parquet của các bảng DB_DGM, mỗi bảng một thư mục
+SQL_MIRROR_DIR = EXTERNAL_DATA_DIR / "db_dgm"
+SQL_REFERENCE_TABLES = ["HT_TCT_DIENLUC", "HT_MIEN", "HT_TINH"]
+
+# Số worker mặc định cho các pool xử lý song song
+N_WORKERS = int(os.getenv("TDN_WORKERS", os.cpu_count() or 1))
+
+# Ngân sách bộ nhớ (MB) cho cache kết quả biểu đồ của dashboard (mỗi worker)
+GRAPH_CACHE_MB = int(os.getenv("TDN_GRAPH_CACHE_MB", 256))
+
+# Giảm điểm phía server trước khi vẽ: số điểm tối đa mỗi trace và phương pháp ('lttb' | 'minmax')
+DOWNSAMPLE_POINTS = int(os.getenv("TDN_MAX_POINTS", 2000))
+DOWNSAMPLE_METHOD = os.getenv("TDN_DOWNSAMPLE", "lttb")
+
+# Tác vụ nền của dashboard (Dash background callbacks + diskcache cục bộ, không cần broker)
+DASH_JOB_DIR = Path(os.getenv("TDN_JOB_DIR", INTERIM_DATA_DIR / "dash_jobs"))
+MAX_BACKGROUND_JOBS = int(os.getenv("TDN_MAX_JOBS", max(1, N_WORKERS // 2)))
+JOB_POLL_MS = int(os.getenv("TDN_JOB_POLL_MS", 250))
+
+# Chạy dashboard production (python -m src.services.dashboard serve)
+DASH_HOST = os.getenv("TDN_DASH_HOST", "0.0.0.0")
+DASH_PORT = int(os.getenv("TDN_DASH_PORT", 8050))
+DASH_WORKERS = int(os.getenv("TDN_DASH_WORKERS", N_WORKERS))
+DASH_THREADS = int(os.getenv("TDN_DASH_THREADS", 4))
+DASH_COMPRESS = os.getenv("TDN_DASH_COMPRESS", "1") not in ("0", "false", "False")
+
+# Backend truy vấn sản lượng: 'auto' (theo ngân sách bộ nhớ) | 'memory' (kho cột mmap) | 'duckdb'
+SANLUONG_BACKEND = os.getenv("TDN_BACKEND", "auto")
+# Ngân sách bộ nhớ (MB): dữ liệu vừa ngân sách được dựng thành kho trong bộ nhớ, lớn hơn thì
+# DuckDB đọc thẳng kho Parquet (giới hạn memory_limit, tràn ra đĩa khi cần)
+MEMORY_BUDGET_MB = int(os.getenv("TDN_MEMORY_BUDGET_MB", 4096))
+
+# API truy vấn dạng cột (/api/series, /api/stats): số dòng mỗi record batch / row group gửi về client
+API_CHUNK_ROWS = int(os.getenv("TDN_API_CHUNK_ROWS", 65536))
@@ -0,0 +1,2234 @@
+# -*- coding: utf-8 -*-
+import argparse
+import glob
+import hashlib
+import importlib.util
+import json
+import os
+import queue
+import re
+import shutil
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from datetime import date, datetime, time as dtime
+from decimal import Decimal
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from pandas.api.types import union_categoricals
+
+from src.config import (
+    API_CHUNK_ROWS,
+    BCSVH_MANIFEST,
+    BCSVH_ROOT,
+    BCSVH_STORE_DIR,
+    DGM_SQL_CONN_STR,
+    DOWNSAMPLE_POINTS,
+    N_WORKERS,
+    PROCESSED_DATA_DIR,
+    RAW_DATA_DIR,
+    ROLLUP_DIR,
+    MEMORY_BUDGET_MB,
+    SANLUONG_BACKEND,
+    SANLUONG_DUCKDB_DIR,
+    SANLUONG_ID_COLUMNS,
+    SANLUONG_LATEST_DIR,
+    SANLUONG_NORMALIZED,
+    SANLUONG_PYRAMID_DIR,
+    SANLUONG_DENSE_DIR,
+    SANLUONG_SHARED_DIR,
+    SANLUONG_SORT_KEYS,
+    SANLUONG_STORE_DIR,
+    SANLUONG_TIME_COLUMNS,
+    SANLUONG_YEARS,
+    SQL_MIRROR_DIR,
+    SQL_REFERENCE_TABLES,
+    UNIT_ERROR_REF,
+)
+from src.features import (
+    BCSVH_SLOT_COLUMNS,
+    SLOT_MINUTES,
+    SLOTS_PER_DAY,
+    TIMESLOT_STATS,
+    calendar_codes,
+    timeslot_stats,
+)
+
+# Số dòng mỗi batch khi đọc Excel / mỗi row group khi ghi Parquet
+EXCEL_BATCH_ROWS = 100_000
+# Số dòng đọc thử để suy ra kiểu của các cột không biết trước
+SCHEMA_SAMPLE_ROWS = 1_000
+# Số dòng mỗi row group trong kho phân vùng: đủ nhỏ để min/max CTDL/NMTD/MADIEMDO
+# của mỗi row group chỉ bao một dải hẹp nhà máy, đủ lớn để đọc tuần tự hiệu quả
+STORE_ROW_GROUP_ROWS = 128 * 1024
+
+
+# ==================== 1. CHUYỂN EXCEL SẢN LƯỢNG -> PARQUET ====================
+def _open_workbook(path):
+    # Import trong hàm để các lệnh không dùng Excel không cần openpyxl
+    from openpyxl import load_workbook
+
+    # read_only: đọc dạng stream, không dựng toàn bộ sheet trong bộ nhớ
+    return load_workbook(path, read_only=True, data_only=True)
+
+
+def _iter_sheet_rows(ws):
+    """Trả về (header, iterator các dòng dữ liệu), bỏ qua dòng rỗng hoàn toàn."""
+    rows = ws.iter_rows(values_only=True)
+    header = next(rows, None)
+    if header is None:
+        return [], iter(())
+    header = [str(h).strip() if h is not None else f"COL_{i}" for i, h in enumerate(header)]
+    return header, (r for r in rows if any(v is not None for v in r))
+
+
+def _column_type(name, sample):
+    """Chọn kiểu Arrow cho một cột: cột đã biết theo quy ước, cột khác suy ra từ mẫu."""
+    if name in SANLUONG_TIME_COLUMNS:
+        return pa.timestamp("ns")
+    if name == "CS":
+        return pa.float32()
+    if name in SANLUONG_ID_COLUMNS:
+        return pa.dictionary(pa.int32(), pa.string())
+
+    values = sample.dropna()
+    if values.empty:
+        return pa.string()
+    if pd.api.types.is_datetime64_any_dtype(values) or all(isinstance(v, datetime) for v in values):
+        return pa.timestamp("ns")
+    if pd.to_numeric(values, errors="coerce").notna().all():
+        return pa.float64()
+    return pa.string()
+
+
+def infer_sanluong_schema(path):
+    """Suy ra schema Parquet từ vài nghìn dòng đầu của sheet đầu tiên.
+
+    Schema được chốt một lần rồi truyền cho mọi worker để các sheet của
+    cùng một năm ghi ra cùng một kiểu.
+    """
+    wb = _open_workbook(path)
+    try:
+        ws = wb[wb.sheetnames[0]]
+        header, rows = _iter_sheet_rows(ws)
+        sample = []
+        for r in rows:
+            sample.append(r)
+            if len(sample) >= SCHEMA_SAMPLE_ROWS:
+                break
+    finally:
+        wb.close()
+
+    df = pd.DataFrame.from_records(sample, columns=header)
+    fields = [pa.field(col, _column_type(col, df[col])) for col in header]
+    fields.append(pa.field("NAM", pa.int16()))
+    return pa.schema(fields)
+
+
+def _rows_to_table(rows, header, schema, year):
+    """Ép kiểu ngay khi đọc: thời gian -> datetime, CS -> float32, ID -> dictionary."""
+    df = pd.DataFrame.from_records(rows, columns=header)
+    columns = {}
+    for field in schema:
+        if field.name == "NAM":
+            columns["NAM"] = pa.array([year] * len(df), type=pa.int16())
+            continue
+        if field.name not in df.columns:
+            columns[field.name] = pa.nulls(len(df), type=field.type)
+            continue
+
+        col = df[field.name]
+        if pa.types.is_timestamp(field.type):
+            col = pd.to_datetime(col, errors="coerce")
+        elif pa.types.is_floating(field.type):
+            col = pd.to_numeric(col, errors="coerce")
+        else:
+            col = col.where(col.isna(), col.astype(str))
+        columns[field.name] = pa.array(col, type=field.type, from_pandas=True)
+    return pa.table(columns, schema=schema)
+
+
+def _convert_sheet(path, sheet, part_path, schema, year, batch_rows):
+    """Worker: stream một sheet, ghi từng batch thành một row group của file tạm."""
+    wb = _open_workbook(path)
+    n_rows = 0
+    try:
+        header, rows = _iter_sheet_rows(wb[sheet])
+        with pq.ParquetWriter(part_path, schema, compression="snappy") as writer:
+            batch = []
+            for r in rows:
+                batch.append(r)
+                if len(batch) >= batch_rows:
+                    writer.write_table(_rows_to_table(batch, header, schema, year))
+                    n_rows += len(batch)
+                    batch = []
+            if batch:
+                writer.write_table(_rows_to_table(batch, header, schema, year))
+                n_rows += len(batch)
+    finally:
+        wb.close()
+    return n_rows
+
+
+def _merge_parts(part_paths, out_path, schema):
+    """Nối các file tạm thành một file năm, chép từng row group (không đọc cả năm vào RAM)."""
+    tmp_path = f"{out_path}.tmp"
+    with pq.ParquetWriter(tmp_path, schema, compression="snappy") as writer:
+        for part in part_paths:
+            pf = pq.ParquetFile(part)
+            for i in range(pf.num_row_groups):
+                writer.write_table(pf.read_row_group(i))
+    os.replace(tmp_path, out_path)
+    for part in part_paths:
+        os.remove(part)
+
+
+def convert_sanluong_workbooks(
+    years=SANLUONG_YEARS,
+    raw_dir=RAW_DATA_DIR,
+    out_dir=PROCESSED_DATA_DIR,
+    workers=N_WORKERS,
+    batch_rows=EXCEL_BATCH_ROWS,
+):
+    """Chuyển ipp-sanluong-{year}.xlsx thành sanluong_{year}.parquet.
+
+    Mỗi sheet là một tác vụ trong process pool; worker đọc sheet ở chế độ
+    read-only và ghi Parquet theo từng batch, nên bộ nhớ đỉnh mỗi worker chỉ
+    khoảng một batch. Khi mọi sheet của một năm xong, các file tạm được nối
+    lại theo thứ tự sheet.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    start = time.time()
+
+    # Lập danh sách tác vụ (năm, sheet) trên tất cả các năm để pool luôn bận
+    tasks = []
+    year_info = {}
+    for year in years:
+        path = os.path.join(raw_dir, f"ipp-sanluong-{year}.xlsx")
+        if not os.path.exists(path):
+            print(f"⚠️ Bỏ qua: không tìm thấy file {path}")
+            continue
+        wb = _open_workbook(path)
+        sheets = list(wb.sheetnames)
+        wb.close()
+        schema = infer_sanluong_schema(path)
+        parts = [os.path.join(out_dir, f".sanluong_{year}.part{i:03d}.parquet") for i in range(len(sheets))]
+        year_info[year] = {"schema": schema, "parts": parts, "pending": len(sheets), "rows": 0}
+        for sheet, part in zip(sheets, parts):
+            tasks.append((year, path, sheet, part, schema))
+        print(f"🔍 {os.path.basename(path)}: {len(sheets)} sheet")
+
+    if not tasks:
+        print("❌ Không có file Excel nào để chuyển đổi.")
+        return []
+
+    outputs = []
+    with ProcessPoolExecutor(max_workers=max(1, min(workers, len(tasks)))) as pool:
+        futures = {
+            pool.submit(_convert_sheet, path, sheet, part, schema, year, batch_rows): (year, sheet)
+            for year, path, sheet, part, schema in tasks
+        }
+        for fut in as_completed(futures):
+            year, sheet = futures[fut]
+            info = year_info[year]
+            info["rows"] += fut.result()
+            info["pending"] -= 1
+            print(f"   ✅ {year} - sheet '{sheet}' xong")
+            if info["pending"] == 0:
+                out_path = os.path.join(out_dir, f"sanluong_{year}.parquet")
+                _merge_parts(info["parts"], out_path, info["schema"])
+                outputs.append(out_path)
+                print(f"💾 Đã lưu {out_path} ({info['rows']:,} dòng)")
+
+    print(f"⏱️ Thời gian chuyển đổi: {time.time() - start:.2f} giây")
+    return outputs
+
+
+# ==================== 2. KHO PARQUET PHÂN VÙNG ====================
+def _store_partitioning(partition_ctdl=False):
+    fields = [pa.field("YEAR", pa.int16()), pa.field("MONTH", pa.int8())]
+    if partition_ctdl:
+        fields.append(pa.field("CTDL", pa.string()))
+    return ds.partitioning(pa.schema(fields), flavor="hive")
+
+
+def _sort_codes(column):
+    """Mã số nguyên có cùng thứ tự với giá trị của cột (kể cả cột dictionary)."""
+    if pa.types.is_dictionary(column.type):
+        column = column.combine_chunks() if isinstance(column, pa.ChunkedArray) else column
+        values = column.dictionary.to_numpy(zero_copy_only=False).astype(str)
+        rank = np.empty(len(values), dtype=np.int64)
+        rank[np.argsort(values, kind="stable")] = np.arange(len(values))
+        indices = column.indices.fill_null(-1).to_numpy()
+        # Giá trị null xếp cuối
+        return np.where(indices >= 0, rank[np.maximum(indices, 0)], len(values))
+    return pc.fill_null(column, pc.max(column)).to_numpy(zero_copy_only=False)
+
+
+def _sort_table(table, keys):
+    """Sắp xếp Table theo nhiều khóa; Arrow chưa sort được cột dictionary nên dùng np.lexsort."""
+    order = np.lexsort([_sort_codes(table.column(k)) for k in reversed(keys)])
+    return table.take(order)
+
+
+def _remove_source_files(store_dir, stem):
+    """Xóa các file do một file nguồn ghi ra trước đó (mọi partition) và thư mục partition đã rỗng."""
+    for path in glob.glob(os.path.join(glob.escape(str(store_dir)), "**", f"{glob.escape(stem)}-*.parquet"), recursive=True):
+        os.remove(path)
+        parent = os.path.dirname(path)
+        while os.path.normpath(parent) != os.path.normpath(str(store_dir)) and not os.listdir(parent):
+            os.rmdir(parent)
+            parent = os.path.dirname(parent)
+
+
+def write_sanluong_store(
+    src_files=None,
+    store_dir=SANLUONG_STORE_DIR,
+    partition_ctdl=False,
+    row_group_rows=STORE_ROW_GROUP_ROWS,
+):
+    """Ghi kho sản lượng phân vùng hive YEAR=/MONTH=[/CTDL=] từ các file sanluong_{year}.parquet.
+
+    - ENDTIME được đổi tên thành TIME.
+    - Trong mỗi file, dòng được sắp theo CTDL/NMTD/MADIEMDO/TIME nên thống kê
+      min/max của từng row group cho phép bỏ qua phần lớn file khi lọc.
+    - Xử lý từng năm một: bộ nhớ đỉnh khoảng một file năm.
+    - Mỗi file nguồn sở hữu các file {stem}-*.parquet của nó trong mọi partition: ghi lại một năm
+      chỉ xóa file của chính năm đó. File năm N có dòng ENDTIME = 01/01/N+1 00:00 (chu kỳ cuối
+      của năm N) nằm trong partition YEAR=N+1/MONTH=1, dùng chung với file năm N+1; xóa theo
+      partition (delete_matching) sẽ làm mất dòng này.
+    """
+    if src_files is None:
+        src_files = sorted(glob.glob(os.path.join(PROCESSED_DATA_DIR, "sanluong_*.parquet")))
+    if not src_files:
+        print(f"❌ Không tìm thấy file 'sanluong_*.parquet' trong {PROCESSED_DATA_DIR}")
+        return
+
+    start = time.time()
+    partitioning = _store_partitioning(partition_ctdl)
+    file_options = ds.ParquetFileFormat().make_write_options(compression="snappy")
+    for f in src_files:
+        table = pq.read_table(f)
+        if "ENDTIME" in table.column_names:
+            table = table.rename_columns(["TIME" if c == "ENDTIME" else c for c in table.column_names])
+        table = table.filter(pc.is_valid(table.column("TIME")))
+        table = table.append_column("YEAR", pc.year(table.column("TIME")).cast(pa.int16()))
+        table = table.append_column("MONTH", pc.month(table.column("TIME")).cast(pa.int8()))
+        if partition_ctdl and pa.types.is_dictionary(table.schema.field("CTDL").type):
+            table = table.set_column(
+                table.schema.get_field_index("CTDL"), "CTDL", table.column("CTDL").cast(pa.string())
+            )
+        table = _sort_table(table, ["YEAR", "MONTH"] + SANLUONG_SORT_KEYS)
+
+        stem = os.path.splitext(os.path.basename(f))[0]
+        _remove_source_files(store_dir, stem)
+        ds.write_dataset(
+            table,
+            store_dir,
+            format="parquet",
+            partitioning=partitioning,
+            basename_template=f"{stem}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore",
+            file_options=file_options,
+            min_rows_per_group=row_group_rows,
+            max_rows_per_group=row_group_rows,
+            preserve_order=True,
+        )
+        print(f"   ✅ {os.path.basename(f)} -> {store_dir} ({table.num_rows:,} dòng)")
+        del table
+
+    print(f"⏱️ Thời gian ghi kho phân vùng: {time.time() - start:.2f} giây")
+
+
+def sanluong_dataset(store_dir=SANLUONG_STORE_DIR):
+    """Mở kho phân vùng dưới dạng pyarrow Dataset (chưa đọc dữ liệu)."""
+    partition_ctdl = bool(glob.glob(os.path.join(store_dir, "YEAR=*", "MONTH=*", "CTDL=*")))
+    return ds.dataset(store_dir, format="parquet", partitioning=_store_partitioning(partition_ctdl))
+
+
+def period_years(times):
+    """Các năm có chu kỳ dữ liệu, theo thời điểm bắt đầu chu kỳ (TIME - 30'): dòng 01/01/N+1 00:00
+    là chu kỳ cuối của năm N, không tính là dữ liệu của năm N+1."""
+    starts = np.asarray(times, dtype="datetime64[ns]") - np.timedelta64(SLOT_MINUTES, "m")
+    starts = starts[~np.isnat(starts)]
+    return sorted(int(y) + 1970 for y in np.unique(starts.astype("datetime64[Y]").astype(np.int64)))
+
+
+def _partition_has_periods(year_dir, year):
+    """Partition YEAR=... có chu kỳ bắt đầu trong năm không (max TIME > 01/01 00:00), chỉ đọc footer."""
+    first = np.datetime64(date(year, 1, 1), "ns")
+    for path in glob.glob(os.path.join(glob.escape(year_dir), "**", "*.parquet"), recursive=True):
+        meta = pq.read_metadata(path)
+        col = meta.schema.to_arrow_schema().get_field_index("TIME")
+        for i in range(meta.num_row_groups):
+            stats = meta.row_group(i).column(col).statistics if col >= 0 else None
+            # Thiếu thống kê: không biết chắc -> coi như có dữ liệu
+            if stats is None or not stats.has_min_max or np.datetime64(stats.max, "ns") > first:
+                return True
+    return False
+
+
+def sanluong_years(store_dir=SANLUONG_STORE_DIR):
+    """Các năm có dữ liệu (theo thư mục YEAR=... hoặc file sanluong_{year}.parquet), không đọc dữ liệu.
+
+    Partition chỉ chứa dòng 00:00 ngày 01/01 (chu kỳ cuối của năm trước) không được tính.
+    """
+    if os.path.isdir(store_dir):
+        years = []
+        for year_dir in glob.glob(os.path.join(glob.escape(str(store_dir)), "YEAR=*")):
+            m = re.search(r"YEAR=(\d+)$", year_dir)
+            if m and _partition_has_periods(year_dir, int(m.group(1))):
+                years.append(int(m.group(1)))
+        return sorted(years)
+    names = glob.glob(os.path.join(PROCESSED_DATA_DIR, "sanluong_*.parquet"))
+    return sorted({int(m.group(1)) for m in (re.search(r"sanluong_(\d{4})\.parquet$", n) for n in names) if m})
+
+
+def _sanluong_filter(years=None, months=None, ctdl=None):
+    """Biểu thức lọc: years là một năm hoặc (năm_đầu, năm_cuối); months/ctdl là giá trị hoặc list."""
+    expr = None
+
+    def _and(e):
+        return e if expr is None else expr & e
+
+    if years is not None:
+        if isinstance(years, (tuple, list)):
+            expr = _and((ds.field("YEAR") >= years[0]) & (ds.field("YEAR") <= years[-1]))
+        else:
+            expr = _and(ds.field("YEAR") == years)
+    if months is not None:
+        months = months if isinstance(months, (tuple, list)) else [months]
+        expr = _and(ds.field("MONTH").isin(list(months)))
+    if ctdl is not None:
+        ctdl = ctdl if isinstance(ctdl, (tuple, list)) else [ctdl]
+        expr = _and(ds.field("CTDL").isin(list(ctdl)))
+    return expr
+
+
+def read_sanluong(columns=None, years=None, months=None, ctdl=None, store_dir=SANLUONG_STORE_DIR):
+    """Đọc sản lượng với cột và bộ lọc được đẩy xuống pyarrow.
+
+    Chỉ các partition YEAR/MONTH (và CTDL) khớp được mở; trong file, row
+    group bị loại theo thống kê min/max trước khi giải nén. Cột dictionary
+    được trả về dạng category.
+    """
+    expr = _sanluong_filter(years, months, ctdl)
+    if os.path.isdir(store_dir):
+        dataset = sanluong_dataset(store_dir)
+        table = dataset.to_table(columns=columns, filter=expr)
+        # CTDL lấy từ tên thư mục partition là string -> đưa về dictionary như các cột ID khác
+        if "CTDL" in table.column_names and not pa.types.is_dictionary(table.schema.field("CTDL").type):
+            idx = table.schema.get_field_index("CTDL")
+            table = table.set_column(idx, "CTDL", table.column("CTDL").dictionary_encode())
+        return table.to_pandas()
+
+    # Chưa dựng kho phân vùng: đọc các file năm cũ (vẫn chỉ đọc các cột cần thiết)
+    legacy = sorted(glob.glob(os.path.join(PROCESSED_DATA_DIR, "sanluong_*.parquet")))
+    if not legacy:
+        print(f"⚠️ Chưa có kho {store_dir} và không có file 'sanluong_*.parquet'")
+        return pd.DataFrame(columns=columns)
+    print(f"⚠️ Chưa có kho {store_dir}, đọc file năm (chạy 'python -m src.dataset store' để tăng tốc)")
+    read_cols = None if columns is None else ["ENDTIME" if c == "TIME" else c for c in columns if c not in ("YEAR", "MONTH")]
+    dataset = ds.dataset(legacy, format="parquet")
+    table = dataset.to_table(columns=read_cols)
+    if "ENDTIME" in table.column_names:
+        table = table.rename_columns(["TIME" if c == "ENDTIME" else c for c in table.column_names])
+    table = table.append_column("YEAR", pc.year(table.column("TIME")).cast(pa.int16()))
+    table = table.append_column("MONTH", pc.month(table.column("TIME")).cast(pa.int8()))
+    if expr is not None:
+        table = table.filter(expr)
+    if columns is not None:
+        table = table.select(columns)
+    return table.to_pandas()
+
+
+# ==================== 3. NẠP VÀ TIỀN XỬ LÝ SONG SONG ====================
+FRAME_COLUMNS = ["CTDL", "NMTD", "MADIEMDO", "TIME", "CS"]
+FRAME_CATEGORY_COLUMNS = ["CTDL", "NMTD", "MADIEMDO"]
+
+
+def _read_piece(piece, columns, expr, schema):
+    """Đọc một mảnh: fragment của kho phân vùng hoặc đường dẫn file năm cũ."""
+    if isinstance(piece, str):
+        table = pq.read_table(piece, columns=["ENDTIME" if c == "TIME" else c for c in columns])
+        return table.rename_columns(["TIME" if c == "ENDTIME" else c for c in table.column_names])
+    return piece.to_table(schema=schema, columns=columns, filter=expr)
+
+
+def _sorted_categorical(values):
+    """Category với danh sách category đã sắp xếp (mã số cùng thứ tự với giá trị)."""
+    if isinstance(values, pa.ChunkedArray):
+        values = values.combine_chunks()
+    if not pa.types.is_dictionary(values.type):
+        values = values.dictionary_encode()
+    cat = pd.Categorical.from_codes(
+        values.indices.fill_null(-1).to_numpy(zero_copy_only=False),
+        categories=pd.Index(values.dictionary.to_numpy(zero_copy_only=False)),
+    ).remove_unused_categories()
+    return cat.reorder_categories(sorted(cat.categories))
+
+
+def _frame_sort_key(ctdl_codes, nmtd_codes, time_ns):
+    """Khóa int64 (CTDL, NMTD, phút) cùng thứ tự với sắp xếp theo CTDL/NMTD/TIME.
+
+    Mã category được cộng 1: mã -1 (CTDL/NMTD null) thành 0 thay vì tràn dấu khi dịch bit
+    và ghi đè các bit phía trên; dòng null xếp trước mọi nhà máy.
+    """
+    ctdl = ctdl_codes.astype(np.int64) + 1
+    nmtd = nmtd_codes.astype(np.int64) + 1
+    minutes = (time_ns // 60_000_000_000).astype(np.int64)
+    if len(ctdl) and (
+        ctdl.min() < 0 or ctdl.max() >= 1 << 15 or nmtd.min() < 0 or nmtd.max() >= 1 << 16
+        or minutes.min() < 0 or minutes.max() >= 1 << 32
+    ):
+        raise ValueError("Số CTDL/NMTD hoặc TIME vượt quá giới hạn của khóa sắp xếp")
+    return (ctdl << 48) | (nmtd << 32) | minutes
+
+
+def _preprocess_piece(piece, columns, expr, schema):
+    """Worker: đọc + tiền xử lý + sắp xếp một mảnh; trả về DataFrame đã sắp xếp."""
+    table = _read_piece(piece, columns, expr, schema)
+    table = table.filter(pc.is_valid(table.column("TIME")))
+    data = {}
+    for col in columns:
+        if col in FRAME_CATEGORY_COLUMNS:
+            data[col] = _sorted_categorical(table.column(col))
+        elif col == "CS":
+            data[col] = pc.cast(table.column(col), pa.float32()).to_numpy(zero_copy_only=False)
+        else:
+            data[col] = table.column(col).to_pandas()
+    del table
+    df = pd.DataFrame(data)
+    times = df["TIME"].astype("datetime64[ns]")
+    df["TIME"] = times
+    df["YEAR"], df["MONTH_NUM"], df["DAY_NUM"], df["SLOT"] = calendar_codes(times.to_numpy())
+
+    key = _frame_sort_key(df["CTDL"].cat.codes.to_numpy(), df["NMTD"].cat.codes.to_numpy(), times.to_numpy().view(np.int64))
+    order = np.argsort(key, kind="stable")
+    return df.take(order).reset_index(drop=True)
+
+
+def _merge_pieces(pieces):
+    """Gộp các mảnh đã sắp xếp.
+
+    - Cột category: union_categoricals với category đã sắp xếp, chỉ ánh xạ lại
+      mã số, không tạo cột object trung gian.
+    - Thứ tự: argsort kind="stable" (timsort) trên khóa nối liền nhận ra k đoạn
+      đã sắp xếp sẵn và trộn chúng, tức là k-way merge O(n log k) thay vì sắp
+      xếp lại từ đầu.
+    """
+    pieces = [p for p in pieces if len(p)]
+    if not pieces:
+        return pd.DataFrame()
+    if len(pieces) == 1:
+        return pieces[0]
+
+    data = {}
+    for col in pieces[0].columns:
+        if isinstance(pieces[0][col].dtype, pd.CategoricalDtype):
+            data[col] = union_categoricals([p[col] for p in pieces], sort_categories=True)
+        else:
+            data[col] = np.concatenate([p[col].to_numpy() for p in pieces])
+    pieces.clear()
+
+    key = _frame_sort_key(data["CTDL"].codes, data["NMTD"].codes, data["TIME"].view(np.int64))
+    order = np.argsort(key, kind="stable")
+    return pd.DataFrame({col: values.take(order) for col, values in data.items()})
+
+
+def _sanluong_pieces(years, months, ctdl, store_dir):
+    """Các mảnh cần đọc (fragment của kho phân vùng hoặc file năm cũ) + biểu thức lọc + schema."""
+    expr = _sanluong_filter(years, months, ctdl)
+    if os.path.isdir(store_dir):
+        dataset = sanluong_dataset(store_dir)
+        return list(dataset.get_fragments(filter=expr)), expr, dataset.schema
+    pieces = sorted(glob.glob(os.path.join(PROCESSED_DATA_DIR, "sanluong_*.parquet")))
+    if expr is not None:
+        print("⚠️ Chưa có kho phân vùng, bỏ qua bộ lọc năm/tháng/CTDL khi đọc file năm")
+    return pieces, None, None
+
+
+def load_sanluong_frame(
+    columns=FRAME_COLUMNS,
+    years=None,
+    months=None,
+    ctdl=None,
+    store_dir=SANLUONG_STORE_DIR,
+    workers=N_WORKERS,
+):
+    """Nạp và tiền xử lý sản lượng song song, trả về DataFrame đã sắp theo CTDL/NMTD/TIME.
+
+    Mỗi file (partition) được đọc và tiền xử lý trong một thread: TIME
+    datetime64, YEAR int16, MONTH_NUM/DAY_NUM/SLOT int8, CS float32, ID category.
+    Giải mã Parquet của pyarrow và các phép toán numpy nhả GIL nên thread
+    chạy song song thật, lại không phải pickle kết quả về tiến trình chính.
+    Kết quả đã đúng thứ tự index (CTDL, NMTD, YEAR, MONTH_NUM, DAY_NUM) nên
+    set_index không cần sort_index.
+    """
+    start = time.time()
+    pieces, expr, schema = _sanluong_pieces(years, months, ctdl, store_dir)
+    if not pieces:
+        print(f"⚠️ Không có dữ liệu sản lượng trong {store_dir}")
+        return pd.DataFrame()
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(pieces)))) as pool:
+        results = list(pool.map(lambda p: _preprocess_piece(p, list(columns), expr, schema), pieces))
+    df = _merge_pieces(results)
+    print(f"✅ Đã nạp {len(pieces)} mảnh, {len(df):,} dòng trong {time.time() - start:.2f} giây")
+    return df
+
+
+# ==================== 4. NẠP BÁO CÁO BCSVH (DGMS) THEO NGÀY ====================
+# Vị trí bảng "Báo cáo sau vận hành" trong file báo cáo ngày, theo loại file
+BCSVH_LAYOUTS = {
+    "-A1": dict(skiprows=162, usecols="A:BC", nrows=860),
+    "-NPC": dict(skiprows=92, usecols="A:BC", nrows=726),
+}
+BCSVH_REPORT_TYPE = "Báo cáo sau vận hành"
+# Schema cố định của mọi file BCSVH: kiểu không phụ thuộc nội dung từng file
+# (cột toàn NaN, ngày không đọc được...) nên đọc chung cả kho không bị lệch kiểu.
+# "Q.ĐK" là mã (A1, PC_BACKAN...) nên giữ dạng chuỗi như các cột định danh khác.
+BCSVH_SCHEMA = pa.schema(
+    [
+        pa.field("Code", pa.string()),
+        pa.field("Nhà máy", pa.string()),
+        pa.field("P.Đặt", pa.float32()),
+        pa.field("Q.ĐK", pa.string()),
+        pa.field("Điện lực", pa.string()),
+        pa.field("Ngày", pa.timestamp("ns")),
+    ]
+    + [pa.field(c, pa.float32()) for c in BCSVH_SLOT_COLUMNS]
+)
+# Tăng khi cách đọc/ghi file BCSVH thay đổi: các file đã nạp bằng phiên bản cũ được đọc lại
+BCSVH_PARSER_VERSION = 3
+
+
+def _bcsvh_layout(filename):
+    for tag, layout in BCSVH_LAYOUTS.items():
+        if tag in filename:
+            return layout
+    return None
+
+
+def _file_sha256(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _bcsvh_day(filename, year):
+    """Ngày báo cáo lấy từ tên file (yyyy.mm.dd), năm lấy theo thư mục năm như notebook gốc."""
+    m = re.search(r"(\d{4})\.(\d{2})\.(\d{2})", filename)
+    if not m:
+        return None
+    return pd.Timestamp(year=int(year), month=int(m.group(2)), day=int(m.group(3)))
+
+
+def _parse_bcsvh_file(path, year, out_path, known_hash):
+    """Worker: băm file, nếu nội dung đổi thì đọc bảng BCSVH và ghi ra một file Parquet.
+
+    Trả về (sha256, số dòng); số dòng là None nếu nội dung không đổi.
+    """
+    digest = _file_sha256(path)
+    if digest == known_hash:
+        return digest, None
+
+    filename = os.path.basename(path)
+    df = pd.read_excel(path, **_bcsvh_layout(filename))
+    # Tiêu đề khung giờ có thể được Excel đọc thành datetime.time
+    df.columns = [c.strftime("%H:%M") if isinstance(c, dtime) else str(c).strip() for c in df.columns]
+    df = df[df["Loại"] == BCSVH_REPORT_TYPE]
+    df = df.drop(columns=["Loại", "Trạng thái"], errors="ignore")
+    # Chỉ giữ dữ liệu đến cột "00:00"
+    df = df.loc[:, :"00:00"]
+
+    df["Ngày"] = pd.Series(_bcsvh_day(filename, year), index=df.index, dtype="datetime64[ns]")
+
+    # Ép từng cột về BCSVH_SCHEMA; cột thiếu trong file ghi thành null
+    arrays = []
+    for field in BCSVH_SCHEMA:
+        if field.name not in df.columns:
+            arrays.append(pa.nulls(len(df), type=field.type))
+            continue
+        values = df[field.name]
+        if pa.types.is_floating(field.type):
+            values = pd.to_numeric(values, errors="coerce").astype("float32")
+        elif pa.types.is_string(field.type):
+            values = values.astype(object).where(values.isna(), values.astype(str))
+        arrays.append(pa.array(values, type=field.type, from_pandas=True))
+    table = pa.Table.from_arrays(arrays, schema=BCSVH_SCHEMA)
+
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    tmp_path = f"{out_path}.tmp"
+    pq.write_table(table, tmp_path, compression="snappy")
+    os.replace(tmp_path, out_path)
+    return digest, table.num_rows
+
+
+def _load_manifest(path):
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    return {}
+
+
+def _save_manifest(manifest, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def _scan_bcsvh(root):
+    """Liệt kê (năm, tháng, đường dẫn) của các file báo cáo ngày BCSVH_xlsx/<năm>/<tháng>/."""
+    for year in sorted(os.listdir(root)):
+        year_path = os.path.join(root, year)
+        if not (os.path.isdir(year_path) and year.isdigit()):
+            continue
+        for month in range(1, 13):
+            folder_path = os.path.join(year_path, f"{month:02d}")
+            if not os.path.isdir(folder_path):
+                continue
+            for file in sorted(os.listdir(folder_path)):
+                if file.endswith(".xlsx") and not file.startswith("~$") and _bcsvh_layout(file):
+                    yield int(year), month, os.path.join(folder_path, file)
+
+
+def ingest_bcsvh(root=BCSVH_ROOT, store_dir=BCSVH_STORE_DIR, manifest_path=BCSVH_MANIFEST, workers=N_WORKERS):
+    """Nạp tăng dần các báo cáo BCSVH ngày vào kho Parquet YEAR=/MONTH=.
+
+    Manifest lưu (size, mtime, sha256) của mỗi file đã nạp:
+    - size/mtime không đổi -> bỏ qua, không mở file;
+    - đổi -> băm lại trong worker, chỉ đọc Excel khi nội dung thực sự đổi;
+    - file nguồn bị xóa -> xóa file Parquet tương ứng;
+    - file nạp bằng BCSVH_PARSER_VERSION cũ -> đọc lại.
+    Mỗi file nguồn ghi ra đúng một file Parquet nên nạp lại là ghi đè, không trùng dữ liệu.
+    """
+    start = time.time()
+    if not os.path.isdir(root):
+        print(f"❌ Không tìm thấy thư mục BCSVH: {root}")
+        return {}
+    manifest = _load_manifest(manifest_path)
+
+    tasks = []
+    seen = set()
+    for year, month, path in _scan_bcsvh(root):
+        rel = os.path.relpath(path, root).replace(os.sep, "/")
+        seen.add(rel)
+        st = os.stat(path)
+        entry = manifest.get(rel)
+        current = entry is not None and entry.get("version") == BCSVH_PARSER_VERSION
+        if current and entry["size"] == st.st_size and entry["mtime"] == st.st_mtime:
+            continue
+        stem = os.path.splitext(os.path.basename(path))[0]
+        out_path = os.path.join(store_dir, f"YEAR={year}", f"MONTH={month}", f"{stem}.parquet")
+        tasks.append((rel, path, year, out_path, st, entry.get("sha256") if current else None))
+
+    # File nguồn đã bị xóa
+    for rel in set(manifest) - seen:
+        out_path = manifest.pop(rel)["output"]
+        if os.path.exists(out_path):
+            os.remove(out_path)
+        print(f"🗑️ Đã xóa dữ liệu của file không còn tồn tại: {rel}")
+
+    n_parsed = 0
+    if tasks:
+        print(f"🔍 {len(tasks)} file mới hoặc đã thay đổi")
+        with ProcessPoolExecutor(max_workers=max(1, min(workers, len(tasks)))) as pool:
+            futures = {
+                pool.submit(_parse_bcsvh_file, path, year, out_path, known_hash): (rel, out_path, st)
+                for rel, path, year, out_path, st, known_hash in tasks
+            }
+            for fut in as_completed(futures):
+                rel, out_path, st = futures[fut]
+                try:
+                    digest, n_rows = fut.result()
+                except Exception as e:
+                    print(f"⚠️ Lỗi khi đọc file {rel}: {e}")
+                    continue
+                entry = manifest.get(rel, {})
+                if n_rows is not None:
+                    n_parsed += 1
+                    entry["rows"] = n_rows
+                entry.update(
+                    size=st.st_size, mtime=st.st_mtime, sha256=digest, output=out_path, version=BCSVH_PARSER_VERSION
+                )
+                manifest[rel] = entry
+
+    _save_manifest(manifest, manifest_path)
+    print(f"✅ Đã nạp {n_parsed} file ({len(manifest)} file trong manifest) trong {time.time() - start:.2f} giây")
+    return manifest
+
+
+def read_bcsvh(years=None, months=None, columns=None, store_dir=BCSVH_STORE_DIR):
+    """Đọc kho BCSVH dạng rộng (mỗi dòng một nhà máy - một ngày, 48 cột khung giờ)."""
+    if not os.path.isdir(store_dir):
+        print(f"⚠️ Chưa có kho BCSVH: {store_dir}")
+        return pd.DataFrame()
+    partitioning = _store_partitioning()
+    schema = pa.unify_schemas([BCSVH_SCHEMA, partitioning.schema])
+    dataset = ds.dataset(store_dir, format="parquet", partitioning=partitioning, schema=schema)
+    return dataset.to_table(columns=columns, filter=_sanluong_filter(years, months)).to_pandas()
+
+
+# ==================== 5. CHUẨN HÓA LỖI ĐƠN VỊ ====================
+def normalize_sanluong_store(
+    ref_path=UNIT_ERROR_REF, out_path=SANLUONG_NORMALIZED, store_dir=SANLUONG_STORE_DIR, years=None
+):
+    """Stream kho sản lượng theo batch, chuẩn hóa CS theo 'Lỗi đơn vị' và ghi ra một file Parquet."""
+    from src.features import normalize_parquet, unit_scale_map
+
+    start = time.time()
+    df_ref = pd.read_excel(ref_path, sheet_name="Sheet1", usecols="A:D")
+    scale = unit_scale_map(df_ref)
+    dataset = sanluong_dataset(store_dir)
+    if years is not None:
+        dataset = dataset.filter(_sanluong_filter(years))
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    n_rows = normalize_parquet(dataset, out_path, scale)
+    print(f"✅ Đã chuẩn hóa {n_rows:,} dòng -> {out_path} trong {time.time() - start:.2f} giây")
+    return out_path
+
+
+# ==================== 6. TRÍCH XUẤT SQL SERVER -> PARQUET ====================
+SQL_CHUNK_ROWS = 50_000
+
+# Kiểu Python mà driver DB-API (pyodbc) báo trong cursor.description -> kiểu Arrow
+_SQL_ARROW_TYPES = {
+    str: pa.string(),
+    int: pa.int64(),
+    float: pa.float64(),
+    bool: pa.bool_(),
+    datetime: pa.timestamp("us"),
+    date: pa.date32(),
+    bytes: pa.binary(),
+    bytearray: pa.binary(),
+}
+
+
+class ConnectionPool:
+    """Pool kết nối DB-API dùng lại giữa các lần truy vấn.
+
+    connect là hàm không tham số trả về một kết nối mới (pyodbc.connect,
+    sqlite3.connect, ...). Kết nối lỗi bị đóng thay vì trả lại pool.
+    """
+
+    def __init__(self, connect, size=4):
+        self._connect = connect
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            yield conn
+        except Exception:
+            conn.close()
+            raise
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+def sql_server_pool(conn_str=DGM_SQL_CONN_STR, size=4):
+    """Pool kết nối SQL Server qua pyodbc, chuỗi kết nối mặc định lấy từ DGM_SQL_CONN_STR (.env)."""
+    import pyodbc
+
+    if not conn_str:
+        raise ValueError("Chưa cấu hình DGM_SQL_CONN_STR trong file .env")
+    return ConnectionPool(lambda: pyodbc.connect(conn_str), size=size)
+
+
+def _sql_schema(description, first_rows):
+    """Schema Arrow từ cursor.description; cột không rõ kiểu thì suy ra từ chunk đầu."""
+    fields = []
+    for i, col in enumerate(description):
+        name, type_code = col[0], col[1]
+        if type_code is Decimal and col[4] and col[5] is not None:
+            arrow_type = pa.decimal128(col[4], col[5])
+        elif type_code in _SQL_ARROW_TYPES:
+            arrow_type = _SQL_ARROW_TYPES[type_code]
+        else:
+            arrow_type = pa.array([r[i] for r in first_rows]).type
+            if pa.types.is_null(arrow_type):
+                arrow_type = pa.string()
+        fields.append(pa.field(name, arrow_type))
+    return pa.schema(fields)
+
+
+def _load_watermark(path):
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    return {}
+
+
+def extract_to_parquet(
+    pool,
+    source,
+    out_dir=SQL_MIRROR_DIR,
+    name=None,
+    watermark_col=None,
+    chunk_rows=SQL_CHUNK_ROWS,
+):
+    """Trích xuất một bảng hoặc câu truy vấn ra Parquet theo từng chunk cố định.
+
+    - source: tên bảng (SELECT * FROM ...) hoặc câu SELECT (không có ORDER BY).
+    - Mỗi fetchmany(chunk_rows) được ghi ngay thành một row group, bộ nhớ
+      đỉnh khoảng một chunk.
+    - watermark_col: chỉ lấy các dòng có giá trị lớn hơn lần chạy trước (lưu
+      trong _watermark.json), mỗi lần chạy thêm một file part mới. Không có
+      watermark thì thay toàn bộ bản sao của bảng.
+    """
+    start = time.time()
+    is_table = re.fullmatch(r"[\w.\[\]]+", source.strip()) is not None
+    name = name or (source.strip().strip("[]").split(".")[-1] if is_table else "query")
+    query = f"SELECT * FROM {source}" if is_table else source.strip().rstrip(";")
+    table_dir = os.path.join(out_dir, name)
+    os.makedirs(table_dir, exist_ok=True)
+
+    state_path = os.path.join(table_dir, "_watermark.json")
+    state = _load_watermark(state_path) if watermark_col else {}
+    params = ()
+    if watermark_col:
+        query = f"SELECT * FROM ({query}) AS src"
+        if state.get("value") is not None:
+            query += f" WHERE {watermark_col} > ?"
+            params = (_decode_watermark(state),)
+        query += f" ORDER BY {watermark_col}"
+
+    if watermark_col:
+        out_path = os.path.join(table_dir, f"part-{datetime.now():%Y%m%d%H%M%S%f}.parquet")
+    else:
+        out_path = os.path.join(table_dir, f"{name}.parquet")
+    tmp_path = f"{out_path}.tmp"
+
+    n_rows = 0
+    new_mark = None
+    writer = None
+    try:
+        with pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.arraysize = chunk_rows
+            cursor.execute(query, params)
+            schema = None
+            while True:
+                rows = cursor.fetchmany(chunk_rows)
+                if not rows:
+                    break
+                if schema is None:
+                    schema = _sql_schema(cursor.description, rows)
+                    writer = pq.ParquetWriter(tmp_path, schema, compression="snappy")
+                columns = list(zip(*rows))
+                chunk = pa.table(
+                    [pa.array(col, type=field.type) for col, field in zip(columns, schema)], schema=schema
+                )
+                writer.write_table(chunk)
+                n_rows += len(rows)
+                if watermark_col:
+                    chunk_max = pc.max(chunk.column(watermark_col)).as_py()
+                    if chunk_max is not None and (new_mark is None or chunk_max > new_mark):
+                        new_mark = chunk_max
+            cursor.close()
+    finally:
+        if writer is not None:
+            writer.close()
+
+    if n_rows:
+        os.replace(tmp_path, out_path)
+    if watermark_col and new_mark is not None:
+        with open(state_path, "w", encoding="utf-8") as f:
+            json.dump(_encode_watermark(watermark_col, new_mark), f, ensure_ascii=False)
+
+    print(f"✅ {name}: {n_rows:,} dòng -> {table_dir} trong {time.time() - start:.2f} giây")
+    return (out_path if n_rows else None), n_rows
+
+
+def _encode_watermark(column, value):
+    if isinstance(value, (datetime, date)):
+        return {"column": column, "value": value.isoformat(), "type": type(value).__name__}
+    if isinstance(value, Decimal):
+        return {"column": column, "value": str(value), "type": "Decimal"}
+    return {"column": column, "value": value, "type": type(value).__name__}
+
+
+def _decode_watermark(state):
+    value, kind = state["value"], state.get("type")
+    if kind == "datetime":
+        return datetime.fromisoformat(value)
+    if kind == "date":
+        return date.fromisoformat(value)
+    if kind == "Decimal":
+        return Decimal(value)
+    return value
+
+
+def mirror_sql_tables(tables=SQL_REFERENCE_TABLES, pool=None, out_dir=SQL_MIRROR_DIR, watermark_col=None, chunk_rows=SQL_CHUNK_ROWS):
+    """Sao chép các bảng DB_DGM ra Parquet, dùng chung một pool kết nối."""
+    own_pool = pool is None
+    pool = pool or sql_server_pool()
+    try:
+        return {t: extract_to_parquet(pool, t, out_dir, watermark_col=watermark_col, chunk_rows=chunk_rows) for t in tables}
+    finally:
+        if own_pool:
+            pool.close()
+
+
+# ==================== 7. SNAPSHOT KHỞI ĐỘNG NHANH ====================
+# Tăng khi định dạng snapshot hoặc bước tiền xử lý thay đổi để buộc dựng lại
+SNAPSHOT_VERSION = 4
+
+
+def _sanluong_inputs(store_dir):
+    if os.path.isdir(store_dir):
+        return sorted(glob.glob(os.path.join(store_dir, "**", "*.parquet"), recursive=True))
+    return sorted(glob.glob(os.path.join(PROCESSED_DATA_DIR, "sanluong_*.parquet")))
+
+
+def sanluong_fingerprint(store_dir=SANLUONG_STORE_DIR, **params):
+    """Dấu vân tay dữ liệu đầu vào: đường dẫn, kích thước, mtime từng file + tham số nạp."""
+    h = hashlib.sha1()
+    h.update(json.dumps({"version": SNAPSHOT_VERSION, **params}, sort_keys=True, default=str).encode())
+    for path in _sanluong_inputs(store_dir):
+        st = os.stat(path)
+        h.update(f"{os.path.relpath(path, store_dir)}|{st.st_size}|{st.st_mtime_ns}\n".encode())
+    return h.hexdigest()
+
+
+def _save_array(snap_dir, key, values):
+    """Lưu một cột/level: category -> mã số + danh sách category trong meta, còn lại -> .npy."""
+    entry = {"file": f"{key}.npy"}
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        values = pd.Categorical(values)
+        entry["categories"] = values.categories.tolist()
+        entry["ordered"] = bool(values.ordered)
+        values = values.codes
+    np.save(os.path.join(snap_dir, entry["file"]), np.asarray(values), allow_pickle=False)
+    return entry
+
+
+def _load_array(snap_dir, entry, mmap_mode):
+    values = np.load(os.path.join(snap_dir, entry["file"]), mmap_mode=mmap_mode, allow_pickle=False)
+    # View ndarray thường trên cùng vùng mmap (không sao chép), tránh lớp con np.memmap lan sang pandas
+    values = values.view(np.ndarray)
+    if "categories" in entry:
+        dtype = pd.CategoricalDtype(entry["categories"], ordered=entry["ordered"])
+        return pd.Categorical.from_codes(values, dtype=dtype, validate=False)
+    return values
+
+
+def save_frame_snapshot(df, snap_dir, fingerprint, arrays=None, extra_meta=None, files=None):
+    """Ghi các cột DataFrame thành bộ .npy, mỗi cột một file, thay thế snapshot cũ.
+
+    arrays: các mảng phụ (độ dài tùy ý) lưu kèm; files: các file .npy đã ghi sẵn
+    trên đĩa (tên -> đường dẫn) được chuyển vào snapshot; extra_meta: thông tin
+    thêm vào meta.json.
+    """
+    start = time.time()
+    snap_dir = str(snap_dir)
+    # Thư mục tạm riêng từng tiến trình: nhiều worker cùng dựng lại không ghi đè lẫn nhau
+    tmp_dir = f"{snap_dir}.tmp{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    meta = {"fingerprint": fingerprint, "rows": len(df), "columns": [], "arrays": [], **(extra_meta or {})}
+    for i, col in enumerate(df.columns):
+        meta["columns"].append({"name": col, **_save_array(tmp_dir, f"c{i}", df[col].array)})
+    for i, (name, values) in enumerate((arrays or {}).items()):
+        meta["arrays"].append({"name": name, **_save_array(tmp_dir, f"a{i}", values)})
+    for i, (name, path) in enumerate((files or {}).items()):
+        os.replace(path, os.path.join(tmp_dir, f"f{i}.npy"))
+        meta["arrays"].append({"name": name, "file": f"f{i}.npy"})
+    with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+
+    # Đổi tên thư mục cũ trước khi xóa: worker khác đang mmap snapshot cũ vẫn đọc được
+    old_dir = f"{snap_dir}.old{os.getpid()}"
+    if os.path.isdir(snap_dir):
+        os.replace(snap_dir, old_dir)
+    os.replace(tmp_dir, snap_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    print(f"💾 Đã ghi snapshot {snap_dir} trong {time.time() - start:.2f} giây")
+
+
+def _load_snapshot_meta(snap_dir, fingerprint=None):
+    meta_path = os.path.join(snap_dir, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, encoding="utf-8") as f:
+        meta = json.load(f)
+    if fingerprint is not None and meta.get("fingerprint") != fingerprint:
+        return None
+    return meta
+
+
+# ==================== 8. KHO CỘT MMAP DÙNG CHUNG ====================
+SERIES_KEYS = ("CTDL", "NMTD", "MADIEMDO")
+# Chuỗi sản lượng dạng dài gửi ra ngoài (API Arrow/Parquet): mã là dictionary int32
+SERIES_SCHEMA = pa.schema(
+    [(c, pa.dictionary(pa.int32(), pa.string())) for c in SERIES_KEYS]
+    + [("TIME", pa.timestamp("ns")), ("CS", pa.float32())]
+)
+
+
+def series_dictionaries(categories):
+    """Từ điển Arrow của CTDL/NMTD/MADIEMDO (dùng chung cho mọi batch của một luồng)."""
+    return {c: pa.array(np.asarray(categories[c], dtype=object), pa.string()) for c in SERIES_KEYS}
+
+
+def series_batch(codes, dictionaries, times, values):
+    """Record batch theo SERIES_SCHEMA từ mã category (CTDL/NMTD/MADIEMDO), TIME và CS."""
+    arrays = [
+        pa.DictionaryArray.from_arrays(pa.array(np.asarray(codes[c], dtype=np.int32)), dictionaries[c])
+        for c in SERIES_KEYS
+    ]
+    arrays += [pa.array(np.asarray(times, dtype="datetime64[ns]")), pa.array(np.asarray(values, dtype=np.float32))]
+    return pa.RecordBatch.from_arrays(arrays, schema=SERIES_SCHEMA)
+
+
+def period_bounds(year, month, day=None):
+    """Khoảng [start, end) (datetime64) của một tháng hoặc một ngày; (None, None) nếu ngày không hợp lệ."""
+    try:
+        if day is None:
+            start = np.datetime64(date(year, month, 1), "M")
+        else:
+            start = np.datetime64(date(year, month, day), "D")
+    except ValueError:
+        return None, None
+    return start, start + 1
+
+
+class SanluongBackend(ABC):
+    """Giao diện chung của kho sản lượng mà dashboard, notebook và API dùng.
+
+    Thuộc tính: `backend` (tên), `fingerprint`, `years`, `index` (HierarchyIndex), số dòng
+    (len), `nbytes` (bộ nhớ thường trú). Lớp con cài đặt `query` (một nhà máy trong
+    tháng/ngày -> DataFrame theo thời gian) và `record_batches` (chuỗi nhiều nhà máy ->
+    record batch SERIES_SCHEMA).
+    """
+
+    backend = None
+
+    @abstractmethod
+    def __len__(self):
+        """Số dòng của kho."""
+
+    @property
+    def empty(self):
+        return len(self) == 0
+
+    def ctdl_list(self):
+        """Các CTDL có dữ liệu (đã sắp xếp)."""
+        return self.index.ctdl_list()
+
+    def nmtd_list(self, ctdl):
+        """Các nhà máy của một CTDL (đã sắp xếp); rỗng nếu CTDL không tồn tại."""
+        return self.index.nmtd_list(ctdl)
+
+    def madiemdo_list(self, ctdl, nmtd):
+        """Các điểm đo của một nhà máy (đã sắp xếp)."""
+        return self.index.madiemdo_list(ctdl, nmtd)
+
+    @abstractmethod
+    def query(self, ctdl, nmtd, year, month, day=None, madiemdo=None, columns=("TIME", "CS", "MADIEMDO"), dropna=False):
+        """Các dòng của nhà máy trong một tháng/ngày (tùy chọn một điểm đo), đã theo thời gian."""
+
+    @abstractmethod
+    def record_batches(self, plants, madiemdo=None, start=None, end=None, chunk_rows=API_CHUNK_ROWS):
+        """Record batch (SERIES_SCHEMA) của các nhà máy trong [start, end)."""
+
+
+class SanluongStore(SanluongBackend):
+    """Kho sản lượng dạng cột, mở bằng mmap chỉ đọc.
+
+    Các cột (mã CTDL/NMTD/MADIEMDO, TIME, CS float32) và khóa KEY int64 đã
+    sắp xếp (CTDL, NMTD, phút) nằm trong các file .npy. Mọi worker WSGI mở
+    cùng các file nên chỉ có một bản dữ liệu trong page cache của hệ điều
+    hành; truy vấn nhà máy/tháng/ngày là searchsorted trên KEY, không dựng
+    MultiIndex hay bảng băm riêng cho từng tiến trình.
+    """
+
+    COLUMNS = ["CTDL", "NMTD", "MADIEMDO", "TIME", "CS"]
+    backend = "memory"
+
+    def __init__(self, shared_dir=SANLUONG_SHARED_DIR, meta=None):
+        self.shared_dir = str(shared_dir)
+        meta = meta or _load_snapshot_meta(self.shared_dir)
+        if meta is None:
+            raise FileNotFoundError(f"Chưa có kho dùng chung: {self.shared_dir}")
+        self.fingerprint = meta["fingerprint"]
+        self.years = meta.get("years", [])
+        self.columns = {e["name"]: _load_array(self.shared_dir, e, "r") for e in meta["columns"]}
+        arrays = {e["name"]: _load_array(self.shared_dir, e, "r") for e in meta["arrays"]}
+        self.key = arrays["KEY"]
+        self.plant_ctdl = arrays["PLANT_CTDL"]
+        self.plant_nmtd = arrays["PLANT_NMTD"]
+        self.plant_offsets = arrays["PLANT_OFFSETS"]
+        self._ctdl_codes = {c: i for i, c in enumerate(self.columns["CTDL"].categories)}
+        self._nmtd_codes = {c: i for i, c in enumerate(self.columns["NMTD"].categories)}
+        self._madiemdo_codes = {c: i for i, c in enumerate(self.columns["MADIEMDO"].categories)}
+        # Chỉ mục CTDL -> NMTD -> MADIEMDO và các ngày có dữ liệu, dựng từ mảng AVAIL nhỏ đã lưu sẵn
+        self.index = HierarchyIndex(
+            *(self.columns[c].categories for c in ("CTDL", "NMTD", "MADIEMDO")), np.asarray(arrays["AVAIL"]), self.years
+        )
+
+    def __len__(self):
+        return len(self.key)
+
+    @property
+    def nbytes(self):
+        arrays = [self.key, self.plant_offsets] + [
+            v.codes if isinstance(v, pd.Categorical) else v for v in self.columns.values()
+        ]
+        return sum(a.nbytes for a in arrays)
+
+    @classmethod
+    def build(
+        cls, store_dir=SANLUONG_STORE_DIR, shared_dir=SANLUONG_SHARED_DIR, workers=N_WORKERS, fingerprint=None, years=None
+    ):
+        """Nạp + tiền xử lý kho sản lượng (mọi năm hoặc chỉ `years`) rồi ghi các cột và khóa sắp xếp ra .npy."""
+        fingerprint = fingerprint or cls.fingerprint_of(store_dir, years)
+        df = load_sanluong_frame(cls.COLUMNS, years=years, store_dir=store_dir, workers=workers)
+        if df.empty:
+            df = pd.DataFrame({c: pd.Categorical([]) for c in ("CTDL", "NMTD", "MADIEMDO")})
+            df["TIME"] = np.array([], dtype="datetime64[ns]")
+            df["CS"] = np.array([], dtype=np.float32)
+        ctdl = df["CTDL"].cat.codes.to_numpy()
+        nmtd = df["NMTD"].cat.codes.to_numpy()
+        key = _frame_sort_key(ctdl, nmtd, df["TIME"].to_numpy().view(np.int64))
+        # Bảng nhà máy: đoạn [offset_i, offset_i+1) của KEY thuộc cùng một cặp CTDL/NMTD
+        starts = np.flatnonzero(np.diff(key >> 32)) + 1 if len(key) else np.array([], dtype=np.int64)
+        starts = np.concatenate([[0], starts]).astype(np.int64) if len(key) else starts
+        valid = df["CS"].notna().to_numpy()
+        arrays = {
+            "KEY": key,
+            "PLANT_CTDL": ctdl[starts],
+            "PLANT_NMTD": nmtd[starts],
+            "PLANT_OFFSETS": np.append(starts, len(key)).astype(np.int64),
+            "AVAIL": availability_keys(
+                ctdl[valid], nmtd[valid], df["MADIEMDO"].cat.codes.to_numpy()[valid], df["TIME"].to_numpy()[valid]
+            ),
+        }
+        data_years = period_years(df["TIME"].to_numpy())
+        if years is not None:
+            lo, hi = (years[0], years[-1]) if isinstance(years, (tuple, list)) else (years, years)
+            data_years = [y for y in data_years if lo <= y <= hi]
+        save_frame_snapshot(df[cls.COLUMNS], shared_dir, fingerprint, arrays=arrays, extra_meta={"years": data_years})
+        return cls(shared_dir)
+
+    @classmethod
+    def fingerprint_of(cls, store_dir=SANLUONG_STORE_DIR, years=None):
+        params = {"shared": cls.COLUMNS}
+        if years is not None:
+            params["years"] = years
+        return sanluong_fingerprint(store_dir, **params)
+
+    @classmethod
+    def is_current(cls, store_dir=SANLUONG_STORE_DIR, shared_dir=SANLUONG_SHARED_DIR, years=None):
+        """Kho dùng chung đã có và khớp với kho sản lượng hiện tại (mở được ngay, không phải dựng)."""
+        return _load_snapshot_meta(shared_dir, cls.fingerprint_of(store_dir, years)) is not None
+
+    @classmethod
+    def open(cls, store_dir=SANLUONG_STORE_DIR, shared_dir=SANLUONG_SHARED_DIR, workers=N_WORKERS, rebuild=True, years=None):
+        """Mở kho dùng chung; dựng lại nếu kho sản lượng đã thay đổi (rebuild=True)."""
+        start = time.time()
+        fingerprint = cls.fingerprint_of(store_dir, years)
+        meta = _load_snapshot_meta(shared_dir, fingerprint)
+        if meta is None:
+            if not rebuild:
+                meta = _load_snapshot_meta(shared_dir)
+                if meta is None:
+                    raise FileNotFoundError(f"Chưa có kho dùng chung: {shared_dir}")
+                print("⚠️ Kho dùng chung đã cũ so với kho sản lượng (không dựng lại)")
+                return cls(shared_dir, meta)
+            print("🔄 Kho dùng chung chưa có hoặc đã cũ, dựng lại...")
+            return cls.build(store_dir, shared_dir, workers, fingerprint, years)
+        store = cls(shared_dir, meta)
+        print(f"✅ Mở kho dùng chung {len(store):,} dòng (mmap) trong {time.time() - start:.2f} giây")
+        return store
+
+    @classmethod
+    def open_latest(cls, store_dir=SANLUONG_STORE_DIR, latest_dir=SANLUONG_LATEST_DIR, workers=N_WORKERS):
+        """Kho dùng chung chỉ gồm năm mới nhất (nhỏ, dựng nhanh); None nếu kho sản lượng rỗng."""
+        years = sanluong_years(store_dir)
+        if not years:
+            return None
+        # Kèm partition năm sau (nếu có chỉ là dòng 00:00 ngày 01/01 = chu kỳ cuối của năm mới nhất)
+        return cls.open(store_dir, latest_dir, workers, years=(years[-1], years[-1] + 1))
+
+    def plant_range(self, ctdl, nmtd, start=None, end=None):
+        """Đoạn dòng [lo, hi) của nhà máy, giới hạn TIME trong [start, end)."""
+        c, n = self._ctdl_codes.get(ctdl), self._nmtd_codes.get(nmtd)
+        if c is None or n is None:
+            return 0, 0
+        base = ((c + 1) << 48) | ((n + 1) << 32)  # cùng mã hóa với _frame_sort_key
+        lo_min = 0 if start is None else int(np.datetime64(start, "m").astype(np.int64))
+        hi_min = (1 << 32) if end is None else int(np.datetime64(end, "m").astype(np.int64))
+        lo, hi = np.searchsorted(self.key, [base + lo_min, base + hi_min], side="left")
+        return int(lo), int(hi)
+
+    def period_range(self, ctdl, nmtd, year, month, day=None):
+        """Đoạn dòng của nhà máy trong một tháng (day=None) hoặc một ngày, theo ngày của TIME."""
+        start, end = period_bounds(year, month, day)
+        if start is None:
+            return 0, 0
+        return self.plant_range(ctdl, nmtd, start, end)
+
+    def frame(self, lo, hi, columns=("TIME", "CS", "MADIEMDO")):
+        """DataFrame nhỏ (bản sao) của đoạn dòng [lo, hi)."""
+        return pd.DataFrame({c: self.columns[c][lo:hi] for c in columns}).copy()
+
+    def query(self, ctdl, nmtd, year, month, day=None, madiemdo=None, columns=("TIME", "CS", "MADIEMDO"), dropna=False):
+        """Các dòng của nhà máy trong một tháng/ngày (tùy chọn chỉ một điểm đo), đã theo thời gian.
+
+        Đoạn [lo, hi) tìm bằng searchsorted trên KEY; lọc điểm đo và CS NaN (dropna=True) chỉ
+        chạy trên đoạn đó, nên chi phí tỉ lệ với số dòng kết quả chứ không với cả kho.
+        """
+        lo, hi = self.period_range(ctdl, nmtd, year, month, day)
+        keep = None
+        if madiemdo is not None:
+            # Mã -1 là MADIEMDO null: điểm đo không có trong kho phải ra kết quả rỗng
+            code = self._madiemdo_codes.get(madiemdo)
+            if code is None:
+                return self.frame(lo, lo, columns)
+            keep = self.columns["MADIEMDO"].codes[lo:hi] == code
+        if dropna:
+            valid = ~np.isnan(self.columns["CS"][lo:hi])
+            keep = valid if keep is None else keep & valid
+        if keep is None:
+            return self.frame(lo, hi, columns)
+        rows = lo + np.flatnonzero(keep)
+        return pd.DataFrame({c: self.columns[c][rows] for c in columns})
+
+    def record_batches(self, plants, madiemdo=None, start=None, end=None, chunk_rows=API_CHUNK_ROWS):
+        """Record batch (SERIES_SCHEMA) của các nhà máy trong [start, end): mỗi nhà máy là một đoạn
+        liền của KEY (searchsorted), cắt thành khối `chunk_rows` dòng đọc thẳng từ mmap."""
+        columns = self.columns
+        dictionaries = series_dictionaries({c: columns[c].categories for c in SERIES_KEYS})
+        wanted = None
+        if madiemdo:
+            wanted = columns["MADIEMDO"].categories.get_indexer(madiemdo)
+            wanted = wanted[wanted >= 0]
+        for ctdl, nmtd in plants:
+            lo, hi = self.plant_range(ctdl, nmtd, start, end)
+            for b_lo in range(lo, hi, chunk_rows):
+                rows = slice(b_lo, min(b_lo + chunk_rows, hi))
+                if wanted is not None:
+                    rows = b_lo + np.flatnonzero(np.isin(columns["MADIEMDO"].codes[rows], wanted))
+                    if not len(rows):
+                        continue
+                codes = {c: columns[c].codes[rows] for c in SERIES_KEYS}
+                yield series_batch(codes, dictionaries, columns["TIME"][rows], columns["CS"][rows])
+
+
+# ==================== 9. TENSOR DÀY ĐIỂM ĐO × NGÀY × KHUNG GIỜ ====================
+def _series_frame(values, madiemdo, first_time, step):
+    """Ma trận (điểm đo, kỳ) bước `step` bắt đầu từ `first_time` -> DataFrame dài TIME/CS/MADIEMDO (bỏ ô NaN)."""
+    n_meters, n_periods = values.shape
+    times = np.datetime64(first_time, "ns") + np.arange(n_periods, dtype=np.int64) * np.timedelta64(step, "ns")
+    flat = np.asarray(values, dtype=np.float32)
+    valid = ~np.isnan(flat)
+    meter_idx, pos = np.nonzero(valid)
+    return pd.DataFrame(
+        {
+            "TIME": times[pos],
+            "CS": flat[valid],
+            "MADIEMDO": pd.Categorical.from_codes(meter_idx, categories=madiemdo) if len(madiemdo) else pd.Categorical([]),
+        }
+    )
+
+
+class DenseStore:
+    """Sản lượng dạng tensor float32 (n_điểm_đo, n_ngày, 48), NaN ở khung giờ thiếu.
+
+    - Trục điểm đo sắp theo CTDL/NMTD/MADIEMDO: các điểm đo của một nhà máy
+      nằm liền nhau [PLANT_OFFSETS[i], PLANT_OFFSETS[i+1]).
+    - Trục ngày liên tục từ day0; khung giờ k của ngày d là TIME = d + k*30'
+      (cùng quy ước ngày theo TIME với YEAR/MONTH_NUM/DAY_NUM).
+    Một tháng/ngày của một nhà máy là một lát cắt của tensor, 4 byte mỗi mẫu,
+    không có index theo dòng. Tensor được mở bằng mmap.
+    """
+
+    def __init__(self, dense_dir=SANLUONG_DENSE_DIR, meta=None):
+        self.dense_dir = str(dense_dir)
+        meta = meta or _load_snapshot_meta(self.dense_dir)
+        if meta is None:
+            raise FileNotFoundError(f"Chưa có tensor sản lượng: {self.dense_dir}")
+        self.fingerprint = meta["fingerprint"]
+        self.day0 = np.datetime64(meta["day0"], "D")
+        self.meters = {e["name"]: _load_array(self.dense_dir, e, None) for e in meta["columns"]}
+        arrays = {e["name"]: _load_array(self.dense_dir, e, "r") for e in meta["arrays"]}
+        self.values = arrays["VALUES"]
+        self.plant_ctdl = np.asarray(arrays["PLANT_CTDL"])
+        self.plant_nmtd = np.asarray(arrays["PLANT_NMTD"])
+        self.plant_offsets = np.asarray(arrays["PLANT_OFFSETS"])
+        self._plants = {
+            (self.meters["CTDL"].categories[c], self.meters["NMTD"].categories[n]): i
+            for i, (c, n) in enumerate(zip(self.plant_ctdl, self.plant_nmtd))
+        }
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    @property
+    def days(self):
+        """Trục ngày (datetime64[D])."""
+        return self.day0 + np.arange(self.values.shape[1])
+
+    @classmethod
+    def build(cls, store_dir=SANLUONG_STORE_DIR, dense_dir=SANLUONG_DENSE_DIR, workers=N_WORKERS, fingerprint=None):
+        """Dựng tensor từ kho sản lượng Parquet, ghi thẳng vào file .npy (không giữ cả tensor trong RAM)."""
+        start = time.time()
+        fingerprint = fingerprint or sanluong_fingerprint(store_dir, dense=True)
+        columns = ["CTDL", "NMTD", "MADIEMDO", "TIME", "CS"]
+        pieces, expr, schema = _sanluong_pieces(None, None, None, store_dir)
+
+        def _read_valid(piece, cols):
+            table = _read_piece(piece, cols, expr, schema)
+            mask = pc.is_valid(table.column("TIME"))
+            for c in columns[:3]:
+                mask = pc.and_(mask, pc.is_valid(table.column(c)))
+            return table.filter(mask)
+
+        # Lượt 1: danh sách điểm đo và khoảng ngày
+        def _scan(piece):
+            table = _read_valid(piece, columns[:4])
+            ids = pd.DataFrame({c: _sorted_categorical(table.column(c)) for c in columns[:3]})
+            ids = ids.drop_duplicates().astype(str)
+            bounds = pc.min_max(table.column("TIME")).as_py() if table.num_rows else {"min": None, "max": None}
+            return ids, bounds["min"], bounds["max"]
+
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(pieces) or 1))) as pool:
+            scans = list(pool.map(_scan, pieces))
+        ids = pd.concat([sc[0] for sc in scans], ignore_index=True).drop_duplicates()
+        ids = ids.sort_values(columns[:3], kind="stable").reset_index(drop=True)
+        meters = pd.DataFrame({c: pd.Categorical(ids[c], categories=sorted(ids[c].unique())) for c in columns[:3]})
+        lows = [sc[1] for sc in scans if sc[1] is not None]
+        highs = [sc[2] for sc in scans if sc[2] is not None]
+        if lows:
+            day0 = np.datetime64(min(lows), "D")
+            n_days = int((np.datetime64(max(highs), "D") - day0).astype(np.int64)) + 1
+        else:
+            day0, n_days = np.datetime64("1970-01-01", "D"), 0
+
+        # Khóa điểm đo (mã CTDL, NMTD, MADIEMDO) đã sắp xếp -> vị trí trên trục điểm đo bằng searchsorted
+        sizes = [len(meters[c].cat.categories) for c in columns[:3]]
+        codes = [meters[c].cat.codes.to_numpy().astype(np.int64) for c in columns[:3]]
+        meter_key = (codes[0] * sizes[1] + codes[1]) * sizes[2] + codes[2]
+
+        os.makedirs(os.path.dirname(str(dense_dir)) or ".", exist_ok=True)
+        tensor_path = f"{dense_dir}.values{os.getpid()}.npy"
+        values = np.lib.format.open_memmap(tensor_path, mode="w+", dtype=np.float32, shape=(len(meters), n_days, SLOTS_PER_DAY))
+        values[:] = np.nan
+
+        # Lượt 2: ghi CS vào đúng ô (điểm đo, ngày, khung giờ); mảnh được đọc song song
+        def _load(piece):
+            table = _read_valid(piece, columns)
+            piece_codes = []
+            for c in columns[:3]:
+                # Ánh xạ category của mảnh sang mã toàn cục trên danh sách category, không đổi từng dòng
+                cat = _sorted_categorical(table.column(c))
+                mapping = meters[c].cat.categories.get_indexer(cat.categories.astype(str))
+                piece_codes.append(mapping[cat.codes].astype(np.int64))
+            times = table.column("TIME").to_numpy().astype("datetime64[ns]")
+            cs = pc.cast(table.column("CS"), pa.float32()).to_numpy(zero_copy_only=False)
+            return piece_codes, times, cs
+
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(pieces) or 1))) as pool:
+            for piece_codes, times, cs in pool.map(_load, pieces):
+                key = (piece_codes[0] * sizes[1] + piece_codes[1]) * sizes[2] + piece_codes[2]
+                meter_idx = np.searchsorted(meter_key, key)
+                days = times.astype("datetime64[D]")
+                day_idx = (days - day0).astype(np.int64)
+                slot_idx = ((times - days) // np.timedelta64(SLOT_MINUTES, "m")).astype(np.int64)
+                values[meter_idx, day_idx, slot_idx] = cs
+        values.flush()
+        del values
+
+        ctdl, nmtd = codes[0], codes[1]
+        plant_key = ctdl * sizes[1] + nmtd
+        starts = np.flatnonzero(np.diff(plant_key)) + 1 if len(plant_key) else np.array([], dtype=np.int64)
+        starts = np.concatenate([[0], starts]).astype(np.int64) if len(plant_key) else starts
+        arrays = {
+            "PLANT_CTDL": ctdl[starts],
+            "PLANT_NMTD": nmtd[starts],
+            "PLANT_OFFSETS": np.append(starts, len(plant_key)).astype(np.int64),
+        }
+        save_frame_snapshot(
+            meters, dense_dir, fingerprint, arrays=arrays, files={"VALUES": tensor_path}, extra_meta={"day0": str(day0)}
+        )
+        print(f"✅ Tensor {len(meters):,} điểm đo × {n_days:,} ngày × {SLOTS_PER_DAY} trong {time.time() - start:.2f} giây")
+        return cls(dense_dir)
+
+    @classmethod
+    def open(cls, store_dir=SANLUONG_STORE_DIR, dense_dir=SANLUONG_DENSE_DIR, workers=N_WORKERS, rebuild=True):
+        """Mở tensor (mmap); dựng lại nếu kho sản lượng đã thay đổi (rebuild=True)."""
+        fingerprint = sanluong_fingerprint(store_dir, dense=True)
+        meta = _load_snapshot_meta(dense_dir, fingerprint)
+        if meta is None:
+            if rebuild:
+                print("🔄 Tensor sản lượng chưa có hoặc đã cũ, dựng lại...")
+                return cls.build(store_dir, dense_dir, workers, fingerprint)
+            print("⚠️ Tensor sản lượng đã cũ so với kho sản lượng (không dựng lại)")
+        dense = cls(dense_dir, meta)
+        print(f"✅ Mở tensor sản lượng {dense.shape} (mmap)")
+        return dense
+
+    def meter_range(self, ctdl, nmtd):
+        """Đoạn [lo, hi) trên trục điểm đo của một nhà máy; (0, 0) nếu không có."""
+        i = self._plants.get((ctdl, nmtd))
+        if i is None:
+            return 0, 0
+        return int(self.plant_offsets[i]), int(self.plant_offsets[i + 1])
+
+    def madiemdo(self, lo, hi):
+        """Tên các điểm đo trong đoạn [lo, hi)."""
+        return list(self.meters["MADIEMDO"][lo:hi].astype(str))
+
+    def day_range(self, start, end):
+        """Đoạn [lo, hi) trên trục ngày cho khoảng ngày [start, end), đã cắt theo biên tensor."""
+        n_days = self.values.shape[1]
+        lo = int((np.datetime64(start, "D") - self.day0).astype(np.int64))
+        hi = int((np.datetime64(end, "D") - self.day0).astype(np.int64))
+        return min(max(lo, 0), n_days), min(max(hi, 0), n_days)
+
+    def period(self, ctdl, nmtd, year, month, day=None):
+        """Lát cắt (điểm đo, ngày, 48) của nhà máy trong một tháng hoặc một ngày + tên điểm đo + ngày đầu."""
+        if day is None:
+            start = np.datetime64(date(year, month, 1), "M").astype("datetime64[D]")
+            end = (np.datetime64(date(year, month, 1), "M") + 1).astype("datetime64[D]")
+        else:
+            try:
+                start = np.datetime64(date(year, month, day), "D")
+            except ValueError:
+                start = end = self.day0
+            else:
+                end = start + 1
+        m_lo, m_hi = self.meter_range(ctdl, nmtd)
+        d_lo, d_hi = self.day_range(start, end)
+        return self.values[m_lo:m_hi, d_lo:d_hi, :], self.madiemdo(m_lo, m_hi), self.day0 + d_lo
+
+    @staticmethod
+    def to_frame(block, madiemdo, first_day):
+        """Lát cắt tensor -> DataFrame dài TIME/CS/MADIEMDO (bỏ ô NaN) để vẽ biểu đồ."""
+        return _series_frame(block.reshape(len(block), -1), madiemdo, first_day, np.timedelta64(SLOT_MINUTES, "m"))
+
+
+# ==================== 10. BẢNG TỔNG HỢP DỰNG SẴN ====================
+ROLLUP_LEVELS = {
+    "meter": ["CTDL", "NMTD", "MADIEMDO"],
+    "plant": ["CTDL", "NMTD"],
+    "company": ["CTDL"],
+}
+ROLLUP_STATS = ["SUM", "MEAN", "MIN", "MAX", "COUNT"]
+
+
+def _slot_stats(block, axis):
+    """SUM/MEAN/MIN/MAX/COUNT bỏ qua NaN theo một trục; nhóm không có dữ liệu có COUNT = 0."""
+    valid = ~np.isnan(block)
+    count = valid.sum(axis=axis)
+    total = np.where(valid, block, 0).sum(axis=axis, dtype=np.float64)
+    empty = count == 0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total / count
+    vmin = np.where(valid, block, np.inf).min(axis=axis)
+    vmax = np.where(valid, block, -np.inf).max(axis=axis)
+    total[empty] = np.nan
+    vmin[empty] = np.nan
+    vmax[empty] = np.nan
+    return {
+        "SUM": total,
+        "MEAN": mean.astype(np.float32),
+        "MIN": vmin.astype(np.float32),
+        "MAX": vmax.astype(np.float32),
+        "COUNT": count.astype(np.int32),
+    }
+
+
+def _group_total(block, offsets):
+    """Cộng các dòng liền nhau [offsets[i], offsets[i+1]) của trục 0 theo từng khung giờ (NaN nếu cả nhóm thiếu)."""
+    valid = ~np.isnan(block)
+    totals = np.add.reduceat(np.where(valid, block, 0), offsets[:-1], axis=0, dtype=np.float64)
+    counts = np.add.reduceat(valid, offsets[:-1], axis=0, dtype=np.int32)
+    totals[counts == 0] = np.nan
+    return totals
+
+
+def _rollup_frame(ids, stats, keys, stat_names=ROLLUP_STATS):
+    """Bảng dài: mỗi dòng một (nhóm, khóa); stats là các mảng (n_nhóm, n_khóa), bỏ dòng COUNT = 0."""
+    n_groups, n_keys = stats["COUNT"].shape
+    keep = stats["COUNT"].reshape(-1) > 0
+    data = {name: values.take(np.repeat(np.arange(n_groups), n_keys)[keep]) for name, values in ids.items()}
+    for name, values in keys.items():
+        data[name] = np.tile(values, n_groups)[keep]
+    for name in stat_names:
+        data[name] = stats[name].reshape(-1)[keep]
+    return pd.DataFrame(data)
+
+
+def build_rollups(dense=None, out_dir=ROLLUP_DIR):
+    """Dựng các bảng tổng hợp từ tensor sản lượng, mỗi lần một tháng.
+
+    - daily_/monthly_{meter,plant,company}.parquet: SUM/MEAN/MIN/MAX/COUNT của
+      các giá trị 30' trong ngày/tháng. Với nhà máy và công ty, CS các điểm đo
+      được cộng theo từng khung giờ trước (SUM ngày của nhà máy = TONG_NGAY).
+    - profile_meter.parquet: MIN/P25/MEDIAN/MEAN/P75/MAX/COUNT theo (MADIEMDO,
+      YEAR, MONTH, SLOT) trên các ngày trong tháng (features.timeslot_stats).
+    """
+    start = time.time()
+    dense = dense or DenseStore.open()
+    os.makedirs(out_dir, exist_ok=True)
+
+    meters = dense.meters
+    plant_ctdl = pd.Categorical.from_codes(dense.plant_ctdl, dtype=meters["CTDL"].dtype)
+    plant_nmtd = pd.Categorical.from_codes(dense.plant_nmtd, dtype=meters["NMTD"].dtype)
+    company_starts = np.flatnonzero(np.diff(dense.plant_ctdl)) + 1 if len(dense.plant_ctdl) else []
+    company_offsets = np.concatenate([[0], company_starts, [len(dense.plant_ctdl)]]).astype(np.int64)
+    ids = {
+        "meter": {c: meters[c] for c in ROLLUP_LEVELS["meter"]},
+        "plant": {"CTDL": plant_ctdl, "NMTD": plant_nmtd},
+        "company": {"CTDL": plant_ctdl.take(company_offsets[:-1]) if len(plant_ctdl) else plant_ctdl},
+    }
+
+    days = dense.days
+    months = days.astype("datetime64[M]")
+    bounds = np.concatenate([[0], np.flatnonzero(np.diff(months.astype(np.int64))) + 1, [len(days)]]).astype(np.int64)
+    daily = {level: [] for level in ROLLUP_LEVELS}
+    monthly = {level: [] for level in ROLLUP_LEVELS}
+    profile = []
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        if hi <= lo or not len(meters["CTDL"]):
+            continue
+        block = np.asarray(dense.values[:, lo:hi, :])
+        plant = _group_total(block, dense.plant_offsets)
+        company = _group_total(plant, company_offsets)
+        for level, values in (("meter", block), ("plant", plant), ("company", company)):
+            daily[level].append(_slot_stats(values, axis=2))
+            monthly[level].append(_slot_stats(values.reshape(len(values), -1), axis=1))
+        profile.append(timeslot_stats(block, axis=1))
+
+    month_keys = months[bounds[:-1]][: len(profile)] if len(profile) else months[:0]
+    year_idx = (month_keys.astype(np.int64) // 12 + 1970).astype(np.int16)
+    month_idx = (month_keys.astype(np.int64) % 12 + 1).astype(np.int8)
+
+    def _concat(parts, axis):
+        return {name: np.concatenate([p[name] for p in parts], axis=axis) for name in ROLLUP_STATS}
+
+    written = {}
+    for level in ROLLUP_LEVELS:
+        if not daily[level]:
+            continue
+        tables = {
+            f"daily_{level}": _rollup_frame(ids[level], _concat(daily[level], 1), {"DATE": days[: sum(d["COUNT"].shape[1] for d in daily[level])]}),
+            f"monthly_{level}": _rollup_frame(
+                ids[level],
+                {name: np.stack([m[name] for m in monthly[level]], axis=1) for name in ROLLUP_STATS},
+                {"YEAR": year_idx, "MONTH": month_idx},
+            ),
+        }
+        written.update(tables)
+    if profile:
+        stacked = {name: np.stack([p[name] for p in profile], axis=1) for name in TIMESLOT_STATS}
+        n_months = len(profile)
+        written["profile_meter"] = _rollup_frame(
+            ids["meter"],
+            {name: v.reshape(len(v), -1) for name, v in stacked.items()},
+            {
+                "YEAR": np.repeat(year_idx, SLOTS_PER_DAY),
+                "MONTH": np.repeat(month_idx, SLOTS_PER_DAY),
+                "SLOT": np.tile(np.arange(SLOTS_PER_DAY, dtype=np.int8), n_months),
+            },
+            TIMESLOT_STATS,
+        )
+
+    for name, df in written.items():
+        path = os.path.join(out_dir, f"{name}.parquet")
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False), f"{path}.tmp", compression="snappy")
+        os.replace(f"{path}.tmp", path)
+        print(f"   💾 {name}: {len(df):,} dòng")
+    print(f"✅ Đã dựng {len(written)} bảng tổng hợp trong {time.time() - start:.2f} giây")
+    return written
+
+
+def load_rollups(names=None, out_dir=ROLLUP_DIR):
+    """Đọc các bảng tổng hợp (mặc định: tất cả file trong ROLLUP_DIR) -> dict tên -> DataFrame."""
+    if names is None:
+        names = [os.path.splitext(os.path.basename(p))[0] for p in sorted(glob.glob(os.path.join(out_dir, "*.parquet")))]
+    rollups = {}
+    for name in names:
+        path = os.path.join(out_dir, f"{name}.parquet")
+        if os.path.exists(path):
+            rollups[name] = pd.read_parquet(path)
+    return rollups
+
+
+# ==================== 11. CHỈ MỤC PHÂN CẤP VÀ NGÀY CÓ DỮ LIỆU ====================
+def availability_keys(ctdl_codes, nmtd_codes, madiemdo_codes, times):
+    """Các cặp (điểm đo, ngày) có dữ liệu dưới dạng khóa int64 duy nhất, đã sắp xếp.
+
+    Khóa = CTDL<<48 | NMTD<<32 | MADIEMDO<<16 | số ngày từ 1970-01-01.
+    """
+    days = np.asarray(times, dtype="datetime64[ns]").astype("datetime64[D]").astype(np.int64)
+    codes = [np.asarray(c, dtype=np.int64) for c in (ctdl_codes, nmtd_codes, madiemdo_codes)]
+    ok = (codes[0] >= 0) & (codes[1] >= 0) & (codes[2] >= 0) & (days >= 0)
+    codes = [c[ok] for c in codes]
+    days = days[ok]
+    if len(days) and (codes[0].max() >= 1 << 15 or codes[1].max() >= 1 << 16 or codes[2].max() >= 1 << 16 or days.max() >= 1 << 16):
+        raise ValueError("Số CTDL/NMTD/MADIEMDO hoặc ngày vượt quá giới hạn của khóa chỉ mục")
+    key = (codes[0] << 48) | (codes[1] << 32) | (codes[2] << 16) | days
+    # pd.unique dùng bảng băm (O(n)), chỉ sắp xếp các khóa duy nhất
+    return np.sort(pd.unique(key))
+
+
+class HierarchyIndex:
+    """Chỉ mục CTDL -> NMTD -> MADIEMDO kèm các ngày có dữ liệu của từng nút.
+
+    Dựng một lần lúc nạp từ các khóa (điểm đo, ngày) duy nhất: danh sách cho
+    dropdown và kiểm tra tồn tại tháng là tra dict/set O(1), kiểm tra ngày là
+    searchsorted trên mảng ngày đã sắp xếp của nút (tối đa vài nghìn phần tử).
+    """
+
+    def __init__(self, ctdl_categories, nmtd_categories, madiemdo_categories, avail, years=None):
+        # years: các năm có chu kỳ dữ liệu (period_years); loại năm chỉ có dòng 00:00 ngày 01/01
+        self._years = None if years is None else set(years)
+        self._tree = {}
+        self._days = {}
+        self._months = {}
+        avail = np.asarray(avail, dtype=np.int64)
+        meter = avail >> 16
+        days = (avail & 0xFFFF).astype(np.int32)
+        bounds = np.concatenate([[0], np.flatnonzero(np.diff(meter)) + 1, [len(avail)]]) if len(avail) else [0]
+        groups = {}
+        for lo, hi in zip(bounds[:-1], bounds[1:]):
+            m = int(meter[lo])
+            ctdl, nmtd = ctdl_categories[m >> 32], nmtd_categories[(m >> 16) & 0xFFFF]
+            madiemdo = madiemdo_categories[m & 0xFFFF]
+            self._tree.setdefault(ctdl, {}).setdefault(nmtd, []).append(madiemdo)
+            node_days = days[lo:hi]
+            # Nút cha (nhà máy, công ty, toàn bộ) gom ngày của các điểm đo con
+            for node in ((ctdl, nmtd, madiemdo), (ctdl, nmtd), (ctdl,), ()):
+                groups.setdefault(node, []).append(node_days)
+        for node, parts in groups.items():
+            node_days = parts[0] if len(parts) == 1 else np.unique(np.concatenate(parts))
+            self._days[node] = node_days
+            self._months[node] = set(np.unique(node_days.astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)).tolist())
+        for plants in self._tree.values():
+            for meters in plants.values():
+                meters.sort()
+
+    @classmethod
+    def from_frame(cls, df):
+        """Dựng từ DataFrame có CTDL/NMTD/MADIEMDO (category), TIME và CS (bỏ dòng CS thiếu)."""
+        if df.empty:
+            return cls([], [], [], np.array([], dtype=np.int64))
+        cols = [df[c] if c in df.columns else df.index.get_level_values(c) for c in ("CTDL", "NMTD", "MADIEMDO")]
+        cats = [pd.Categorical(c) for c in cols]
+        valid = df["CS"].notna().to_numpy()
+        times = df["TIME"].to_numpy()[valid]
+        avail = availability_keys(*(c.codes[valid] for c in cats), times)
+        return cls(*(c.categories for c in cats), avail, period_years(times))
+
+    @staticmethod
+    def _node(ctdl=None, nmtd=None, madiemdo=None):
+        return tuple(v for v in (ctdl, nmtd, madiemdo) if v is not None)
+
+    def ctdl_list(self):
+        return sorted(self._tree)
+
+    def nmtd_list(self, ctdl):
+        return sorted(self._tree.get(ctdl, {}))
+
+    def madiemdo_list(self, ctdl, nmtd):
+        return list(self._tree.get(ctdl, {}).get(nmtd, []))
+
+    def years(self, ctdl=None, nmtd=None, madiemdo=None):
+        """Các năm có dữ liệu của nút (mặc định: toàn bộ)."""
+        months = self._months.get(self._node(ctdl, nmtd, madiemdo), ())
+        years = {m // 12 + 1970 for m in months}
+        return sorted(years if self._years is None else years & self._years)
+
+    def months(self, ctdl, nmtd, year, madiemdo=None):
+        """Các tháng có dữ liệu của nút trong một năm."""
+        months = self._months.get(self._node(ctdl, nmtd, madiemdo), ())
+        base = (year - 1970) * 12
+        return [k - base + 1 for k in range(base, base + 12) if k in months]
+
+    def days(self, ctdl, nmtd, year, month, madiemdo=None):
+        """Các ngày có dữ liệu của nút trong một tháng."""
+        node_days = self._days.get(self._node(ctdl, nmtd, madiemdo))
+        if node_days is None or not 1 <= month <= 12:
+            return []
+        first_month = np.datetime64(date(year, month, 1), "M")
+        bounds = np.array([first_month, first_month + 1]).astype("datetime64[D]").astype(np.int64)
+        lo, hi = np.searchsorted(node_days, bounds)
+        return (node_days[lo:hi] - int(bounds[0]) + 1).tolist()
+
+    def has(self, ctdl, nmtd, year, month, day=None, madiemdo=None):
+        """Nút có dữ liệu trong tháng (hoặc ngày) không."""
+        node = self._node(ctdl, nmtd, madiemdo)
+        if not 1 <= month <= 12:
+            return False
+        if day is None:
+            return (year - 1970) * 12 + month - 1 in self._months.get(node, ())
+        node_days = self._days.get(node)
+        if node_days is None:
+            return False
+        try:
+            target = int(np.datetime64(date(year, month, day), "D").astype(np.int64))
+        except ValueError:
+            return False
+        i = np.searchsorted(node_days, target)
+        return bool(i < len(node_days) and node_days[i] == target)
+
+
+# ==================== 12. KIM TỰ THÁP ĐA ĐỘ PHÂN GIẢI ====================
+# Mức -> số khung 30' gộp thành một điểm, từ mịn đến thô
+PYRAMID_LEVELS = {"30min": 1, "2h": 4, "1d": SLOTS_PER_DAY, "1w": 7 * SLOTS_PER_DAY}
+PYRAMID_BLOCK_METERS = 256
+
+
+def _nan_mean_last(values):
+    """Trung bình bỏ qua NaN theo trục cuối (NaN nếu cả kỳ không có dữ liệu), float32."""
+    valid = ~np.isnan(values)
+    count = valid.sum(axis=-1)
+    total = np.where(valid, values, 0).sum(axis=-1, dtype=np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (total / count).astype(np.float32)
+
+
+class ResolutionPyramid:
+    """Các mức gộp 30', 2 giờ, ngày, tuần của tensor sản lượng, mỗi mức (n_điểm_đo, n_kỳ) float32.
+
+    - Mức 30' là chính tensor dày (reshape trên mmap, không sao chép); các mức còn lại là
+      CS trung bình của các khung 30' có dữ liệu trong kỳ, NaN nếu cả kỳ trống.
+    - Mức tuần bắt đầu từ thứ Hai; các mức khác bắt đầu từ day0 của tensor.
+    `window` chọn mức mịn nhất mà cửa sổ nhìn thấy không vượt ngân sách điểm mỗi trace,
+    rồi chỉ cắt đúng đoạn đó của các điểm đo trong nhà máy.
+    """
+
+    def __init__(self, dense, pyramid_dir=SANLUONG_PYRAMID_DIR, meta=None):
+        self.pyramid_dir = str(pyramid_dir)
+        meta = meta or _load_snapshot_meta(self.pyramid_dir)
+        if meta is None:
+            raise FileNotFoundError(f"Chưa có kim tự tháp sản lượng: {self.pyramid_dir}")
+        self.dense = dense
+        self.fingerprint = meta["fingerprint"]
+        n_meters, n_days, n_slots = dense.shape
+        self.levels = {"30min": dense.values.reshape(n_meters, n_days * n_slots)}
+        self.levels.update({e["name"]: _load_array(self.pyramid_dir, e, "r") for e in meta["arrays"]})
+        self.origins = {name: np.datetime64(day, "D") for name, day in meta["origins"].items()}
+
+    @property
+    def span(self):
+        """Khoảng ngày [đầu, cuối) có trên tensor."""
+        return self.dense.day0, self.dense.day0 + self.dense.shape[1]
+
+    @classmethod
+    def build(cls, dense=None, pyramid_dir=SANLUONG_PYRAMID_DIR, block_meters=PYRAMID_BLOCK_METERS):
+        """Dựng các mức 2 giờ/ngày/tuần từ tensor dày, mỗi lần một khối điểm đo, ghi thẳng vào .npy."""
+        start = time.time()
+        dense = dense or DenseStore.open()
+        n_meters, n_days, n_slots = dense.shape
+        # 1970-01-01 là thứ Năm: số ngày đệm phía trước để tuần đầu bắt đầu từ thứ Hai
+        lead = int((dense.day0.astype(np.int64) + 3) % 7)
+        n_weeks = -(-(lead + n_days) // 7)
+        sizes = {
+            "2h": n_days * n_slots // PYRAMID_LEVELS["2h"],
+            "1d": n_days,
+            "1w": n_weeks,
+        }
+        origins = {"30min": dense.day0, "2h": dense.day0, "1d": dense.day0, "1w": dense.day0 - lead}
+
+        os.makedirs(os.path.dirname(str(pyramid_dir)) or ".", exist_ok=True)
+        paths = {name: f"{pyramid_dir}.{name}{os.getpid()}.npy" for name in sizes}
+        outs = {
+            name: np.lib.format.open_memmap(paths[name], mode="w+", dtype=np.float32, shape=(n_meters, size))
+            for name, size in sizes.items()
+        }
+        for lo in range(0, n_meters, block_meters):
+            block = np.asarray(dense.values[lo : lo + block_meters])
+            n_block = len(block)
+            outs["2h"][lo : lo + n_block] = _nan_mean_last(block.reshape(n_block, sizes["2h"], PYRAMID_LEVELS["2h"]))
+            outs["1d"][lo : lo + n_block] = _nan_mean_last(block)
+            weeks = np.full((n_block, n_weeks * 7, n_slots), np.nan, dtype=np.float32)
+            weeks[:, lead : lead + n_days] = block
+            outs["1w"][lo : lo + n_block] = _nan_mean_last(weeks.reshape(n_block, n_weeks, -1))
+        for out in outs.values():
+            out.flush()
+        del outs
+
+        save_frame_snapshot(
+            pd.DataFrame(), pyramid_dir, dense.fingerprint, files=paths,
+            extra_meta={"origins": {name: str(day) for name, day in origins.items()}},
+        )
+        print(f"✅ Kim tự tháp {', '.join(f'{k}: {v:,}' for k, v in sizes.items())} kỳ × {n_meters:,} điểm đo trong {time.time() - start:.2f} giây")
+        return cls(dense, pyramid_dir)
+
+    @classmethod
+    def open(cls, dense=None, pyramid_dir=SANLUONG_PYRAMID_DIR, rebuild=True):
+        """Mở kim tự tháp (mmap); dựng lại nếu tensor dày đã thay đổi (rebuild=True)."""
+        dense = dense or DenseStore.open()
+        meta = _load_snapshot_meta(pyramid_dir, dense.fingerprint)
+        if meta is None:
+            if rebuild:
+                print("🔄 Kim tự tháp chưa có hoặc đã cũ, dựng lại...")
+                return cls.build(dense, pyramid_dir)
+            print("⚠️ Kim tự tháp đã cũ so với tensor sản lượng (không dựng lại)")
+        return cls(dense, pyramid_dir, meta)
+
+    def level_window(self, name, start, end):
+        """Đoạn [lo, hi) trên trục kỳ của một mức phủ khoảng thời gian [start, end)."""
+        step = np.timedelta64(PYRAMID_LEVELS[name] * SLOT_MINUTES, "m")
+        origin = self.origins[name].astype("datetime64[ns]")
+        n_periods = self.levels[name].shape[1]
+        lo = int(np.floor((np.datetime64(start, "ns") - origin) / step))
+        hi = int(np.ceil((np.datetime64(end, "ns") - origin) / step))
+        return min(max(lo, 0), n_periods), min(max(hi, 0), n_periods)
+
+    def window(self, ctdl, nmtd, start, end, max_points=DOWNSAMPLE_POINTS):
+        """(DataFrame TIME/CS/MADIEMDO, tên mức) của nhà máy trong [start, end).
+
+        Chọn mức mịn nhất có số kỳ trong cửa sổ <= max_points (mức tuần nếu không mức nào vừa).
+        """
+        m_lo, m_hi = self.dense.meter_range(ctdl, nmtd)
+        for name in PYRAMID_LEVELS:
+            lo, hi = self.level_window(name, start, end)
+            if hi - lo <= max_points:
+                break
+        step = np.timedelta64(PYRAMID_LEVELS[name] * SLOT_MINUTES, "m")
+        first = self.origins[name].astype("datetime64[ns]") + lo * step
+        return _series_frame(self.levels[name][m_lo:m_hi, lo:hi], self.dense.madiemdo(m_lo, m_hi), first, step), name
+
+
+# ==================== 13. BACKEND DUCKDB NGOÀI BỘ NHỚ VÀ CHỌN BACKEND ====================
+# Bộ nhớ đỉnh ước tính mỗi dòng khi dựng kho trong bộ nhớ (SanluongStore.build): các cột đã
+# nạp và lịch (YEAR/MONTH_NUM/DAY_NUM/SLOT), khóa sắp xếp, hoán vị argsort, bản sao khi ghép mảnh
+STORE_BUILD_BYTES_PER_ROW = 64
+# memory_limit tối thiểu của DuckDB (MB): ngân sách rất nhỏ vẫn đủ cho truy vấn một nhà máy
+DUCKDB_MIN_MEMORY_MB = 256
+SANLUONG_BACKENDS = ("auto", "memory", "duckdb")
+
+
+def sanluong_rows(store_dir=SANLUONG_STORE_DIR):
+    """Số dòng của kho sản lượng, lấy từ footer Parquet (không đọc dữ liệu)."""
+    if os.path.isdir(store_dir):
+        return sanluong_dataset(store_dir).count_rows()
+    return sum(pq.read_metadata(path).num_rows for path in _sanluong_inputs(store_dir))
+
+
+def _sql_time(value):
+    """datetime64 -> hằng TIMESTAMP của DuckDB (giá trị do ta tạo, không phải chuỗi người dùng)."""
+    return f"TIMESTAMP '{np.datetime64(value, 'us')}'"
+
+
+class DuckDBStore(SanluongBackend):
+    """Kho sản lượng ngoài bộ nhớ: DuckDB nhúng truy vấn thẳng kho Parquet phân vùng.
+
+    - Điều kiện YEAR/MONTH bỏ qua cả partition; CTDL/NMTD/TIME bỏ qua row group theo min/max
+      (kho đã sắp theo CTDL/NMTD/MADIEMDO/TIME); chỉ các dòng kết quả vào RAM.
+    - DuckDB bị giới hạn `memory_limit`, phần vượt tràn ra thư mục tạm trên đĩa.
+    - Chỉ mục phân cấp (các cặp điểm đo × ngày có dữ liệu) được tính một lần bằng DuckDB,
+      lưu snapshot theo fingerprint kho.
+    Mỗi truy vấn chậm hơn kho mmap nhưng không phụ thuộc dữ liệu có vừa RAM hay không.
+    """
+
+    backend = "duckdb"
+
+    def __init__(self, store_dir=SANLUONG_STORE_DIR, duckdb_dir=SANLUONG_DUCKDB_DIR, memory_mb=MEMORY_BUDGET_MB, threads=N_WORKERS):
+        self.store_dir = str(store_dir)
+        self.duckdb_dir = str(duckdb_dir)
+        self.memory_mb = max(int(memory_mb), DUCKDB_MIN_MEMORY_MB)
+        self.threads = max(1, int(threads))
+        pattern = os.path.join(self.store_dir, "**", "*.parquet").replace("'", "''")
+        self.source = f"read_parquet('{pattern}', hive_partitioning = true)"
+        self._con = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.fingerprint = None
+        self.years = []
+        self.rows = 0
+        self._avail = np.array([], dtype=np.int64)
+        self.index = HierarchyIndex.from_frame(pd.DataFrame())
+
+    def __len__(self):
+        return self.rows
+
+    @property
+    def nbytes(self):
+        """Bộ nhớ thường trú: chỉ mục phân cấp (dữ liệu nằm trên đĩa)."""
+        return int(self._avail.nbytes)
+
+    def _cursor(self):
+        # Mỗi tiến trình (worker fork ra) mở kết nối riêng; cursor riêng cho từng luồng
+        with self._lock:
+            if self._con is None or self._pid != os.getpid():
+                import duckdb
+
+                os.makedirs(os.path.join(self.duckdb_dir, "tmp"), exist_ok=True)
+                self._con = duckdb.connect(
+                    config={
+                        "memory_limit": f"{self.memory_mb}MB",
+                        "threads": self.threads,
+                        "temp_directory": os.path.join(self.duckdb_dir, "tmp"),
+                    }
+                )
+                self._pid = os.getpid()
+            return self._con.cursor()
+
+    def close(self):
+        with self._lock:
+            if self._con is not None and self._pid == os.getpid():
+                self._con.close()
+            self._con = None
+
+    @classmethod
+    def open(cls, store_dir=SANLUONG_STORE_DIR, duckdb_dir=SANLUONG_DUCKDB_DIR, memory_mb=MEMORY_BUDGET_MB, threads=N_WORKERS):
+        """Mở backend DuckDB; dựng lại chỉ mục phân cấp nếu kho sản lượng đã thay đổi."""
+        start = time.time()
+        if not os.path.isdir(store_dir):
+            raise FileNotFoundError(f"Backend DuckDB cần kho phân vùng: {store_dir} (chạy 'python -m src.dataset store')")
+        store = cls(store_dir, duckdb_dir, memory_mb, threads)
+        index_dir = os.path.join(str(duckdb_dir), "index")
+        fingerprint = sanluong_fingerprint(store_dir, duckdb=True)
+        meta = _load_snapshot_meta(index_dir, fingerprint)
+        if meta is None:
+            print("🔄 Chỉ mục DuckDB chưa có hoặc đã cũ, dựng lại...")
+            store._build_index(index_dir, fingerprint)
+            meta = _load_snapshot_meta(index_dir, fingerprint)
+        store._attach_index(index_dir, meta)
+        print(f"✅ Mở backend DuckDB {len(store):,} dòng (ngoài bộ nhớ, giới hạn {store.memory_mb:,} MB) trong {time.time() - start:.2f} giây")
+        return store
+
+    def _build_index(self, index_dir, fingerprint):
+        """Các (CTDL, NMTD, MADIEMDO, ngày) và số giá trị CS trong ngày: một lượt GROUP BY ngoài bộ nhớ."""
+        groups = self._cursor().execute(
+            f"SELECT CTDL, NMTD, MADIEMDO, CAST(TIME AS DATE) AS DAY, count(CS) AS N "
+            f"FROM {self.source} WHERE TIME IS NOT NULL GROUP BY ALL"
+        ).df()
+        rows = self._cursor().execute(f"SELECT count(*) FROM {self.source}").fetchone()[0]
+        categories = {c: sorted(groups[c].dropna().astype(str).unique()) for c in SERIES_KEYS}
+        codes = {c: pd.Categorical(groups[c], categories=categories[c]).codes for c in SERIES_KEYS}
+        valid = groups["N"].to_numpy() > 0
+        avail = availability_keys(
+            *(codes[c][valid] for c in SERIES_KEYS), pd.to_datetime(groups["DAY"]).to_numpy()[valid]
+        )
+        save_frame_snapshot(
+            pd.DataFrame(), index_dir, fingerprint, arrays={"AVAIL": avail},
+            extra_meta={"categories": categories, "years": sanluong_years(self.store_dir), "store_rows": int(rows)},
+        )
+
+    def _attach_index(self, index_dir, meta):
+        arrays = {e["name"]: _load_array(index_dir, e, None) for e in meta["arrays"]}
+        self.fingerprint = meta["fingerprint"]
+        self.years = meta["years"]
+        self.rows = meta["store_rows"]
+        self.categories = {c: pd.Index(meta["categories"][c]) for c in SERIES_KEYS}
+        self._avail = np.asarray(arrays["AVAIL"])
+        self.index = HierarchyIndex(*(self.categories[c] for c in SERIES_KEYS), self._avail, self.years)
+        self._dictionaries = series_dictionaries(self.categories)
+
+    def _where(self, ctdl, nmtd, start=None, end=None, madiemdo=None, dropna=False):
+        """Điều kiện WHERE + tham số; YEAR/MONTH/TIME là hằng số để DuckDB bỏ qua partition/row group."""
+        clauses, params = ["CTDL = ?", "NMTD = ?"], [ctdl, nmtd]
+        if start is not None:
+            start = np.datetime64(start, "us")
+            clauses += [f"YEAR >= {start.astype('datetime64[Y]').astype(int) + 1970}", f"TIME >= {_sql_time(start)}"]
+        if end is not None:
+            end = np.datetime64(end, "us")
+            last = end - np.timedelta64(1, "us")
+            clauses += [f"YEAR <= {last.astype('datetime64[Y]').astype(int) + 1970}", f"TIME < {_sql_time(end)}"]
+            if start is not None and start.astype("datetime64[M]") == last.astype("datetime64[M]"):
+                clauses.append(f"MONTH = {start.astype('datetime64[M]').astype(int) % 12 + 1}")
+        if madiemdo:
+            madiemdo = [madiemdo] if isinstance(madiemdo, str) else list(madiemdo)
+            clauses.append(f"MADIEMDO IN ({', '.join('?' * len(madiemdo))})")
+            params += madiemdo
+        if dropna:
+            clauses.append("CS IS NOT NULL AND NOT isnan(CS)")
+        return " AND ".join(clauses), params
+
+    def query(self, ctdl, nmtd, year, month, day=None, madiemdo=None, columns=("TIME", "CS", "MADIEMDO"), dropna=False):
+        """Các dòng của nhà máy trong một tháng/ngày (tùy chọn một điểm đo), đã theo thời gian."""
+        start, end = period_bounds(int(year), int(month), None if day is None else int(day))
+        if start is None:
+            df = pd.DataFrame({c: [] for c in columns})
+        else:
+            where, params = self._where(ctdl, nmtd, start, end, madiemdo, dropna)
+            df = self._cursor().execute(
+                f"SELECT {', '.join(columns)} FROM {self.source} WHERE {where} ORDER BY TIME, MADIEMDO", params
+            ).df()
+        # Cùng kiểu dữ liệu với SanluongStore.query (kể cả khi rỗng)
+        out = {}
+        for c in columns:
+            if c in SERIES_KEYS:
+                out[c] = pd.Categorical(df[c], categories=self.categories[c])
+            elif c == "TIME":
+                out[c] = df[c].to_numpy().astype("datetime64[ns]")
+            elif c == "CS":
+                out[c] = df[c].to_numpy(dtype=np.float32, na_value=np.nan)
+            else:
+                out[c] = df[c]
+        return pd.DataFrame(out)
+
+    def record_batches(self, plants, madiemdo=None, start=None, end=None, chunk_rows=API_CHUNK_ROWS):
+        """Record batch (SERIES_SCHEMA) của các nhà máy trong [start, end), DuckDB trả dần từng khối."""
+        for ctdl, nmtd in plants:
+            where, params = self._where(ctdl, nmtd, start, end, madiemdo)
+            reader = self._cursor().execute(
+                f"SELECT CTDL, NMTD, MADIEMDO, TIME, CAST(CS AS FLOAT) AS CS FROM {self.source} "
+                f"WHERE {where} ORDER BY TIME, MADIEMDO",
+                params,
+            ).fetch_record_batch(chunk_rows)
+            for batch in reader:
+                if not batch.num_rows:
+                    continue
+                codes = {
+                    c: self.categories[c].get_indexer(batch.column(c).to_numpy(zero_copy_only=False)) for c in SERIES_KEYS
+                }
+                times = batch.column("TIME").cast(pa.timestamp("ns")).to_numpy(zero_copy_only=False)
+                values = batch.column("CS").to_numpy(zero_copy_only=False)
+                yield series_batch(codes, self._dictionaries, times, values)
+
+
+def select_backend(store_dir=SANLUONG_STORE_DIR, budget_mb=MEMORY_BUDGET_MB, backend=SANLUONG_BACKEND):
+    """Chọn backend khi khởi động: 'memory' nếu kho dựng trong bộ nhớ vừa ngân sách, nếu không 'duckdb'.
+
+    Ước tính = số dòng (footer Parquet) × STORE_BUILD_BYTES_PER_ROW. backend khác 'auto' thì dùng đúng
+    backend đó; thiếu duckdb hoặc chưa có kho phân vùng thì vẫn dùng kho trong bộ nhớ (kèm cảnh báo).
+    """
+    if backend not in SANLUONG_BACKENDS:
+        raise ValueError(f"Backend không hợp lệ: {backend} (chọn trong {SANLUONG_BACKENDS})")
+    if backend != "auto":
+        return backend
+    need_mb = sanluong_rows(store_dir) * STORE_BUILD_BYTES_PER_ROW / 1024**2
+    if need_mb <= budget_mb:
+        print(f"   🧮 Kho ước tính {need_mb:,.0f} MB <= ngân sách {budget_mb:,} MB: dùng kho trong bộ nhớ")
+        return "memory"
+    if importlib.util.find_spec("duckdb") is None:
+        print(f"⚠️ Kho ước tính {need_mb:,.0f} MB vượt ngân sách {budget_mb:,} MB nhưng chưa cài duckdb: dùng kho trong bộ nhớ")
+        return "memory"
+    if not os.path.isdir(store_dir):
+        print(f"⚠️ Kho ước tính {need_mb:,.0f} MB vượt ngân sách nhưng chưa có kho phân vùng: dùng kho trong bộ nhớ")
+        return "memory"
+    print(f"   🧮 Kho ước tính {need_mb:,.0f} MB > ngân sách {budget_mb:,} MB: dùng DuckDB ngoài bộ nhớ")
+    return "duckdb"
+
+
+def open_sanluong_backend(store_dir=SANLUONG_STORE_DIR, budget_mb=MEMORY_BUDGET_MB, backend=SANLUONG_BACKEND):
+    """Mở kho sản lượng bằng backend được chọn (xem select_backend)."""
+    if select_backend(store_dir, budget_mb, backend) == "duckdb":
+        return DuckDBStore.open(store_dir, memory_mb=budget_mb)
+    return SanluongStore.open(store_dir)
+
+
+# ==================== CLI ====================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Xử lý dữ liệu sản lượng TĐN")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_convert = sub.add_parser("convert", help="Excel sản lượng năm -> Parquet")
+    p_convert.add_argument("--years", type=int, nargs="+", default=SANLUONG_YEARS)
+    p_convert.add_argument("--raw-dir", default=RAW_DATA_DIR)
+    p_convert.add_argument("--out-dir", default=PROCESSED_DATA_DIR)
+    p_convert.add_argument("--workers", type=int, default=N_WORKERS)
+    p_convert.add_argument("--batch-rows", type=int, default=EXCEL_BATCH_ROWS)
+
+    p_store = sub.add_parser("store", help="sanluong_{year}.parquet -> kho phân vùng YEAR/MONTH")
+    p_store.add_argument("files", nargs="*", help="Mặc định: mọi sanluong_*.parquet trong data/processed")
+    p_store.add_argument("--store-dir", default=SANLUONG_STORE_DIR)
+    p_store.add_argument("--partition-ctdl", action="store_true", help="Phân vùng thêm theo CTDL")
+    p_store.add_argument("--row-group-rows", type=int, default=STORE_ROW_GROUP_ROWS)
+    p_store.add_argument("--no-rollups", action="store_true", help="Không dựng lại tensor, bảng tổng hợp và kim tự tháp")
+
+    p_bcsvh = sub.add_parser("ingest-bcsvh", help="Nạp tăng dần báo cáo BCSVH ngày -> Parquet")
+    p_bcsvh.add_argument("--root", default=BCSVH_ROOT)
+    p_bcsvh.add_argument("--store-dir", default=BCSVH_STORE_DIR)
+    p_bcsvh.add_argument("--manifest", default=BCSVH_MANIFEST)
+    p_bcsvh.add_argument("--workers", type=int, default=N_WORKERS)
+
+    p_norm = sub.add_parser("normalize", help="Chuẩn hóa CS theo 'Lỗi đơn vị' -> sanluong_chuanhoa.parquet")
+    p_norm.add_argument("--ref", default=UNIT_ERROR_REF)
+    p_norm.add_argument("--out", default=SANLUONG_NORMALIZED)
+    p_norm.add_argument("--store-dir", default=SANLUONG_STORE_DIR)
+    p_norm.add_argument("--years", type=int, nargs="+")
+
+    p_sql = sub.add_parser("extract-sql", help="Sao chép bảng DB_DGM -> Parquet theo chunk")
+    p_sql.add_argument("tables", nargs="*", default=SQL_REFERENCE_TABLES)
+    p_sql.add_argument("--out-dir", default=SQL_MIRROR_DIR)
+    p_sql.add_argument("--watermark", help="Cột tăng dần để chỉ lấy dòng mới (vd. ID, THOIGIAN)")
+    p_sql.add_argument("--chunk-rows", type=int, default=SQL_CHUNK_ROWS)
+
+    p_shared = sub.add_parser("shared-store", help="Dựng trước kho cột mmap dùng chung cho models/app.py")
+    p_shared.add_argument("--store-dir", default=SANLUONG_STORE_DIR)
+    p_shared.add_argument("--shared-dir", default=SANLUONG_SHARED_DIR)
+    p_shared.add_argument("--workers", type=int, default=N_WORKERS)
+
+    p_dense = sub.add_parser("dense-store", help="Dựng tensor điểm đo × ngày × khung giờ (.npy, mmap)")
+    p_dense.add_argument("--store-dir", default=SANLUONG_STORE_DIR)
+    p_dense.add_argument("--dense-dir", default=SANLUONG_DENSE_DIR)
+    p_dense.add_argument("--workers", type=int, default=N_WORKERS)
+
+    p_pyr = sub.add_parser("pyramid", help="Dựng các mức gộp 2 giờ/ngày/tuần cho biểu đồ theo khoảng thời gian")
+    p_pyr.add_argument("--store-dir", default=SANLUONG_STORE_DIR)
+    p_pyr.add_argument("--pyramid-dir", default=SANLUONG_PYRAMID_DIR)
+
+    p_roll = sub.add_parser("rollups", help="Dựng bảng tổng hợp ngày/tháng theo điểm đo, nhà máy, công ty")
+    p_roll.add_argument("--store-dir", default=SANLUONG_STORE_DIR)
+    p_roll.add_argument("--out-dir", default=ROLLUP_DIR)
+
+    p_duck = sub.add_parser("duckdb-index", help="Dựng trước chỉ mục cho backend DuckDB ngoài bộ nhớ")
+    p_duck.add_argument("--store-dir", default=SANLUONG_STORE_DIR)
+    p_duck.add_argument("--duckdb-dir", default=SANLUONG_DUCKDB_DIR)
+    p_duck.add_argument("--memory-mb", type=int, default=MEMORY_BUDGET_MB)
+
+    args = parser.parse_args(argv)
+    if args.command == "convert":
+        convert_sanluong_workbooks(args.years, args.raw_dir, args.out_dir, args.workers, args.batch_rows)
+    elif args.command == "store":
+        write_sanluong_store(args.files or None, args.store_dir, args.partition_ctdl, args.row_group_rows)
+        if not args.no_rollups:
+            dense = DenseStore.open(args.store_dir)
+            build_rollups(dense)
+            ResolutionPyramid.build(dense)
+    elif args.command == "ingest-bcsvh":
+        ingest_bcsvh(args.root, args.store_dir, args.manifest, args.workers)
+    elif args.command == "normalize":
+        normalize_sanluong_store(args.ref, args.out, args.store_dir, args.years)
+    elif args.command == "extract-sql":
+        mirror_sql_tables(args.tables, out_dir=args.out_dir, watermark_col=args.watermark, chunk_rows=args.chunk_rows)
+    elif args.command == "shared-store":
+        SanluongStore.open(args.store_dir, args.shared_dir, args.workers)
+    elif args.command == "dense-store":
+        DenseStore.open(args.store_dir, args.dense_dir, args.workers)
+    elif args.command == "rollups":
+        build_rollups(DenseStore.open(args.store_dir), args.out_dir)
+    elif args.command == "pyramid":
+        ResolutionPyramid.build(DenseStore.open(args.store_dir), args.pyramid_dir)
+    elif args.command == "duckdb-index":
+        DuckDBStore.open(args.store_dir, args.duckdb_dir, args.memory_mb).close()
+
+
+if __name__ == "__main__":
+    main()
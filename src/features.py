@@ -0,0 +1,366 @@
+# -*- coding: utf-8 -*-
+import re
+import unicodedata
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+try:
+    from unidecode import unidecode
+except ImportError:  # unidecode là tùy chọn, thay bằng bỏ dấu Unicode
+    unidecode = None
+
+SLOT_MINUTES = 30
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+_SLOT_NS = SLOT_MINUTES * 60 * 1_000_000_000
+
+
+# ==================== 1. CHUYỂN BÁO CÁO BCSVH DẠNG RỘNG -> DẠNG DÀI ====================
+# 48 cột khung giờ của báo cáo BCSVH: '00:30', '01:00', ..., '23:30', '00:00'.
+# Cột thứ k (k = 1..48) là chu kỳ kết thúc lúc ngày + k*30 phút, nên '00:00'
+# (k = 48) tự rơi sang 00:00 của ngày hôm sau.
+BCSVH_SLOT_COLUMNS = [
+    f"{(k * SLOT_MINUTES // 60) % 24:02d}:{k * SLOT_MINUTES % 60:02d}" for k in range(1, SLOTS_PER_DAY + 1)
+]
+# Cột định danh BCSVH -> tên cột tương ứng trong kho sản lượng
+BCSVH_ID_COLUMNS = {"Điện lực": "CTDL", "Nhà máy": "NMTD", "Code": "MADIEMDO"}
+
+
+# Nhãn hiển thị của SLOT (0 -> "00:00", 1 -> "00:30", ..., 47 -> "23:30")
+SLOT_LABELS = [f"{m // 60:02d}:{m % 60:02d}" for m in range(0, 24 * 60, SLOT_MINUTES)]
+
+
+def calendar_codes(times):
+    """YEAR (int16), MONTH (int8), DAY (int8), SLOT (int8, 0–47) từ mảng datetime64.
+
+    Tính thuần bằng số học trên int64 (đổi đơn vị ngày/tháng của numpy),
+    không định dạng chuỗi; SLOT là khung 30 phút chứa thời điểm TIME.
+    """
+    times = np.asarray(times, dtype="datetime64[ns]")
+    days = times.astype("datetime64[D]")
+    months = days.astype("datetime64[M]")
+    month_idx = months.astype(np.int64)
+    year = (month_idx // 12 + 1970).astype(np.int16)
+    month = (month_idx % 12 + 1).astype(np.int8)
+    day = ((days - months).astype(np.int64) + 1).astype(np.int8)
+    ns_of_day = times.view(np.int64) - days.astype("datetime64[ns]").view(np.int64)
+    slot = (ns_of_day // _SLOT_NS).astype(np.int8)
+    return year, month, day, slot
+
+
+def slot_labels(slots):
+    """Gắn nhãn "HH:MM" cho mảng SLOT khi hiển thị (Categorical, không tạo chuỗi mỗi dòng)."""
+    return pd.Categorical.from_codes(np.asarray(slots, dtype=np.int8), SLOT_LABELS)
+
+
+def reshape_bcsvh(df_wide, sort=True, dropna=False):
+    """Chuyển bảng BCSVH (một dòng = một điểm đo - một ngày, 48 cột khung giờ) sang dạng dài.
+
+    Thay cho pd.melt + apply(create_datetime): TIME = Ngày + k*30 phút tính
+    bằng số học trên mảng int64, CS là ma trận (n, 48) được trải phẳng. Cột
+    định danh chỉ được mã hóa category trên n dòng gốc rồi lặp lại mã số.
+
+    Kết quả có cùng schema dạng dài với kho sản lượng:
+    CTDL, NMTD, MADIEMDO (category), TIME, CS (float32), YEAR, MONTH.
+    """
+    missing = [c for c in BCSVH_SLOT_COLUMNS if c not in df_wide.columns]
+    if missing:
+        raise KeyError(f"Thiếu cột khung giờ: {missing[:5]}...")
+
+    n = len(df_wide)
+    values = df_wide[BCSVH_SLOT_COLUMNS].to_numpy(dtype=np.float32)
+    day_ns = pd.to_datetime(df_wide["Ngày"]).to_numpy("datetime64[ns]").view(np.int64)
+    offsets = np.arange(1, SLOTS_PER_DAY + 1, dtype=np.int64) * _SLOT_NS
+    times = (day_ns[:, None] + offsets[None, :]).reshape(-1).view("datetime64[ns]")
+
+    data = {}
+    for src, dst in BCSVH_ID_COLUMNS.items():
+        cat = df_wide[src].astype("category").array
+        data[dst] = pd.Categorical.from_codes(np.repeat(cat.codes, SLOTS_PER_DAY), categories=cat.categories)
+    data["TIME"] = times
+    data["CS"] = values.reshape(-1)
+    data["YEAR"], data["MONTH"] = calendar_codes(times)[:2]
+    out = pd.DataFrame(data)
+
+    if dropna:
+        out = out[out["CS"].notna()]
+    if sort and n:
+        # Cùng thứ tự với kho sản lượng: CTDL/NMTD/MADIEMDO/TIME (category đã sắp xếp)
+        order = np.lexsort(
+            (
+                out["TIME"].to_numpy().view(np.int64),
+                out["MADIEMDO"].cat.codes.to_numpy(),
+                out["NMTD"].cat.codes.to_numpy(),
+                out["CTDL"].cat.codes.to_numpy(),
+            )
+        )
+        out = out.take(order)
+    return out.reset_index(drop=True)
+
+
+# ==================== 2. CHUẨN HÓA LỖI ĐƠN VỊ CÔNG SUẤT ====================
+# Mã 'Lỗi đơn vị' (DanhsachNM_sanluong) -> hệ số nhân CS; mã khác giữ nguyên CS
+UNIT_ERROR_SCALE = {0: 1.0, 1: 100.0, 2: 1e4, 3: 1e5, 4: 1e6, 5: 0.1}
+UNIT_ERROR_COLUMN = "Lỗi đơn vị"
+
+
+def unit_scale_map(df_ref, code_col="MADIEMDO", error_col=UNIT_ERROR_COLUMN):
+    """Hệ số chuẩn hóa cho từng MADIEMDO (Series index = MADIEMDO dạng chuỗi).
+
+    Điểm đo không có mã lỗi cho hệ số NaN (bị loại khi chuẩn hóa, như
+    notebook gốc); MADIEMDO trùng lặp lấy dòng đầu tiên để không nhân bản dữ liệu.
+    """
+    ref = df_ref[[code_col, error_col]].copy()
+    ref[code_col] = ref[code_col].astype(str)
+    ref = ref.drop_duplicates(subset=code_col, keep="first")
+    errors = pd.to_numeric(ref[error_col], errors="coerce")
+    scale = errors.map(UNIT_ERROR_SCALE).where(errors.isna() | errors.isin(list(UNIT_ERROR_SCALE)), 1.0)
+    return pd.Series(scale.to_numpy(dtype=np.float64), index=pd.Index(ref[code_col], name=code_col), name="SCALE")
+
+
+def _factors_for_codes(categories, codes, scale):
+    """Tra hệ số một lần cho mỗi category rồi gather theo mã số (mã -1 -> NaN)."""
+    per_category = scale.reindex(pd.Index(categories).astype(str)).to_numpy(dtype=np.float64)
+    return np.append(per_category, np.nan)[codes]
+
+
+def normalize_cs(df, scale, cs_col="CS", out_col="CS_chuanhoa", code_col="MADIEMDO", drop_unmatched=True):
+    """Thêm cột CS đã chuẩn hóa cho DataFrame: một phép gather-nhân trên cả mảng CS.
+
+    Thay cho merge 'Lỗi đơn vị' vào từng dòng + apply(normalize_cs, axis=1).
+    """
+    codes = df[code_col]
+    if isinstance(codes.dtype, pd.CategoricalDtype):
+        factors = _factors_for_codes(codes.cat.categories, codes.cat.codes.to_numpy(), scale)
+    else:
+        idx, uniques = pd.factorize(codes)
+        factors = _factors_for_codes(uniques, idx, scale)
+
+    cs = df[cs_col].to_numpy(dtype=np.float64, na_value=np.nan)
+    out = df.copy()
+    out[out_col] = (cs * factors).astype(df[cs_col].dtype if df[cs_col].dtype.kind == "f" else np.float64)
+    if drop_unmatched:
+        out = out[~np.isnan(factors)]
+    return out
+
+
+def normalize_cs_batch(batch, scale, cs_col="CS", out_col="CS_chuanhoa", code_col="MADIEMDO", drop_unmatched=True):
+    """Phiên bản cho pyarrow RecordBatch/Table, dùng khi stream Parquet theo batch."""
+    codes = batch.column(code_col)
+    if isinstance(codes, pa.ChunkedArray):
+        codes = codes.combine_chunks()
+    if not pa.types.is_dictionary(codes.type):
+        codes = codes.dictionary_encode()
+    factors = _factors_for_codes(
+        codes.dictionary.to_numpy(zero_copy_only=False),
+        codes.indices.fill_null(-1).to_numpy(zero_copy_only=False),
+        scale,
+    )
+
+    cs_type = batch.schema.field(cs_col).type
+    cs = pc.cast(batch.column(cs_col), pa.float64()).to_numpy(zero_copy_only=False)
+    values = pa.array(cs * factors, type=pa.float64(), from_pandas=True)
+    if pa.types.is_floating(cs_type):
+        values = pc.cast(values, cs_type)
+    out = batch.append_column(out_col, values)
+    if drop_unmatched:
+        out = out.filter(pa.array(~np.isnan(factors)))
+    return out
+
+
+def normalize_parquet(source, out_path, scale, columns=None, **kwargs):
+    """Chuẩn hóa CS theo từng batch từ Parquet nguồn sang một file Parquet mới.
+
+    source là đường dẫn file hoặc pyarrow Dataset; bộ nhớ đỉnh khoảng một batch.
+    """
+    if isinstance(source, (str, bytes)) or hasattr(source, "__fspath__"):
+        batches = pq.ParquetFile(source).iter_batches(columns=columns)
+    else:
+        batches = source.to_batches(columns=columns)
+
+    writer = None
+    n_rows = 0
+    try:
+        for batch in batches:
+            out = normalize_cs_batch(batch, scale, **kwargs)
+            if writer is None:
+                writer = pq.ParquetWriter(out_path, out.schema, compression="snappy")
+            writer.write_table(pa.Table.from_batches([out]) if isinstance(out, pa.RecordBatch) else out)
+            n_rows += out.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+    return n_rows
+
+
+# ==================== 3. CHUẨN HÓA TÊN NHÀ MÁY / CÔNG TY / MÃ ĐIỂM ĐO ====================
+MADIEMDO_PATTERN = re.compile(r"G\d+A\d+S\d+M\d+")
+
+
+def remove_accents(text):
+    """Bỏ dấu tiếng Việt (chỉ bỏ ký tự tổ hợp; 'Đ' giữ nguyên)."""
+    nfkd_form = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in nfkd_form if not unicodedata.combining(c))
+
+
+def _to_ascii(text):
+    if unidecode is not None:
+        return unidecode(text)
+    return remove_accents(text).replace("Đ", "D").replace("đ", "d")
+
+
+def convert_nmtd_to_ten_nm(text):
+    """Tên nhà máy -> TEN_NM (như Multi_sheet.ipynb).
+
+    1. Chuyển về in hoa.
+    2. Loại bỏ dấu tiếng Việt.
+    3. Xóa tiền tố "NMTD" hoặc "MNTD" (sau khi bỏ dấu).
+    4. Thay các ký tự không phải chữ/số bằng '_'.
+    5. Xóa dấu gạch dưới ở đầu hoặc cuối.
+    """
+    if text is None or (isinstance(text, float) and np.isnan(text)):
+        return ""
+    text = _to_ascii(str(text).upper())
+    text = re.sub(r"^(?:NMTD|MNTD)\s*", "", text)
+    text = re.sub(r"[^A-Za-z0-9]+", "_", text)
+    return text.strip("_")
+
+
+def transform_name(name):
+    """Chuẩn hóa tên NMTD như UDF transform_name trong TND.ipynb (giữ nguyên kết quả cũ)."""
+    if name.startswith("NMTĐ "):
+        name = name[len("NMTĐ ") :]
+    name = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode("utf-8")
+    name = re.sub(r"\s+", "_", name.strip())
+    return name.upper()
+
+
+def convert_company(name):
+    """Tên công ty -> mã ĐVQL dạng PC_..., vd 'CTY ĐIỆN LỰC LÀO CAI' -> 'PC_LAOCAI' (như TND.ipynb)."""
+    core_name = name.replace("CTY ĐIỆN LỰC ", "")
+    core_name = remove_accents(core_name).replace(" ", "")
+    return "PC_" + core_name
+
+
+# Bản ghi nhớ của mỗi hàm chuẩn hóa: mỗi tên chỉ xử lý một lần trong cả phiên
+_memoized = {}
+
+
+def _memoize(func):
+    if func not in _memoized:
+        _memoized[func] = lru_cache(maxsize=None)(func)
+    return _memoized[func]
+
+
+def _codes_and_uniques(values):
+    """(mã số, giá trị phân biệt) của Series/mảng; dùng sẵn category nếu có."""
+    if isinstance(getattr(values, "dtype", None), pd.CategoricalDtype):
+        cat = pd.Categorical(values)
+        return cat.codes, cat.categories
+    return pd.factorize(pd.Series(values) if not isinstance(values, pd.Series) else values)
+
+
+def normalize_names(values, func=convert_nmtd_to_ten_nm):
+    """Áp dụng func một lần cho mỗi giá trị phân biệt rồi ánh xạ lại theo mã số.
+
+    Chi phí tỷ lệ với số tên khác nhau chứ không phải số dòng. Kết quả là
+    Series category (nhiều tên gốc có thể gộp về cùng một tên chuẩn); giá
+    trị thiếu giữ là NaN.
+    """
+    codes, uniques = _codes_and_uniques(values)
+    func = _memoize(func)
+    mapped = [func(u) for u in uniques]
+    new_codes, new_uniques = pd.factorize(pd.Series(mapped, dtype=object))
+    codes = np.asarray(codes)
+    result_codes = np.where(codes >= 0, np.append(new_codes, -1)[codes], -1)
+    result = pd.Categorical.from_codes(result_codes, categories=pd.Index(new_uniques))
+    index = values.index if isinstance(values, pd.Series) else None
+    name = values.name if isinstance(values, pd.Series) else None
+    return pd.Series(result, index=index, name=name)
+
+
+def madiemdo_valid_mask(values):
+    """Mask hợp lệ của MADIEMDO dạng G<số>A<số>S<số>M<số> (như str.match), kiểm tra mỗi mã một lần."""
+    codes, uniques = _codes_and_uniques(values)
+    valid = np.array([bool(MADIEMDO_PATTERN.match(str(u))) for u in uniques] + [False], dtype=bool)
+    return valid[np.asarray(codes)]
+
+
+# ==================== 4. THỐNG KÊ THEO KHUNG GIỜ ====================
+TIMESLOT_STATS = ["MIN", "P25", "MEDIAN", "MEAN", "P75", "MAX", "COUNT"]
+_TIMESLOT_QUANTILES = {"MIN": 0.0, "P25": 0.25, "MEDIAN": 0.5, "P75": 0.75, "MAX": 1.0}
+
+
+def nan_quantiles(values, quantiles, axis=0):
+    """Phân vị bỏ qua NaN theo một trục (nội suy tuyến tính như np.nanpercentile).
+
+    np.nanpercentile theo trục gọi hàm Python cho từng lát 1 chiều; ở đây
+    sắp xếp một lần (NaN nằm cuối), đếm số giá trị hợp lệ rồi lấy phần tử
+    bằng take_along_axis cho mọi nhóm cùng lúc.
+    """
+    values = np.moveaxis(np.asarray(values, dtype=np.float32), axis, -1)
+    ordered = np.sort(values, axis=-1)
+    n = (~np.isnan(values)).sum(axis=-1)
+    last = np.maximum(n - 1, 0)[..., None]
+    out = []
+    for q in quantiles:
+        pos = q * last
+        lo = np.floor(pos).astype(np.int64)
+        hi = np.ceil(pos).astype(np.int64)
+        v_lo = np.take_along_axis(ordered, lo, axis=-1)[..., 0]
+        v_hi = np.take_along_axis(ordered, hi, axis=-1)[..., 0]
+        v = v_lo + (v_hi - v_lo) * (pos[..., 0] - lo[..., 0])
+        out.append(np.where(n > 0, v, np.nan).astype(np.float32))
+    return out
+
+
+def timeslot_stats(values, axis=1):
+    """MIN/P25/MEDIAN/MEAN/P75/MAX/COUNT trên trục ngày của khối (..., ngày, 48).
+
+    Ví dụ khối (n_điểm_đo, n_ngày_trong_tháng, 48) -> mỗi thống kê là mảng
+    (n_điểm_đo, 48), tính cho mọi điểm đo và khung giờ trong một lượt.
+    """
+    values = np.asarray(values, dtype=np.float32)
+    stats = dict(zip(_TIMESLOT_QUANTILES, nan_quantiles(values, list(_TIMESLOT_QUANTILES.values()), axis=axis)))
+    count = (~np.isnan(values)).sum(axis=axis)
+    total = np.where(np.isnan(values), 0, values).sum(axis=axis, dtype=np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        stats["MEAN"] = (total / count).astype(np.float32)
+    stats["COUNT"] = count.astype(np.int32)
+    return {name: stats[name] for name in TIMESLOT_STATS}
+
+
+def monthly_timeslot_stats(values, days):
+    """Thống kê khung giờ cho mọi (điểm đo, tháng) của tensor (n_điểm_đo, n_ngày, 48).
+
+    days: trục ngày datetime64[D]. Trả về (các tháng datetime64[M], dict thống
+    kê -> mảng (n_điểm_đo, n_tháng, 48)).
+    """
+    days = np.asarray(days, dtype="datetime64[D]")
+    months = days.astype("datetime64[M]")
+    bounds = np.concatenate([[0], np.flatnonzero(np.diff(months.astype(np.int64))) + 1, [len(days)]]).astype(np.int64)
+    parts = [timeslot_stats(values[:, lo:hi, :], axis=1) for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+    if not parts:
+        return months[:0], {name: np.empty((len(values), 0, SLOTS_PER_DAY)) for name in TIMESLOT_STATS}
+    return months[bounds[:-1]], {name: np.stack([p[name] for p in parts], axis=1) for name in TIMESLOT_STATS}
+
+
+def day_slot_matrix(times, values):
+    """Các dòng (TIME, CS) -> ma trận (ngày, 48) NaN ở khung giờ thiếu, kèm trục ngày.
+
+    Ngày và khung giờ tính theo TIME như calendar_codes (khung k của ngày d là d + k*30').
+    """
+    times = np.asarray(times, dtype="datetime64[ns]")
+    if not len(times):
+        return np.empty((0, SLOTS_PER_DAY), dtype=np.float32), times.astype("datetime64[D]")
+    days = times.astype("datetime64[D]")
+    day0 = days.min()
+    day_idx = (days - day0).astype(np.int64)
+    slot_idx = ((times - days.astype("datetime64[ns]")).view(np.int64) // _SLOT_NS).astype(np.int64)
+    matrix = np.full((day_idx.max() + 1, SLOTS_PER_DAY), np.nan, dtype=np.float32)
+    matrix[day_idx, slot_idx] = np.asarray(values, dtype=np.float32)
+    return matrix, day0 + np.arange(len(matrix))
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+import base64
+
+import numpy as np
+import pandas as pd
+
+try:
+    from dash import Patch
+except ImportError:  # dash chỉ cần cho dashboard (models/app.py), notebook không cần
+    Patch = None
+
+from src.config import DOWNSAMPLE_METHOD, DOWNSAMPLE_POINTS
+
+DOWNSAMPLE_METHODS = ("lttb", "minmax")
+
+
+# ==================== 1. MA TRẬN CHUỖI (trace x thời điểm) ====================
+def series_matrix(df, x="TIME", y="CS", by="MADIEMDO"):
+    """Chuyển dữ liệu dài (by, x, y) thành ma trận (số trace, số thời điểm) trên trục x chung.
+
+    Trả về (labels, xs, Y, present): Y float64 NaN ở ô trống, `present` đánh dấu ô có dòng
+    dữ liệu thật (để phân biệt NaN của CS với ô trace không có thời điểm đó).
+    """
+    trace_codes, labels = pd.factorize(df[by], sort=True)
+    x_codes, xs = pd.factorize(df[x], sort=True)
+    Y = np.full((len(labels), len(xs)), np.nan)
+    present = np.zeros(Y.shape, dtype=bool)
+    keep = trace_codes >= 0
+    Y[trace_codes[keep], x_codes[keep]] = df[y].to_numpy(dtype=np.float64)[keep]
+    present[trace_codes[keep], x_codes[keep]] = True
+    return labels, xs, Y, present
+
+
+def _axis_values(xs):
+    """Trục x dạng float64 (datetime -> ns) để tính diện tích tam giác."""
+    values = np.asarray(xs)
+    if np.issubdtype(values.dtype, np.datetime64):
+        values = values.astype("datetime64[ns]").view(np.int64)
+    return values.astype(np.float64)
+
+
+# ==================== 2. GIẢM ĐIỂM (vector hóa trên mọi trace cùng lúc) ====================
+def lttb_indices(xs, Y, n_out):
+    """Largest-Triangle-Three-Buckets cho mọi hàng của Y cùng lúc; trả về chỉ số cột (T, n_out).
+
+    Vòng lặp chỉ chạy qua các bucket (n_out lần), mỗi bước xử lý đồng thời tất cả trace.
+    Bucket toàn NaN giữ lại một điểm NaN để biểu đồ vẫn đứt đoạn tại chỗ thiếu dữ liệu.
+    """
+    n_traces, n_points = Y.shape
+    if n_points <= n_out or n_out < 3:
+        return np.broadcast_to(np.arange(n_points), (n_traces, n_points)).copy()
+
+    x = _axis_values(xs)
+    filled = np.where(np.isnan(Y), 0.0, Y)
+    counts = (~np.isnan(Y)).astype(np.float64)
+    # n_out - 2 bucket cho các điểm giữa, điểm đầu và cuối luôn được giữ
+    edges = np.linspace(1, n_points - 1, n_out - 1).astype(np.int64)
+    starts = edges[:-1]
+    # Trung bình mỗi bucket (cho vai trò "bucket kế tiếp") tính một lần bằng reduceat
+    with np.errstate(invalid="ignore", divide="ignore"):
+        bucket_y = np.add.reduceat(filled, starts, axis=1) / np.add.reduceat(counts, starts, axis=1)
+    bucket_x = np.add.reduceat(x[: edges[-1]], starts) / np.diff(edges)
+    # Bucket kế tiếp của bucket cuối là điểm cuối cùng
+    next_x = np.append(bucket_x[1:], x[-1])
+    next_y = np.concatenate([bucket_y[:, 1:], Y[:, -1:]], axis=1)
+
+    rows = np.arange(n_traces)
+    out = np.empty((n_traces, n_out), dtype=np.int64)
+    out[:, 0] = 0
+    out[:, -1] = n_points - 1
+    a = np.zeros(n_traces, dtype=np.int64)
+    for i, (lo, hi) in enumerate(zip(starts, edges[1:])):
+        ax, ay = x[a], Y[rows, a]
+        cx, cy = next_x[i], next_y[:, i]
+        area = np.abs((ax - cx)[:, None] * (Y[:, lo:hi] - ay[:, None]) - (ax[:, None] - x[lo:hi]) * (cy - ay)[:, None])
+        a = lo + np.argmax(np.where(np.isnan(area), -1.0, area), axis=1)
+        out[:, i + 1] = a
+    return out
+
+
+def minmax_indices(xs, Y, n_out):
+    """Giữ điểm nhỏ nhất và lớn nhất của mỗi bucket (n_out // 2 bucket) cho mọi trace; (T, k).
+
+    Giữ nguyên đỉnh/đáy của chuỗi, phù hợp khi cần thấy công suất cực đại.
+    """
+    n_traces, n_points = Y.shape
+    n_buckets = max(n_out // 2, 1)
+    if n_points <= n_out:
+        return np.broadcast_to(np.arange(n_points), (n_traces, n_points)).copy()
+
+    edges = np.linspace(0, n_points, n_buckets + 1).astype(np.int64)
+    nan = np.isnan(Y)
+    low = np.where(nan, np.inf, Y)
+    high = np.where(nan, -np.inf, Y)
+    out = np.empty((n_traces, 2 * n_buckets), dtype=np.int64)
+    for i, (lo, hi) in enumerate(zip(edges[:-1], edges[1:])):
+        out[:, 2 * i] = lo + np.argmin(low[:, lo:hi], axis=1)
+        out[:, 2 * i + 1] = lo + np.argmax(high[:, lo:hi], axis=1)
+    # Sắp xếp lại theo thời gian trong từng trace (min có thể đứng sau max trong bucket)
+    return np.sort(out, axis=1)
+
+
+def downsample_frame(df, n_out=DOWNSAMPLE_POINTS, method=DOWNSAMPLE_METHOD, x="TIME", y="CS", by="MADIEMDO"):
+    """Giảm mỗi trace (nhóm `by`) về tối đa khoảng `n_out` điểm trước khi dựng figure.
+
+    Trả về DataFrame dài (by, x, y) sắp theo (by, x); nếu không trace nào vượt ngân sách
+    thì trả lại nguyên `df`.
+    """
+    if method not in DOWNSAMPLE_METHODS:
+        raise ValueError(f"Phương pháp giảm điểm không hợp lệ: {method} (chọn trong {DOWNSAMPLE_METHODS})")
+    if df.empty or not n_out or df[by].value_counts().max() <= n_out:
+        return df
+
+    labels, xs, Y, present = series_matrix(df, x, y, by)
+    pick = lttb_indices if method == "lttb" else minmax_indices
+    idx = pick(xs, Y, n_out)
+    rows = np.broadcast_to(np.arange(len(labels))[:, None], idx.shape)
+    # Bỏ các ô trace không có dòng thật (đệm khi ghép về trục x chung) và điểm trùng
+    keep = present[rows, idx]
+    keep[:, 1:] &= idx[:, 1:] != idx[:, :-1]
+    rows, idx = rows[keep], idx[keep]
+    out = pd.DataFrame({by: labels.take(rows), x: xs.take(idx), y: Y[rows, idx].astype(df[y].dtype)})
+    if isinstance(df[by].dtype, pd.CategoricalDtype):
+        out[by] = out[by].astype(df[by].dtype)
+    return out
+
+
+# ==================== 3. TRACE GỌN (TYPED ARRAY) VÀ CẬP NHẬT TỪNG PHẦN ====================
+def typed_array(values, dtype):
+    """Mảng số -> typed array base64 của plotly.js ({"dtype": "f4", "bdata": ...}), little-endian."""
+    values = np.ascontiguousarray(values, dtype=np.dtype(dtype).newbyteorder("<"))
+    return {"dtype": values.dtype.str[1:], "bdata": base64.b64encode(values.tobytes()).decode("ascii")}
+
+
+def epoch_ms(times):
+    """datetime64 -> số mili-giây từ 1970-01-01 (float64), trục x kiểu 'date' của plotly hiểu trực tiếp."""
+    return np.asarray(times, dtype="datetime64[ns]").view(np.int64) / 1e6
+
+
+def line_traces(df, x="TIME", y="CS", by="MADIEMDO", markers=False, hovertemplate=None):
+    """Mỗi giá trị `by` một trace scattergl; x là epoch ms (f8), y là float32 (f4) dạng typed array.
+
+    Thay cho px.line: không gửi danh sách số/chuỗi ISO dạng JSON, màu lấy theo colorway của template.
+    """
+    codes, labels = pd.factorize(df[by], sort=True)
+    order = np.argsort(codes, kind="stable")
+    codes = codes[order]
+    xs = epoch_ms(df[x].to_numpy()[order])
+    ys = df[y].to_numpy(dtype=np.float32)[order]
+    bounds = np.concatenate([[0], np.flatnonzero(np.diff(codes)) + 1, [len(codes)]])
+    traces = []
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        if hi <= lo or codes[lo] < 0:
+            continue
+        trace = {
+            "type": "scattergl",
+            "mode": "lines+markers" if markers else "lines",
+            "name": str(labels[codes[lo]]),
+            "legendgroup": str(labels[codes[lo]]),
+            "x": typed_array(xs[lo:hi], "f8"),
+            "y": typed_array(ys[lo:hi], "f4"),
+            "line": {"width": 2},
+        }
+        if hovertemplate:
+            trace["hovertemplate"] = hovertemplate
+        traces.append(trace)
+    return traces
+
+
+def patch_figure(fig, layout_keys=("annotations",)):
+    """dash.Patch thay toàn bộ `data` và chỉ các khóa layout thay đổi (vd. 'annotations', 'xaxis.range').
+
+    Template, trục, lề... đã có sẵn phía trình duyệt nên không gửi lại.
+    """
+    full = fig.to_plotly_json() if hasattr(fig, "to_plotly_json") else fig
+    patch = Patch()
+    patch["data"] = full["data"]
+    for key in layout_keys:
+        source, target = full.get("layout", {}), patch["layout"]
+        *parents, last = key.split(".")
+        for part in parents:
+            source, target = source.get(part, {}), target[part]
+        target[last] = source.get(last)
+    return patch
@@ -0,0 +1,261 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+
+from src.config import API_CHUNK_ROWS, ROLLUP_DIR
+from src.dataset import PYRAMID_LEVELS, ROLLUP_LEVELS, SERIES_KEYS, SERIES_SCHEMA, series_batch, series_dictionaries
+from src.features import SLOT_MINUTES
+
+RESOLUTIONS = ("raw",) + tuple(PYRAMID_LEVELS)
+STATS_PERIODS = ("daily", "monthly")
+FORMATS = {
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+    "json": "application/json",
+}
+
+
+class ApiError(ValueError):
+    """Tham số truy vấn không hợp lệ -> HTTP 400."""
+
+
+# ==================== 1. ĐỌC THAM SỐ ====================
+def _list_arg(name, split=False):
+    """Tham số lặp lại (?madiemdo=A&madiemdo=B); split=True cho phép thêm dạng 'A,B'."""
+    values = request.args.getlist(name)
+    if split:
+        values = [v for value in values for v in value.split(",")]
+    return [v.strip() for v in values if v.strip()]
+
+
+def _time_arg(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return np.datetime64(pd.Timestamp(value).tz_localize(None), "ns")
+    except ValueError:
+        raise ApiError(f"Thời điểm '{name}' không hợp lệ: {value}")
+
+
+def _choice_arg(name, choices, default):
+    value = request.args.get(name, default)
+    if value not in choices:
+        raise ApiError(f"'{name}' phải là một trong {list(choices)}, nhận được: {value}")
+    return value
+
+
+def _plants(store):
+    """Các cặp (CTDL, NMTD) được yêu cầu: ?ctdl=&nmtd=... (nhiều nmtd) hoặc mọi nhà máy của CTDL."""
+    ctdl = request.args.get("ctdl")
+    if not ctdl:
+        raise ApiError("Thiếu tham số 'ctdl'")
+    nmtd = _list_arg("nmtd") or store.nmtd_list(ctdl)
+    return [(ctdl, n) for n in nmtd]
+
+
+# ==================== 2. GHI ARROW IPC / PARQUET THEO TỪNG KHỐI ====================
+class _Sink:
+    """File-like chỉ ghi: gom byte writer vừa ghi để generator trả dần về client."""
+
+    closed = False
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+
+    def write(self, data):
+        data = bytes(data)
+        self.parts.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        out = b"".join(self.parts)
+        self.parts = []
+        return out
+
+
+def stream_batches(batches, schema, fmt):
+    """Generator byte: mỗi record batch là một message Arrow IPC hoặc một row group Parquet."""
+    sink = _Sink()
+    if fmt == "parquet":
+        # Mỗi batch là một row group
+        writer = pq.ParquetWriter(sink, schema, compression="snappy")
+    else:
+        writer = pa.ipc.new_stream(sink, schema)
+    try:
+        for batch in batches:
+            writer.write_batch(batch)
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def _respond(batches, schema, fmt, filename):
+    if fmt == "json":
+        table = pa.Table.from_batches(list(batches), schema)
+        df = table.to_pandas()
+        return Response(df.to_json(orient="records", date_format="iso"), mimetype=FORMATS["json"])
+    response = Response(stream_with_context(stream_batches(batches, schema, fmt)), mimetype=FORMATS[fmt])
+    response.headers["Content-Disposition"] = f'attachment; filename="{filename}.{fmt}"'
+    return response
+
+
+# ==================== 3. CHUỖI SẢN LƯỢNG THEO MỨC KIM TỰ THÁP ====================
+# Độ phân giải gốc (res=raw) do chính backend kho trả về: SanluongBackend.record_batches
+def level_batches(pyramid, level, plants, madiemdo=None, start=None, end=None, chunk_rows=API_CHUNK_ROWS):
+    """Record batch của một mức kim tự tháp (CS trung bình mỗi kỳ), bỏ kỳ không có dữ liệu."""
+    dense = pyramid.dense
+    meters = dense.meters
+    dictionaries = series_dictionaries({c: meters[c].categories for c in SERIES_KEYS})
+    values = pyramid.levels[level]
+    step = np.timedelta64(PYRAMID_LEVELS[level] * SLOT_MINUTES, "m").astype("timedelta64[ns]")
+    origin = pyramid.origins[level].astype("datetime64[ns]")
+    span_start, span_end = pyramid.span
+    start = span_start if start is None else start
+    end = span_end if end is None else end
+    for ctdl, nmtd in plants:
+        m_lo, m_hi = dense.meter_range(ctdl, nmtd)
+        idx = np.arange(m_lo, m_hi)
+        if madiemdo:
+            idx = idx[np.isin(meters["MADIEMDO"][m_lo:m_hi].astype(str), madiemdo)]
+        if not len(idx):
+            continue
+        lo, hi = pyramid.level_window(level, start, end)
+        # Mỗi khối tối đa khoảng chunk_rows ô (số điểm đo × số kỳ)
+        span = max(1, chunk_rows // len(idx))
+        for p_lo in range(lo, hi, span):
+            p_hi = min(p_lo + span, hi)
+            block = np.asarray(values[idx, p_lo:p_hi])
+            meter_pos, period = np.nonzero(~np.isnan(block))
+            if not len(period):
+                continue
+            codes = {c: meters[c].codes[idx[meter_pos]] for c in SERIES_KEYS}
+            yield series_batch(codes, dictionaries, origin + (p_lo + period) * step, block[meter_pos, period])
+
+
+# ==================== 4. BẢNG TỔNG HỢP NGÀY / THÁNG ====================
+def stats_filter(level, period, ctdl=None, nmtd=None, madiemdo=None, start=None, end=None):
+    """Biểu thức lọc pyarrow cho bảng {period}_{level}: theo mã và khoảng [start, end)."""
+    expr = pc.scalar(True)
+    for name, values in (("CTDL", ctdl), ("NMTD", nmtd), ("MADIEMDO", madiemdo)):
+        if not values:
+            continue
+        if name not in ROLLUP_LEVELS[level]:
+            raise ApiError(f"Bảng mức '{level}' không có cột {name}")
+        expr &= pc.field(name).isin(values)
+    if period == "daily":
+        if start is not None:
+            expr &= pc.field("DATE") >= pa.scalar(start.astype("datetime64[D]").astype("datetime64[ms]"))
+        if end is not None:
+            expr &= pc.field("DATE") < pa.scalar(end.astype("datetime64[ms]"))
+    else:
+        month = pc.field("YEAR").cast(pa.int32()) * 12 + pc.field("MONTH").cast(pa.int32()) - 1
+        if start is not None:
+            expr &= month >= int(start.astype("datetime64[M]").astype(np.int64)) + 1970 * 12
+        if end is not None:
+            expr &= month < int((end - np.timedelta64(1, "ns")).astype("datetime64[M]").astype(np.int64)) + 1970 * 12 + 1
+    return expr
+
+
+def read_stats(level, period, out_dir=ROLLUP_DIR, **filters):
+    """Đọc bảng tổng hợp đã lọc (pushdown vào Parquet, chỉ đọc row group cần thiết)."""
+    path = os.path.join(out_dir, f"{period}_{level}.parquet")
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Chưa có bảng tổng hợp {period}_{level} (chạy 'python -m src.dataset rollups')")
+    return pq.read_table(path, filters=stats_filter(level, period, **filters))
+
+
+# ==================== 5. BLUEPRINT /api ====================
+def create_api(get_store, get_pyramid=lambda: None, rollup_dir=ROLLUP_DIR, chunk_rows=API_CHUNK_ROWS):
+    """Blueprint /api dùng chung kho mmap (và kim tự tháp) với dashboard.
+
+    `get_store()` / `get_pyramid()` trả về đối tượng đang phục vụ (None khi chưa nạp xong),
+    gọi ở mỗi yêu cầu nên API thấy ngay dữ liệu vừa được nạp nền hoặc dựng lại.
+
+    - GET /api/meta: cây CTDL -> NMTD -> MADIEMDO, các năm, độ phân giải, bảng tổng hợp.
+    - GET /api/series?ctdl=&nmtd=&madiemdo=&start=&end=&res=&format=: chuỗi CS dạng dài
+      (CTDL, NMTD, MADIEMDO, TIME, CS); nhiều nmtd/madiemdo trong một yêu cầu; res=raw
+      (kho gốc) hoặc một mức kim tự tháp (30min, 2h, 1d, 1w).
+    - GET /api/stats?level=&period=&ctdl=&nmtd=&madiemdo=&start=&end=&format=: bảng
+      tổng hợp ngày/tháng (SUM/MEAN/MIN/MAX/COUNT) ở mức meter/plant/company.
+    format=arrow (mặc định, Arrow IPC stream) | parquet | json; arrow/parquet được gửi
+    dần theo từng khối `chunk_rows` dòng. Đọc từ Python:
+    `pyarrow.ipc.open_stream(requests.get(url, stream=True).raw).read_all()`.
+    """
+    api = Blueprint("api", __name__, url_prefix="/api")
+
+    @api.errorhandler(ApiError)
+    def bad_request(e):
+        return jsonify(error=str(e)), 400
+
+    @api.errorhandler(FileNotFoundError)
+    def not_found(e):
+        return jsonify(error=str(e)), 404
+
+    @api.before_request
+    def require_store():
+        # /stats đọc thẳng bảng tổng hợp trên đĩa, không cần kho mmap
+        if request.endpoint == "api.stats":
+            return None
+        store = get_store()
+        if store is None or store.empty:
+            return jsonify(error="Dữ liệu sản lượng chưa sẵn sàng"), 503
+
+    @api.route("/meta")
+    def meta():
+        store, pyramid = get_store(), get_pyramid()
+        tree = {c: {n: store.madiemdo_list(c, n) for n in store.nmtd_list(c)} for c in store.ctdl_list()}
+        available = sorted(os.path.splitext(f)[0] for f in os.listdir(rollup_dir)) if os.path.isdir(rollup_dir) else []
+        return jsonify(
+            plants=tree,
+            years=store.years,
+            resolutions=list(RESOLUTIONS if pyramid is not None else RESOLUTIONS[:1]),
+            stats=[name for name in available if name.split("_", 1)[0] in STATS_PERIODS],
+            fingerprint=store.fingerprint,
+        )
+
+    @api.route("/series")
+    def series():
+        fmt = _choice_arg("format", FORMATS, "arrow")
+        res = _choice_arg("res", RESOLUTIONS, "raw")
+        store, pyramid = get_store(), get_pyramid()
+        plants = _plants(store)
+        madiemdo = _list_arg("madiemdo", split=True)
+        start, end = _time_arg("start"), _time_arg("end")
+        if res == "raw":
+            batches = store.record_batches(plants, madiemdo, start, end, chunk_rows)
+        elif pyramid is None:
+            raise ApiError("Chưa có kim tự tháp đa độ phân giải, chỉ hỗ trợ res=raw")
+        else:
+            batches = level_batches(pyramid, res, plants, madiemdo, start, end, chunk_rows)
+        return _respond(batches, SERIES_SCHEMA, fmt, f"series_{res}")
+
+    @api.route("/stats")
+    def stats():
+        fmt = _choice_arg("format", FORMATS, "arrow")
+        level = _choice_arg("level", ROLLUP_LEVELS, "plant")
+        period = _choice_arg("period", STATS_PERIODS, "daily")
+        table = read_stats(
+            level, period, rollup_dir,
+            ctdl=_list_arg("ctdl"), nmtd=_list_arg("nmtd"), madiemdo=_list_arg("madiemdo", split=True),
+            start=_time_arg("start"), end=_time_arg("end"),
+        )
+        return _respond(table.to_batches(max_chunksize=chunk_rows), table.schema, fmt, f"{period}_{level}")
+
+    return api
@@ -0,0 +1,102 @@
+from collections import OrderedDict
+import threading
+
+import numpy as np
+import pandas as pd
+
+
+# ==================== 1. ƯỚC LƯỢNG KÍCH THƯỚC ====================
+def estimate_nbytes(value):
+    """Ước lượng số byte của kết quả (DataFrame, mảng numpy, tuple/list/dict lồng nhau)."""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        usage = value.memory_usage(deep=True)
+        return int(usage.sum() if isinstance(usage, pd.Series) else usage)
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_nbytes(v) for v in value)
+    if isinstance(value, dict):
+        return sum(estimate_nbytes(v) for v in value.values())
+    if isinstance(value, str):
+        return len(value)
+    return 64  # Số, None, đối tượng nhỏ: tính một khoản cố định
+
+
+# ==================== 2. CACHE LRU GIỚI HẠN THEO BYTE ====================
+class LRUCache:
+    """Cache LRU giới hạn tổng số byte, an toàn khi nhiều luồng gọi đồng thời.
+
+    Khóa nên gồm phiên bản dữ liệu (fingerprint kho); gọi `bind(version)` mỗi lần truy vấn,
+    cache tự xóa toàn bộ khi phiên bản đổi (dữ liệu mới được nạp).
+    """
+
+    def __init__(self, max_bytes, sizeof=estimate_nbytes):
+        self.max_bytes = int(max_bytes)
+        self.sizeof = sizeof
+        self.version = None
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items = OrderedDict()  # key -> (value, nbytes), cuối = mới dùng nhất
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def bind(self, version):
+        """Gắn cache với phiên bản dữ liệu; xóa sạch nếu phiên bản khác lần trước."""
+        with self._lock:
+            if version != self.version:
+                self._clear()
+                self.version = version
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, value, nbytes=None):
+        """Lưu kết quả; bỏ qua nếu một mình nó đã vượt ngân sách byte."""
+        nbytes = self.sizeof(value) if nbytes is None else int(nbytes)
+        if nbytes > self.max_bytes:
+            return False
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[1]
+            self._items[key] = (value, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted) = self._items.popitem(last=False)
+                self.nbytes -= evicted
+                self.evictions += 1
+        return True
+
+    def invalidate(self):
+        with self._lock:
+            self._clear()
+
+    def _clear(self):
+        self._items.clear()
+        self.nbytes = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._items),
+            "nbytes": self.nbytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
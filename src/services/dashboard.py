@@ -0,0 +1,105 @@
+import argparse
+import gc
+import importlib.util
+import os
+import sys
+import time
+
+from src.config import DASH_HOST, DASH_PORT, DASH_THREADS, DASH_WORKERS, MODELS_DIR
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:  # gunicorn không chạy trên Windows -> waitress / server Flask
+    BaseApplication = None
+
+try:
+    import waitress
+except ImportError:
+    waitress = None
+
+
+# ==================== 1. NẠP ỨNG DỤNG MỘT LẦN TRONG TIẾN TRÌNH MASTER ====================
+def load_app():
+    """Import models/app.py, chờ nạp xong kho mmap, kim tự tháp, bảng tổng hợp rồi đóng băng heap.
+
+    gc.freeze() chuyển mọi đối tượng đã nạp sang thế hệ vĩnh viễn: các worker fork ra sau đó
+    không bị GC chạm vào (ghi refcount/header) nên các trang bộ nhớ vẫn dùng chung copy-on-write.
+    """
+    start = time.time()
+    spec = importlib.util.spec_from_file_location("models.app", MODELS_DIR / "app.py")
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    # Chờ luồng nạp nền xong trước khi fork: worker chỉ kế thừa dữ liệu, không kế thừa luồng
+    module.loader.wait()
+    # Kết nối SQLite của diskcache không được dùng chung qua fork: đóng ở master, worker tự mở lại
+    for cache in (module.job_cache, module.slot_cache):
+        if cache is not None:
+            cache.close()
+    gc.collect()
+    gc.freeze()
+    print(f"✅ Đã nạp dashboard trong {time.time() - start:.2f} giây (pid {os.getpid()}), sẵn sàng: {module.data_ready}")
+    return module
+
+
+# ==================== 2. SERVER WSGI ====================
+if BaseApplication is not None:
+
+    class PreloadedApplication(BaseApplication):
+        """gunicorn dùng app WSGI đã nạp sẵn ở master (tương đương --preload), fork N worker."""
+
+        def __init__(self, application, options):
+            self.application = application
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return self.application
+
+
+def serve(host=DASH_HOST, port=DASH_PORT, workers=DASH_WORKERS, threads=DASH_THREADS, timeout=120):
+    """Chạy dashboard production: gunicorn (preload + fork) nếu có, nếu không thì waitress / Flask."""
+    module = load_app()
+    server = module.server
+    if BaseApplication is not None:
+        print(f"🚀 gunicorn {workers} worker × {threads} luồng tại http://{host}:{port}/ (kiểm tra: /healthz, /readyz)")
+        options = {
+            "bind": f"{host}:{port}",
+            "workers": workers,
+            "threads": threads,
+            "worker_class": "gthread",
+            "timeout": timeout,
+            "preload_app": True,
+        }
+        PreloadedApplication(server, options).run()
+    elif waitress is not None:
+        print(f"🚀 waitress 1 tiến trình × {threads} luồng tại http://{host}:{port}/ (kiểm tra: /healthz, /readyz)")
+        waitress.serve(server, host=host, port=port, threads=threads)
+    else:
+        print("⚠️ Chưa cài gunicorn/waitress: dùng server Flask một tiến trình (không debug)")
+        module.app.run(host=host, port=port, debug=False, threaded=True)
+
+
+# ==================== CLI ====================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Chạy dashboard sản lượng TĐN")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_serve = sub.add_parser("serve", help="Chạy production: nạp dữ liệu một lần rồi fork các worker")
+    p_serve.add_argument("--host", default=DASH_HOST)
+    p_serve.add_argument("--port", type=int, default=DASH_PORT)
+    p_serve.add_argument("--workers", type=int, default=DASH_WORKERS)
+    p_serve.add_argument("--threads", type=int, default=DASH_THREADS)
+    p_serve.add_argument("--timeout", type=int, default=120)
+
+    args = parser.parse_args(argv)
+    if args.command == "serve":
+        serve(args.host, args.port, args.workers, args.threads, args.timeout)
+
+
+if __name__ == "__main__":
+    main()
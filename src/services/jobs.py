@@ -0,0 +1,68 @@
+import os
+import time
+from contextlib import contextmanager
+
+try:
+    import psutil
+except ImportError:  # psutil đi kèm dash[diskcache]; thiếu thì không thu hồi được slot của tiến trình đã chết
+    psutil = None
+
+
+def _alive(pid):
+    if psutil is None:
+        return True
+    return psutil.pid_exists(pid)
+
+
+# ==================== GIỚI HẠN SỐ TÁC VỤ NỀN ĐỒNG THỜI ====================
+class JobSlots:
+    """Giới hạn số tác vụ nền chạy cùng lúc giữa mọi tiến trình/worker, dùng chung một diskcache.
+
+    Mỗi slot là một khóa `<name>:<i>` giữ pid của tiến trình đang dùng. Tác vụ bị hủy giữa chừng
+    (Dash kill tiến trình của yêu cầu đã bị thay thế) không kịp trả slot: slot có pid không còn
+    sống được thu hồi ngay, và mọi slot tự hết hạn sau `expire` giây.
+    """
+
+    def __init__(self, cache, name, limit, expire=600, poll=0.05):
+        self.cache = cache
+        self.name = name
+        self.limit = max(1, int(limit))
+        self.expire = expire
+        self.poll = poll
+
+    def _keys(self):
+        return [f"{self.name}:{i}" for i in range(self.limit)]
+
+    def _try_acquire(self, pid):
+        for key in self._keys():
+            if self.cache.add(key, pid, expire=self.expire):
+                return key
+            owner = self.cache.get(key)
+            if owner is not None and owner != pid and not _alive(owner):
+                with self.cache.transact():
+                    if self.cache.get(key) == owner:
+                        self.cache.delete(key)
+                if self.cache.add(key, pid, expire=self.expire):
+                    return key
+        return None
+
+    @contextmanager
+    def acquire(self, on_wait=None):
+        """Chờ tới khi có slot trống; gọi `on_wait()` một lần nếu phải xếp hàng."""
+        pid = os.getpid()
+        key = self._try_acquire(pid)
+        if key is None and on_wait is not None:
+            on_wait()
+        while key is None:
+            time.sleep(self.poll)
+            key = self._try_acquire(pid)
+        try:
+            yield key
+        finally:
+            with self.cache.transact():
+                if self.cache.get(key) == pid:
+                    self.cache.delete(key)
+
+    def busy(self):
+        """Số slot đang được giữ."""
+        return sum(self.cache.get(key) is not None for key in self._keys())
@@ -0,0 +1,70 @@
+import threading
+import time
+
+
+# ==================== NẠP DỮ LIỆU TRONG LUỒNG NỀN ====================
+class BackgroundLoader:
+    """Chạy lần lượt các bước nạp dữ liệu trong một luồng nền để server phục vụ được ngay.
+
+    Mỗi bước là (tên, hàm); hàm tự gán kết quả (kho, bảng tổng hợp...) cho nơi dùng. Lỗi của
+    một bước được ghi lại và không chặn các bước sau. `version` tăng sau mỗi bước để giao diện
+    biết có dữ liệu mới (vd. cập nhật danh sách dropdown).
+    """
+
+    def __init__(self, steps, name="data-loader"):
+        self.steps = list(steps)
+        self.name = name
+        self.stage = None
+        self.completed = []
+        self.errors = {}
+        self.version = 0
+        self.started_at = None
+        self.finished_at = None
+        self._done = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self.started_at = time.time()
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            for name, step in self.steps:
+                self.stage = name
+                start = time.time()
+                try:
+                    step()
+                except Exception as e:  # Bắt cả MemoryError và các lỗi khác
+                    print(f"❌ Lỗi khi nạp '{name}': {e}")
+                    self.errors[name] = str(e)
+                else:
+                    print(f"   ⏱️ Nạp '{name}' xong trong {time.time() - start:.2f} giây")
+                self.completed.append(name)
+                self.version += 1
+        finally:
+            self.stage = None
+            self.finished_at = time.time()
+            self._done.set()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """Chờ nạp xong (vd. trước khi fork các worker); True nếu đã xong."""
+        self.start()
+        return self._done.wait(timeout)
+
+    def state(self):
+        elapsed = (self.finished_at or time.time()) - self.started_at if self.started_at else 0.0
+        return {
+            "done": self.done,
+            "stage": self.stage,
+            "completed": list(self.completed),
+            "errors": dict(self.errors),
+            "version": self.version,
+            "elapsed": round(elapsed, 3),
+        }
@@ -0,0 +1,42 @@
+import sqlite3
+
+import pyarrow.parquet as pq
+
+from src.dataset import ConnectionPool, _load_watermark, extract_to_parquet
+
+
+def _insert(db_path, start, stop):
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS HT_TINH (ID INTEGER PRIMARY KEY, MA_TINH TEXT, DIEN_TICH REAL)")
+        conn.executemany(
+            "INSERT INTO HT_TINH VALUES (?, ?, ?)", [(i, f"T{i:02d}", i * 1.5) for i in range(start, stop)]
+        )
+
+
+def test_extract_to_parquet_chunks_and_watermark(tmp_path):
+    db_path = str(tmp_path / "dgm.sqlite")
+    out_dir = tmp_path / "sql"
+    _insert(db_path, 1, 11)
+    pool = ConnectionPool(lambda: sqlite3.connect(db_path), size=2)
+    try:
+        # Lần đầu: toàn bộ 10 dòng, mỗi fetchmany(3) là một row group
+        path, n_rows = extract_to_parquet(pool, "HT_TINH", out_dir, watermark_col="ID", chunk_rows=3)
+        meta = pq.read_metadata(path)
+        assert n_rows == 10
+        assert meta.num_rows == 10
+        assert meta.num_row_groups == 4
+        assert _load_watermark(out_dir / "HT_TINH" / "_watermark.json") == {"column": "ID", "value": 10, "type": "int"}
+
+        # Lần sau: chỉ các dòng mới (ID > 10) vào một file part mới
+        _insert(db_path, 11, 16)
+        path2, n_rows2 = extract_to_parquet(pool, "HT_TINH", out_dir, watermark_col="ID", chunk_rows=3)
+        assert path2 != path
+        assert n_rows2 == 5
+        assert pq.read_table(path2).column("ID").to_pylist() == list(range(11, 16))
+        assert _load_watermark(out_dir / "HT_TINH" / "_watermark.json")["value"] == 15
+
+        # Không có dòng mới: không ghi file, watermark giữ nguyên
+        assert extract_to_parquet(pool, "HT_TINH", out_dir, watermark_col="ID", chunk_rows=3) == (None, 0)
+        assert pq.read_table(out_dir / "HT_TINH", columns=["ID"]).num_rows == 15
+    finally:
+        pool.close()